@@ -0,0 +1,357 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Benchmarks of each stage of the pipeline on the checked-in corpus.
+
+Each stage is timed (best of a number of runs) and memory-profiled
+(tracemalloc peak, in a separate run) and compared against stored
+baselines. tracemalloc only sees allocations by Python, so memory held
+by lxml is not counted. A stage regresses when its time or its peak
+grows by more than both a relative threshold and an absolute floor, so
+that stages which take a few milliseconds or allocate little in Python
+do not fail on noise. Run from the source directory:
+
+	python benchmark.py                 # compare against the baselines
+	python benchmark.py --update        # record new baselines
+	python benchmark.py -s tex_compile  # only some stages
+
+The exit status is 1 if any stage regressed.
+"""
+
+import argparse
+import collections
+import gc
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from lxml import etree
+
+
+DATA_DIR = '../data'
+BASELINE_FILENAME = os.path.join(DATA_DIR, 'benchmarks', 'baseline.json')
+HTML_FILENAMES = [
+	os.path.join(DATA_DIR, 'mamre.cantillation', 'c0%d.htm' % i)
+	for i in range(1, 6)]
+XML_FILENAME = os.path.join(DATA_DIR, 'xml_torah', 'torah.xml')
+
+# Measurements of a stage: best wall time in seconds, tracemalloc peak
+# in bytes.
+Result = collections.namedtuple('Result', ['seconds', 'peak_bytes'])
+
+# Smallest slowdown of a stage, in seconds, counted as a regression.
+# Scheduler noise alone moves stages of about 10 ms by several ms.
+TIME_FLOOR_SECONDS = 0.01
+
+# Smallest growth of a tracemalloc peak, in bytes, counted as a
+# regression.
+MEMORY_FLOOR_BYTES = 64 * 1024
+
+
+def format_bytes(n):
+	"""Formats a number of bytes in B, KB or MB, whichever reads best."""
+	if n < 1e4:
+		return '%d B' % n
+	if n < 1e6:
+		return '%.1f KB' % (n / 1e3)
+	return '%.2f MB' % (n / 1e6)
+
+
+class Stage(object):
+	"""A benchmarked step of the pipeline.
+
+	setup() prepares the inputs of run(), and is not measured.
+	"""
+
+	def __init__(self, name, run, setup=None):
+		self.name = name
+		self.run = run
+		self.setup = setup
+
+	def measure(self, repeat=5, min_seconds=0.5):
+		"""Returns the Result of the stage.
+
+		Args:
+			repeat: minimum number of timed runs; the best is kept.
+			min_seconds: short stages are run until they took at least
+				this long in total, which steadies their best time.
+		"""
+		args = self.setup() if self.setup else ()
+		best = None
+		total = 0.0
+		n_runs = 0
+		while n_runs < repeat or total < min_seconds:
+			gc.collect()
+			start = time.perf_counter()
+			self.run(*args)
+			elapsed = time.perf_counter() - start
+			total += elapsed
+			n_runs += 1
+			if best is None or elapsed < best:
+				best = elapsed
+
+		gc.collect()
+		tracemalloc.start()
+		try:
+			self.run(*args)
+			_, peak = tracemalloc.get_traced_memory()
+		finally:
+			tracemalloc.stop()
+		# Microseconds are well below the noise of the timings.
+		return Result(round(best, 6), peak)
+
+
+def _parse_xml():
+	from parse_xml_torah import XmlTorahParser
+	return XmlTorahParser().parse_xml_filename(XML_FILENAME)
+
+
+def _torah():
+	return (_parse_xml(),)
+
+
+def _torah_xml_elt():
+	return (_parse_xml().to_xml_elt(),)
+
+
+def _parse_html(fname):
+	from parse_mm import MechonMamreParser
+	return MechonMamreParser().parse_sefer_filename(fname)
+
+
+def _parse_html_lxml(fname):
+	from parse_mm import MechonMamreParser
+	parser = MechonMamreParser(backend=MechonMamreParser.LXML)
+	return parser.parse_sefer_filename(fname)
+
+
+def _parse_xml_streaming():
+	from parse_xml_torah import XmlTorahParser
+	return XmlTorahParser(streaming=True).parse_xml_filename(XML_FILENAME)
+
+
+def _serialize(xml_elt):
+	return etree.tostring(
+		xml_elt, pretty_print=True, xml_declaration=True, encoding='utf-8')
+
+
+def _write_xml(torah):
+	from write_xml_torah import XmlTorahWriter
+	XmlTorahWriter().write(torah, io.BytesIO())
+
+
+def _compile_tex(torah):
+	from kavlar import KavlarCompiler
+	return KavlarCompiler.default_instance().compile_torah_model(torah)
+
+
+def _stream_tex(torah):
+	from kavlar import KavlarCompiler
+	compiler = KavlarCompiler.default_instance()
+	compiler.stream_torah_model(torah, io.StringIO())
+
+
+def _layout_setup():
+	import layout
+	from kavlar import KavlarConfig
+	engine = layout.LayoutEngine.from_config(KavlarConfig.default_config())
+	return engine, _parse_xml()
+
+
+def _build_paragraphs(engine, torah):
+	return engine.builder.paragraphs_for_torah(torah)
+
+
+def _layout_torah(engine, torah):
+	return engine.layout_torah(torah)
+
+
+def _relayout_setup():
+	from incremental import IncrementalLayout
+	from kavlar import KavlarConfig
+	from torah_model import PasukFragment, TextFragment
+	torah = _parse_xml()
+	incremental = IncrementalLayout.from_config(
+		KavlarConfig.default_config())
+	incremental.layout_torah(torah)
+	fragment = next(
+		e for e in torah.stream[1].stream[19].stream
+		if type(e) == PasukFragment)
+	text = [e for e in fragment.stream if type(e) == TextFragment][-1]
+	return incremental, torah, text
+
+
+def _relayout(incremental, torah, text):
+	# An edit and its undo.
+	text.text += u' אבג'
+	incremental.relayout(torah)
+	text.text = text.text[:-4]
+	incremental.relayout(torah)
+
+
+def default_stages():
+	"""The benchmarked stages, in pipeline order."""
+	stages = []
+	for i, fname in enumerate(HTML_FILENAMES):
+		stages.append(Stage(
+			'html_parse_%d' % (i + 1), _parse_html, lambda f=fname: (f,)))
+		stages.append(Stage(
+			'html_parse_lxml_%d' % (i + 1), _parse_html_lxml,
+			lambda f=fname: (f,)))
+	stages.extend([
+		Stage('xml_parse', _parse_xml),
+		Stage('xml_parse_streaming', _parse_xml_streaming),
+		Stage('xml_build', lambda torah: torah.to_xml_elt(), _torah),
+		Stage('xml_serialize', _serialize, _torah_xml_elt),
+		Stage('xml_write', _write_xml, _torah),
+		Stage('tex_compile', _compile_tex, _torah),
+		Stage('tex_stream', _stream_tex, _torah),
+		Stage('layout_paragraphs', _build_paragraphs, _layout_setup),
+		Stage('layout_torah', _layout_torah, _layout_setup),
+		Stage('layout_relayout', _relayout, _relayout_setup),
+	])
+	return stages
+
+
+def load_baselines(fname):
+	"""Returns the dict of stored Results by stage name."""
+	if not os.path.exists(fname):
+		return {}
+	with open(fname, 'r', encoding='utf-8') as f:
+		data = json.load(f)
+	return dict((name, Result(**r)) for name, r in data.items())
+
+
+def save_baselines(fname, results):
+	dirname = os.path.dirname(fname)
+	if dirname and not os.path.isdir(dirname):
+		os.makedirs(dirname)
+	data = dict((name, r._asdict()) for name, r in results.items())
+	with open(fname, 'w', encoding='utf-8') as f:
+		json.dump(data, f, indent=2, sort_keys=True)
+		f.write('\n')
+
+
+def regressions(result, baseline, time_threshold, memory_threshold,
+				memory_floor=MEMORY_FLOOR_BYTES,
+				time_floor=TIME_FLOOR_SECONDS):
+	"""Returns descriptions of how result regressed from baseline.
+
+	Args:
+		result, baseline: Results of a stage.
+		time_threshold, memory_threshold: allowed relative increases,
+			e.g. 0.25 for 25%.
+		memory_floor: smallest increase of the peak in bytes which is a
+			regression, whatever the relative increase.
+		time_floor: smallest slowdown in seconds which is a regression,
+			whatever the relative slowdown.
+	"""
+	ret = []
+	slowdown = result.seconds - baseline.seconds
+	if (slowdown > baseline.seconds * time_threshold and
+			slowdown > time_floor):
+		ret.append('time %.1f ms > %.1f ms' % (
+			1e3 * result.seconds, 1e3 * baseline.seconds))
+	growth = result.peak_bytes - baseline.peak_bytes
+	if (growth > baseline.peak_bytes * memory_threshold and
+			growth > memory_floor):
+		ret.append('peak %s > %s' % (
+			format_bytes(result.peak_bytes),
+			format_bytes(baseline.peak_bytes)))
+	return ret
+
+
+def run(stages, baselines, repeat=5, time_threshold=0.5,
+		memory_threshold=0.1, out=sys.stdout, min_seconds=0.5,
+		memory_floor=MEMORY_FLOOR_BYTES, time_floor=TIME_FLOOR_SECONDS):
+	"""Measures stages and compares them against baselines.
+
+	Returns:
+		The pair (dict of Results by stage name, list of names of the
+		stages which regressed).
+	"""
+	results = {}
+	failed = []
+	for stage in stages:
+		result = stage.measure(repeat, min_seconds)
+		results[stage.name] = result
+		line = '%-22s %9.1f ms %10s' % (
+			stage.name, 1e3 * result.seconds,
+			format_bytes(result.peak_bytes))
+		baseline = baselines.get(stage.name)
+		if baseline is None:
+			line += '  (no baseline)'
+		else:
+			problems = regressions(
+				result, baseline, time_threshold, memory_threshold,
+				memory_floor, time_floor)
+			if problems:
+				failed.append(stage.name)
+				line += '  REGRESSED: ' + '; '.join(problems)
+			elif baseline.seconds > 0:
+				line += '  ok (%+.0f%%)' % (
+					100.0 * (result.seconds / baseline.seconds - 1))
+			else:
+				line += '  ok'
+		print(line, file=out)
+	return results, failed
+
+
+def main():
+	parser = argparse.ArgumentParser(
+		description='Benchmarks the stages of the pipeline.')
+	parser.add_argument(
+		'-s', '--stages', nargs='*', default=None,
+		help='Names of the stages to run; all by default.')
+	parser.add_argument(
+		'-b', '--baseline', default=BASELINE_FILENAME,
+		help='JSON file of baselines.')
+	parser.add_argument(
+		'-u', '--update', action='store_true',
+		help='Record the results as the new baselines.')
+	parser.add_argument(
+		'-r', '--repeat', type=int, default=5,
+		help='Timed runs per stage; the best is kept.')
+	parser.add_argument(
+		'-t', '--time_threshold', type=float, default=0.5,
+		help='Allowed relative slowdown; timings are noisy.')
+	parser.add_argument(
+		'-T', '--time_floor', type=float, default=TIME_FLOOR_SECONDS,
+		help='Smallest slowdown in seconds which counts as a regression.')
+	parser.add_argument(
+		'-m', '--memory_threshold', type=float, default=0.1,
+		help='Allowed relative increase of peak memory.')
+	parser.add_argument(
+		'-f', '--memory_floor', type=int, default=MEMORY_FLOOR_BYTES,
+		help='Smallest increase of peak memory in bytes which counts as '
+		'a regression.')
+	args = parser.parse_args()
+
+	stages = default_stages()
+	if args.stages:
+		unknown = set(args.stages) - set(s.name for s in stages)
+		if unknown:
+			parser.error('unknown stages: %s' % ', '.join(sorted(unknown)))
+		stages = [s for s in stages if s.name in args.stages]
+
+	baselines = load_baselines(args.baseline)
+	results, failed = run(
+		stages, {} if args.update else baselines, args.repeat,
+		args.time_threshold, args.memory_threshold,
+		memory_floor=args.memory_floor, time_floor=args.time_floor)
+	if args.update:
+		baselines.update(results)
+		save_baselines(args.baseline, baselines)
+		print('Baselines written to', args.baseline)
+		return 0
+	if failed:
+		print('%d stages regressed: %s' % (len(failed), ', '.join(failed)))
+		return 1
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,254 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Column layout anchored at the traditional fixed column tops.
+
+Six points in the Torah (*biya shemo*) must stand at the top of a column.
+They split the text into segments which can be laid out independently of
+each other: each segment begins a fresh column, and is balanced so that it
+fills a whole number of columns. Segments are solved concurrently in a
+process pool and stitched together with global column numbering.
+"""
+
+import collections
+import heapq
+import layout
+import normalize
+import verse_index
+
+from concurrent.futures import ProcessPoolExecutor
+from layout import Layout, LayoutEngine
+
+
+# The biya shemo column tops, by (sefer name, perek index, pasuk index,
+# consonantal skeleton of the first word of the column). Words joined by
+# a maqaf may or may not be split, so the skeleton is matched as a prefix.
+BIYA_SHEMO = (
+	(u'בראשית', 0, 0, u'בראשית'),
+	(u'בראשית', 48, 7, u'יהודה'),
+	(u'שמות', 13, 27, u'הבאים'),
+	(u'שמות', 33, 10, u'שמר'),
+	(u'במדבר', 23, 4, u'מה'),
+	(u'דברים', 30, 27, u'ואעידה'),
+)
+
+# A word which must begin a column.
+Anchor = collections.namedtuple('Anchor', ['pasuk_id', 'letters'])
+
+
+def find_anchors(torah, column_tops=BIYA_SHEMO, index=None):
+	"""Returns the Anchors of the column tops present in this Torah.
+
+	Args:
+		torah: a Torah model.
+		column_tops: tuples of (sefer name, perek index, pasuk index,
+			consonantal skeleton of the anchored word).
+		index: optional verse_index.VerseIndex of torah.
+	"""
+	if index is None:
+		index = verse_index.VerseIndex(torah)
+	found = []
+	for sefer_name, perek_idx, pasuk_idx, letters in column_tops:
+		sefer_idx = index.sefer_idx(sefer_name)
+		if sefer_idx is None:
+			continue
+		verse = index.find((sefer_idx, perek_idx, pasuk_idx))
+		if verse is not None:
+			found.append((verse.position, Anchor(verse.pasuk_id, letters)))
+	return [anchor for _, anchor in sorted(found)]
+
+
+def split_segments(paragraphs, anchors):
+	"""Splits the paragraphs before each anchored word.
+
+	The anchored word is the first word of the pasuk whose skeleton
+	begins with the anchor's.
+
+	Returns:
+		A list of segments, each a list of Paragraphs. Every segment
+		but the first begins with an anchored word.
+	"""
+	by_pasuk = dict((a.pasuk_id, a.letters) for a in anchors)
+	segments = [[]]
+	for paragraph in paragraphs:
+		i = 0
+		while i < len(paragraph.words):
+			word = paragraph.words[i]
+			letters = by_pasuk.get(word.pasuk_id)
+			if (letters is None or
+					not layout.letters_of(word.text).startswith(letters)):
+				i += 1
+				continue
+			# Each anchor is used once.
+			del by_pasuk[word.pasuk_id]
+			if i > 0:
+				head, paragraph = paragraph.split_at(i)
+				segments[-1].append(head)
+				i = 0
+			if segments[-1]:
+				segments.append([])
+		segments[-1].append(paragraph)
+	return segments
+
+
+# Most lines by which a single paragraph is loosened or tightened.
+MAX_LOOSENESS = 2
+
+
+def plan_looseness(breaker, paragraphs, broken, direction, needed,
+				   current=None):
+	"""Chooses paragraph line-count changes adding up to needed lines.
+
+	Steps are taken greedily in order of their marginal demerits; the k-th
+	step of a paragraph becomes available once its (k-1)-th is taken. A
+	paragraph already broken loose or tight can step back towards its
+	optimum, usually at a negative cost.
+
+	Args:
+		breaker: the layout.KnuthPlassBreaker.
+		paragraphs: list of Paragraphs.
+		broken: the current Lines of each paragraph.
+		direction: 1 to add lines, -1 to remove them.
+		needed: the number of lines to add or remove.
+		current: the looseness each paragraph is currently broken with,
+			if not all 0.
+
+	Returns:
+		A pair (total cost, dict of paragraph index to a pair of
+		(looseness, Lines)), or None if the paragraphs cannot absorb
+		that many lines.
+	"""
+	if not needed:
+		return 0.0, {}
+	variants = {}
+	heap = []
+
+	def push_step(i, k):
+		looseness = direction * k
+		if current:
+			looseness += current[i]
+		if abs(looseness) > MAX_LOOSENESS:
+			return
+		lines = breaker.break_paragraph(paragraphs[i], looseness)
+		if len(lines) - len(broken[i]) != direction * k:
+			return
+		prior = variants.get((i, k - 1), (None, broken[i]))[1]
+		cost = (
+			sum(l.demerits for l in lines) -
+			sum(l.demerits for l in prior))
+		variants[(i, k)] = (looseness, lines)
+		heapq.heappush(heap, (cost, i, k))
+
+	for i in range(len(paragraphs)):
+		push_step(i, 1)
+	chosen = {}
+	total = 0.0
+	steps = 0
+	while steps < needed and heap:
+		cost, i, k = heapq.heappop(heap)
+		chosen[i] = variants[(i, k)]
+		total += cost
+		steps += 1
+		push_step(i, k + 1)
+	if steps < needed:
+		return None
+	return total, chosen
+
+
+def solve_segment(params, paragraphs):
+	"""Breaks a segment into lines which fill whole columns if possible.
+
+	The segment is first broken optimally. If its last column is not full,
+	some paragraphs are made looser (or tighter) by a line or two, choosing
+	those whose demerits increase the least, as a scribe would stretch or
+	compress a few paragraphs to land on the column boundary. If neither
+	can be done within tolerance, the last column is left short.
+
+	Returns:
+		The list of Lines of the segment.
+	"""
+	engine = LayoutEngine(params)
+	breaker = engine.breaker
+	lpc = params.lines_per_col
+	broken = [breaker.break_paragraph(p) for p in paragraphs]
+	n_lines = len(engine.join_lines(paragraphs, broken))
+
+	remainder = n_lines % lpc
+	if remainder:
+		plans = []
+		for direction, needed in ((1, lpc - remainder), (-1, remainder)):
+			plan = plan_looseness(
+				breaker, paragraphs, broken, direction, needed)
+			if plan is not None:
+				plans.append(plan)
+		if plans:
+			_, chosen = min(plans, key=lambda plan: plan[0])
+			for i, (_, lines) in chosen.items():
+				broken[i] = lines
+	return engine.join_lines(paragraphs, broken)
+
+
+def _solve_segment_job(job):
+	params, paragraphs = job
+	return solve_segment(params, paragraphs)
+
+
+class AnchoredColumnSolver(object):
+	"""Lays out a Torah in segments between anchored column tops."""
+
+	def __init__(self, params, measure=layout.letter_count_width,
+				 column_tops=BIYA_SHEMO, max_workers=None, normalize=None):
+		"""Initialize.
+
+		Args:
+			params: layout.LayoutParams.
+			measure: callable returning the width of a word in letters.
+			column_tops: see find_anchors.
+			max_workers: size of the process pool. Segments are solved
+				serially in this process if 1.
+			normalize: optional callable applied to the text before it
+				is split into words.
+		"""
+		self.params = params
+		self.builder = layout.ParagraphBuilder(measure, normalize)
+		self.column_tops = column_tops
+		self.max_workers = max_workers
+
+	@classmethod
+	def from_config(cls, config, measure=layout.letter_count_width,
+					max_workers=None):
+		normalizer = normalize.TextNormalizer.from_config(config)
+		return cls(
+			layout.LayoutParams.from_config(config), measure,
+			max_workers=max_workers, normalize=normalizer.normalize)
+
+	def segments_for_torah(self, torah):
+		paragraphs = self.builder.paragraphs_for_torah(torah)
+		anchors = find_anchors(torah, self.column_tops)
+		return split_segments(paragraphs, anchors)
+
+	def solve_segments(self, segments):
+		"""Returns the list of Lines of each segment, in order."""
+		jobs = [(self.params, segment) for segment in segments]
+		if self.max_workers == 1 or len(jobs) < 2:
+			return [_solve_segment_job(job) for job in jobs]
+		with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+			return list(executor.map(_solve_segment_job, jobs))
+
+	def stitch(self, segment_lines):
+		"""Numbers the columns of the segments globally."""
+		lines = []
+		columns = []
+		for seg_lines in segment_lines:
+			lines.extend(seg_lines)
+			columns.extend(Layout.make_columns(
+				seg_lines, self.params.lines_per_col,
+				first_column_idx=len(columns)))
+		return Layout(
+			lines, self.params.lines_per_col, self.params.line_width,
+			columns=columns)
+
+	def solve(self, torah):
+		"""Returns the anchored Layout of this Torah."""
+		segments = self.segments_for_torah(torah)
+		return self.stitch(self.solve_segments(segments))
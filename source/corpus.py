@@ -0,0 +1,301 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Ingests the Tanakh from the per-chapter Mechon Mamre files.
+
+The files of each chapter are named c<book><chapter>.htm, e.g. c0101.htm
+for Bereshit 1, c08a24.htm for Shmuel Bet 24 and c26f0.htm for Tehillim
+150, whose hundreds are written as a hex digit. Book codes sort in the
+order of the Tanakh. CorpusIngester parses each book from its chapter
+files in a bounded process pool and writes it to its own XML file, or
+snapshot, as it is parsed, so the corpus is never held in memory at
+once. A manifest of the books is written alongside. Run from the source
+directory, e.g. for Nevi'im:
+
+	python corpus.py -o ../data/xml_tanakh -j 0 06-24
+"""
+
+import argparse
+import collections
+import json
+import os
+import re
+import sys
+import time
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from parse_mm import MechonMamreParser
+from snapshot import Snapshot
+from torah_model import PasukStart, Torah
+from torah_store import TorahStore
+from write_xml_torah import XmlTorahWriter
+
+
+# Names of the chapter files: the book code and the chapter code.
+CHAPTER_FILENAME = re.compile(r'^c(\d\d[ab]?)([0-9a-f]\d)\.htm$')
+
+# A book of the corpus. index is its position in the whole corpus, which
+# numbers its Sefer, and fnames are the paths of its chapters in order.
+Book = collections.namedtuple('Book', ['code', 'index', 'fnames'])
+
+# The outcome of ingesting a Book.
+BookResult = collections.namedtuple('BookResult', [
+	'code', 'index', 'name', 'output_filename', 'n_perakim', 'n_pasukim',
+	'seconds'])
+
+
+def chapter_number(chapter_code):
+	"""The number of a chapter code, e.g. 1 for '01', 150 for 'f0'."""
+	return int(chapter_code[0], 16) * 10 + int(chapter_code[1])
+
+
+def discover_books(html_dir, codes=None):
+	"""Finds the books of the chapter files in html_dir.
+
+	Args:
+		html_dir: the directory of the Mechon Mamre files.
+		codes: book codes to keep, e.g. ['01', '08a']; all if None.
+
+	Returns:
+		A list of Books in the order of the Tanakh.
+
+	Raises:
+		ValueError: if any of codes has no chapter files.
+	"""
+	chapters = collections.defaultdict(list)
+	for fname in os.listdir(html_dir):
+		match = CHAPTER_FILENAME.match(fname)
+		if match:
+			code, chapter_code = match.groups()
+			chapters[code].append((chapter_number(chapter_code), fname))
+
+	books = []
+	for i, code in enumerate(sorted(chapters)):
+		fnames = [
+			os.path.join(html_dir, fname)
+			for _, fname in sorted(chapters[code])]
+		books.append(Book(code, i, fnames))
+	if codes is None:
+		return books
+
+	missing = set(codes).difference(chapters)
+	if missing:
+		raise ValueError('No chapter files of books %s in %s' % (
+			', '.join(sorted(missing)), html_dir))
+	codes = set(codes)
+	return [book for book in books if book.code in codes]
+
+
+def expand_book_codes(args, codes):
+	"""Expands book code arguments, where 'a-b' is a range of codes.
+
+	A range includes every code from a to b in the order of the Tanakh,
+	e.g. '08a-10' is 08a, 08b, 09a, 09b and 10.
+
+	Args:
+		args: book codes and ranges.
+		codes: all the book codes, in order.
+
+	Raises:
+		ValueError: if an argument names a code not in codes.
+	"""
+	selected = set()
+	for arg in args:
+		first, sep, last = arg.partition('-')
+		if not sep:
+			last = first
+		if first not in codes or last not in codes:
+			raise ValueError('Unknown book code in %r' % arg)
+		selected.update(codes[codes.index(first):codes.index(last) + 1])
+	return [code for code in codes if code in selected]
+
+
+def _ingest_job(job):
+	book, out_fname, output_format, compression, backend = job
+	start = time.time()
+	parser = MechonMamreParser(backend=backend)
+	sefer = parser.parse_chapter_filenames(book.fnames, sefer_idx=book.index)
+	n_perakim = len(sefer.stream)
+	n_pasukim = sum(
+		1 for perek in sefer.iter_stream for elt in perek.iter_stream
+		if isinstance(elt, PasukStart))
+	if output_format == CorpusIngester.SNAPSHOT:
+		torah = Torah()
+		torah.append_to_stream(sefer)
+		Snapshot.save(TorahStore.from_model(torah), out_fname)
+	else:
+		XmlTorahWriter().write_filename([sefer], out_fname, compression)
+	return BookResult(
+		book.code, book.index, sefer.name, out_fname, n_perakim,
+		n_pasukim, time.time() - start)
+
+
+class CorpusIngester(object):
+	"""Parses books from chapter files into per-book outputs."""
+
+	# Formats of the outputs.
+	XML = 'xml'
+	SNAPSHOT = 'snapshot'
+
+	MANIFEST_FILENAME = 'corpus.json'
+
+	def __init__(self, out_dir, output_format=XML, compression=None,
+				 max_workers=1, max_pending=None,
+				 backend=MechonMamreParser.LXML, progress=None):
+		"""Initialize.
+
+		Args:
+			out_dir: directory the outputs and manifest are written to.
+			output_format: XML or SNAPSHOT.
+			compression: XmlTorahWriter.GZIP, XmlTorahWriter.XZ or None,
+				for XML outputs.
+			max_workers: size of the process pool books are parsed in.
+				Books are parsed serially in this process if 1; None means
+				one process per CPU.
+			max_pending: most books submitted to the pool at once;
+				defaults to twice the number of workers.
+			backend: the HTML parser backend.
+			progress: called with (n_done, n_books, BookResult) as each
+				book is written, in the order they finish.
+		"""
+		if output_format not in (self.XML, self.SNAPSHOT):
+			raise ValueError('Unknown output format %r' % output_format)
+		self.out_dir = out_dir
+		self.output_format = output_format
+		self.compression = compression
+		self.max_workers = max_workers
+		self.max_pending = max_pending
+		self.backend = backend
+		self.progress = progress
+
+	def output_filename(self, book):
+		if self.output_format == self.SNAPSHOT:
+			suffix = '.snapshot'
+		else:
+			suffix = '.xml' + {
+				XmlTorahWriter.GZIP: '.gz',
+				XmlTorahWriter.XZ: '.xz'}.get(self.compression, '')
+		return os.path.join(self.out_dir, book.code + suffix)
+
+	def ingest(self, books):
+		"""Parses and writes books, then writes the manifest.
+
+		Returns:
+			The BookResults, in the order of books.
+		"""
+		if not os.path.isdir(self.out_dir):
+			os.makedirs(self.out_dir)
+		jobs = [
+			(book, self.output_filename(book), self.output_format,
+			 self.compression, self.backend)
+			for book in books]
+		results = []
+		if self.max_workers == 1 or len(jobs) < 2:
+			for job in jobs:
+				self._done(results, len(jobs), _ingest_job(job))
+		else:
+			self._ingest_parallel(jobs, results)
+		results.sort(key=lambda r: r.index)
+		self.write_manifest(results)
+		return results
+
+	def _ingest_parallel(self, jobs, results):
+		"""Keeps at most max_pending jobs in the pool at once."""
+		max_pending = self.max_pending or 2 * (
+			self.max_workers or os.cpu_count() or 1)
+		with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+			todo = iter(jobs)
+			pending = set()
+			while True:
+				while len(pending) < max_pending:
+					job = next(todo, None)
+					if job is None:
+						break
+					pending.add(executor.submit(_ingest_job, job))
+				if not pending:
+					break
+				finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+				for future in finished:
+					self._done(results, len(jobs), future.result())
+
+	def _done(self, results, n_books, result):
+		results.append(result)
+		if self.progress is not None:
+			self.progress(len(results), n_books, result)
+
+	def write_manifest(self, results):
+		"""Writes the books of results, in order, to the manifest."""
+		books = [
+			dict(code=r.code, index=r.index, name=r.name,
+				 filename=os.path.basename(r.output_filename),
+				 perakim=r.n_perakim, pasukim=r.n_pasukim)
+			for r in results]
+		fname = os.path.join(self.out_dir, self.MANIFEST_FILENAME)
+		with open(fname, 'w', encoding='utf-8') as f:
+			json.dump(
+				dict(format=self.output_format, books=books), f, indent=2,
+				ensure_ascii=False)
+			f.write('\n')
+
+
+def print_progress(n_done, n_books, result):
+	print('[%d/%d] %s %s: %d perakim, %d pasukim in %.2f s' % (
+		n_done, n_books, result.code, result.name, result.n_perakim,
+		result.n_pasukim, result.seconds))
+
+
+def main():
+	parser = argparse.ArgumentParser(
+		description='Converts the Mechon Mamre chapter files to a file per '
+		'book.')
+	parser.add_argument(
+		'books', nargs='*',
+		help='Book codes, e.g. 01 08a, or ranges, e.g. 06-24; all if none.')
+	parser.add_argument(
+		'-d', '--html_dir', default='../data/mamre.cantillation',
+		help='Directory of the chapter files.')
+	parser.add_argument(
+		'-o', '--out_dir', required=True,
+		help='Directory to write the books and manifest to.')
+	parser.add_argument(
+		'-f', '--format', default=CorpusIngester.XML,
+		choices=(CorpusIngester.XML, CorpusIngester.SNAPSHOT),
+		help='Format of the output of each book.')
+	parser.add_argument(
+		'-z', '--compression', default=None,
+		choices=(XmlTorahWriter.GZIP, XmlTorahWriter.XZ),
+		help='Compression of XML outputs.')
+	parser.add_argument(
+		'-j', '--jobs', type=int, default=1,
+		help='Number of processes parsing books; 0 for one per CPU.')
+	parser.add_argument(
+		'-p', '--max_pending', type=int, default=None,
+		help='Most books queued for the processes at once.')
+	parser.add_argument(
+		'-b', '--backend', default=MechonMamreParser.LXML,
+		choices=(MechonMamreParser.LXML, MechonMamreParser.SOUP),
+		help='HTML parser backend.')
+	args = parser.parse_args()
+
+	books = discover_books(args.html_dir)
+	if args.books:
+		try:
+			codes = expand_book_codes(
+				args.books, [book.code for book in books])
+		except ValueError as e:
+			parser.error(str(e))
+		books = discover_books(args.html_dir, codes)
+
+	ingester = CorpusIngester(
+		args.out_dir, args.format, args.compression, args.jobs or None,
+		args.max_pending, args.backend, print_progress)
+	start = time.time()
+	results = ingester.ingest(books)
+	print('%d books, %d perakim, %d pasukim in %.2f s' % (
+		len(results), sum(r.n_perakim for r in results),
+		sum(r.n_pasukim for r in results), time.time() - start))
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,240 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Content-addressed on-disk cache of the TeX of Perek subtrees.
+
+The TeX of a subtree depends only on its content and on the formatting
+options of the KavlarConfig. FragmentCache stores the TeX of every Perek
+under a hash of both, so a recompile after a small edit only renders the
+perakim which changed. Only one level of the model is cached, so that no
+text is stored twice; the TeX of a sefer is its header and the TeX of its
+perakim. The cache directory is bounded in size; the least recently used
+fragments are evicted first.
+"""
+
+import hashlib
+import os
+import tempfile
+
+from normalize import TextNormalizer
+from torah_model import FormattedText, ParashaDelimiter
+from torah_model import PasukStart, PasukFragment
+from torah_model import Perek, Sefer, Torah, TextFragment
+from torah_model import ENTER, LEAVE, ModelEvents
+
+
+# Bump when a change to to_tex changes the TeX of existing models.
+TEX_VERSION = 1
+
+# Config sections which affect the TeX of a fragment.
+TEX_SECTIONS = ('formatting',)
+
+# Attributes of each model class hashed with its content.
+HASHED_ATTRIBUTES = {
+	Torah: (),
+	Sefer: ('name', 'sefer_idx', 'sefer_id'),
+	Perek: ('perek', 'perek_idx', 'perek_id'),
+	PasukStart: ('pasuk', 'pasuk_idx', 'pasuk_id'),
+	PasukFragment: ('pasuk_id',),
+	TextFragment: ('text',),
+	FormattedText: ('kind', 'text'),
+	ParashaDelimiter: ('kind',)
+}
+
+# Classes whose TeX is cached. Cached subtrees must not nest, or their
+# text would be stored once for each level.
+CACHED_CLASSES = (Perek,)
+
+
+def config_digest(config):
+	"""Hash of the options of config which affect the TeX."""
+	h = hashlib.sha256(b'tex:%d\n' % TEX_VERSION)
+	for section in TEX_SECTIONS:
+		for option, value in sorted(config.items(section)):
+			h.update(('%s.%s=%s\n' % (section, option, value)).encode(
+				'utf-8'))
+	return h.hexdigest()
+
+
+def subtree_digest(elt, memo=None):
+	"""Hash of the content of a model subtree.
+
+	Args:
+		elt: any element of the model.
+		memo: optional dict, filled with the digest of every subtree of
+			a cached class in the subtree by id.
+	"""
+	parts = []
+	# The parts of the subtrees enclosing the cached subtree being hashed.
+	enclosing = []
+	for kind, e, _, _, _ in ModelEvents(elt):
+		t = type(e)
+		if kind == LEAVE:
+			parts.append(u'\2')
+			if t in CACHED_CLASSES and e is not elt:
+				digest = _digest(parts)
+				if memo is not None:
+					memo[id(e)] = digest
+				parts = enclosing.pop()
+				parts.append(digest)
+			continue
+		if kind == ENTER and t in CACHED_CLASSES and e is not elt:
+			enclosing.append(parts)
+			parts = []
+		parts.append(t.__name__)
+		for attribute in HASHED_ATTRIBUTES[t]:
+			parts.append(str(getattr(e, attribute)))
+		if kind == ENTER:
+			parts.append(u'\1')
+	digest = _digest(parts)
+	if memo is not None and type(elt) in CACHED_CLASSES:
+		memo[id(elt)] = digest
+	return digest
+
+
+def _digest(parts):
+	return hashlib.sha256(u'\0'.join(parts).encode('utf-8')).hexdigest()
+
+
+class FragmentCache(object):
+	"""A size-bounded directory of rendered TeX fragments."""
+
+	SUFFIX = '.tex'
+
+	def __init__(self, cache_dir, max_bytes=64 << 20):
+		"""Initialize.
+
+		Args:
+			cache_dir: directory to keep fragments in.
+			max_bytes: the least recently used fragments are evicted
+				when the fragments take more than this.
+		"""
+		self.cache_dir = cache_dir
+		self.max_bytes = max_bytes
+		self.hits = 0
+		self.misses = 0
+		# Digests of the subtrees of the model being compiled, by id.
+		self._digests = None
+		self._config_digests = {}
+		if not os.path.isdir(cache_dir):
+			os.makedirs(cache_dir)
+		self.n_bytes = sum(size for _, _, size in self._entries())
+
+	@classmethod
+	def from_config(cls, config):
+		"""Returns the cache of the configured directory, or None."""
+		cache_dir = config.get('cache', 'fragment_dir')
+		if not cache_dir:
+			return None
+		return cls(cache_dir, config.getint('cache', 'fragment_max_bytes'))
+
+	def _entries(self):
+		"""Yields (path, last use, size) of the cached fragments."""
+		for entry in os.scandir(self.cache_dir):
+			if entry.name.endswith(self.SUFFIX):
+				st = entry.stat()
+				yield entry.path, st.st_mtime, st.st_size
+
+	def path_for(self, key):
+		return os.path.join(self.cache_dir, key + self.SUFFIX)
+
+	def key(self, elt, config):
+		"""The key of the TeX of elt under config."""
+		digest = None
+		if self._digests is not None:
+			digest = self._digests.get(id(elt))
+		if digest is None:
+			digest = subtree_digest(elt, self._digests)
+		config_key = self._config_digests.get(id(config))
+		if config_key is None or self._digests is None:
+			config_key = config_digest(config)
+			self._config_digests[id(config)] = config_key
+		return hashlib.sha256(
+			(digest + config_key).encode('ascii')).hexdigest()
+
+	def get(self, key):
+		"""Returns the cached TeX for key, or None."""
+		path = self.path_for(key)
+		try:
+			with open(path, 'rb') as f:
+				tex = f.read().decode('utf-8')
+			# Mark as recently used.
+			os.utime(path)
+		except (IOError, OSError):
+			return None
+		return tex
+
+	def put(self, key, tex):
+		data = tex.encode('utf-8')
+		path = self.path_for(key)
+		try:
+			old_size = os.path.getsize(path)
+		except OSError:
+			old_size = 0
+		fd, tmp_fname = tempfile.mkstemp(
+			dir=self.cache_dir, suffix='.tmp')
+		try:
+			with os.fdopen(fd, 'wb') as f:
+				f.write(data)
+			os.replace(tmp_fname, path)
+		except BaseException:
+			os.unlink(tmp_fname)
+			raise
+		self.n_bytes += len(data) - old_size
+		if self.n_bytes > self.max_bytes:
+			self.evict()
+
+	def evict(self):
+		"""Removes least recently used fragments down to max_bytes."""
+		entries = sorted(self._entries(), key=lambda e: e[1])
+		self.n_bytes = sum(size for _, _, size in entries)
+		for path, _, size in entries:
+			if self.n_bytes <= self.max_bytes:
+				break
+			try:
+				os.unlink(path)
+			except OSError:
+				continue
+			self.n_bytes -= size
+
+	def caches(self, elt):
+		"""Whether the TeX of elt is cached."""
+		return type(elt) in CACHED_CLASSES
+
+	def iter_tex(self, elt, kavlar_config, normalizer=None):
+		"""Yields the TeX of elt, from the cache where possible.
+
+		Args:
+			elt: an element of a cached class.
+			kavlar_config: the KavlarConfig to compile with.
+			normalizer: the normalize.TextNormalizer of kavlar_config;
+				built from it if None.
+		"""
+		key = self.key(elt, kavlar_config)
+		tex = self.get(key)
+		if tex is None:
+			self.misses += 1
+			tex = ''.join(elt.iter_tex(kavlar_config, self, normalizer))
+			self.put(key, tex)
+		else:
+			self.hits += 1
+		yield tex
+
+	def iter_torah_tex(self, root, kavlar_config):
+		"""Yields the TeX of a whole model, from the cache where possible.
+
+		Digests are remembered for the duration of the call only, since
+		the model may be edited between compiles.
+		"""
+		self._digests = {}
+		self._config_digests = {}
+		normalizer = TextNormalizer.from_config(kavlar_config)
+		try:
+			if self.caches(root):
+				for tex in self.iter_tex(root, kavlar_config, normalizer):
+					yield tex
+			else:
+				for tex in root.iter_tex(kavlar_config, self, normalizer):
+					yield tex
+		finally:
+			self._digests = None
@@ -0,0 +1,320 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Incremental relayout of a torah model after edits to the XML.
+
+The intermediate XML is meant to be edited by hand. Rather than laying out
+the whole Torah again after each edit, IncrementalLayout keeps the broken
+lines of every paragraph as a checkpoint, finds the PasukFragments whose
+content changed (by pasuk_id), and re-breaks only the paragraphs holding
+them. Columns are rebuilt from the first affected line until they line up
+with the previous columns again; unchanged Columns are reused as they are.
+
+By default the result is exactly the layout a full run would produce. With
+absorb=True an edit which changes the number of lines of its paragraph is
+instead absorbed by loosening or tightening the paragraphs which follow, so
+that later columns come out as before. The layout then depends on the
+history of edits.
+"""
+
+import column_solver
+import layout
+import torah_model
+
+from layout import Column, Layout, LayoutEngine, Paragraph
+
+
+def pasuk_signatures(torah):
+	"""Summarizes the content of every pasuk in the model.
+
+	Returns:
+		A triple (ordered list of pasuk_ids, dict of pasuk_id to
+		signature, dict of pasuk_id to list of PasukFragments). Two
+		pasukim with equal signatures lay out identically.
+	"""
+	order = []
+	signatures = {}
+	fragments = {}
+	for sefer in torah.iter_stream:
+		for perek in sefer.iter_stream:
+			for elt in perek.iter_stream:
+				if type(elt) != torah_model.PasukFragment:
+					continue
+				pasuk_id = elt.pasuk_id
+				signature = tuple(
+					(type(c).__name__, getattr(c, 'kind', None),
+					 getattr(c, 'text', None))
+					for c in elt.iter_stream)
+				if pasuk_id in fragments:
+					fragments[pasuk_id].append(elt)
+					signatures[pasuk_id] += signature
+				else:
+					order.append(pasuk_id)
+					fragments[pasuk_id] = [elt]
+					signatures[pasuk_id] = signature
+	return order, signatures, fragments
+
+
+class IncrementalLayout(object):
+	"""A Layout kept up to date across edits of the torah model."""
+
+	def __init__(self, engine, absorb=False):
+		"""Initialize.
+
+		Args:
+			engine: the layout.LayoutEngine to lay out with.
+			absorb: whether to keep later columns in place by absorbing
+				changes in line count into the following paragraphs.
+		"""
+		self.engine = engine
+		self.absorb = absorb
+		self.layout = None
+		self.last_stats = None
+		self._paragraphs = []
+		self._paragraph_lines = []
+		self._looseness = []
+		self._order = []
+		self._position = {}
+		self._signatures = {}
+
+	@classmethod
+	def from_config(cls, config, measure=layout.letter_count_width,
+					absorb=False):
+		return cls(LayoutEngine.from_config(config, measure), absorb)
+
+	def layout_torah(self, torah):
+		"""Lays out the whole Torah from scratch and checkpoints it."""
+		order, signatures, _ = pasuk_signatures(torah)
+		paragraphs = self.engine.builder.paragraphs_for_torah(torah)
+		paragraph_lines = [
+			self.engine.breaker.break_paragraph(p) for p in paragraphs]
+		self._set_state(order, signatures, paragraphs, paragraph_lines)
+		params = self.engine.params
+		lines = self.engine.join_lines(paragraphs, paragraph_lines)
+		self.layout = Layout(lines, params.lines_per_col, params.line_width)
+		self.last_stats = {
+			'changed_pasukim': len(order),
+			'paragraphs_broken': len(paragraphs),
+			'columns_rebuilt': self.layout.n_columns,
+			'full_relayout': True
+		}
+		return self.layout
+
+	def _set_state(self, order, signatures, paragraphs, paragraph_lines):
+		self._order = order
+		self._position = dict((p, i) for i, p in enumerate(order))
+		self._signatures = signatures
+		self._paragraphs = paragraphs
+		self._paragraph_lines = paragraph_lines
+		self._looseness = [0] * len(paragraphs)
+		self._index_paragraphs()
+
+	def _index_paragraphs(self):
+		"""Maps each pasuk_id to the paragraphs holding its words."""
+		self._pasuk_paragraphs = {}
+		for i, paragraph in enumerate(self._paragraphs):
+			pasuk_id = None
+			for word in paragraph.words:
+				if word.pasuk_id != pasuk_id:
+					pasuk_id = word.pasuk_id
+					self._pasuk_paragraphs.setdefault(pasuk_id, []).append(i)
+
+	def changed_pasuk_ids(self, signatures):
+		"""Returns the set of pasuk_ids whose content differs."""
+		old = self._signatures
+		return set(
+			pasuk_id for pasuk_id, signature in signatures.items()
+			if old.get(pasuk_id) != signature)
+
+	def relayout(self, torah):
+		"""Returns the Layout of an edited version of the Torah.
+
+		Falls back to a full layout on the first call, when pasukim were
+		added or removed, or when the previous layout had no paragraphs.
+		"""
+		order, signatures, fragments = pasuk_signatures(torah)
+		if (self.layout is None or order != self._order or
+				not self._paragraphs):
+			return self.layout_torah(torah)
+
+		changed = self.changed_pasuk_ids(signatures)
+		ranges = self._affected_ranges(changed)
+		old_starts = self._line_starts()
+
+		n_broken = 0
+		# Replace from the end so earlier paragraph indices stay valid.
+		for n, (lo, hi) in enumerate(reversed(ranges)):
+			if n:
+				# A range may grow into one already replaced.
+				self._index_paragraphs()
+			lo, hi, new_paragraphs = self._rebuild_range(lo, hi, fragments)
+			new_lines = [
+				self.engine.breaker.break_paragraph(p)
+				for p in new_paragraphs]
+			n_broken += len(new_paragraphs)
+			if self.absorb:
+				n_broken += self._absorb(
+					hi + 1, new_lines, self._paragraph_lines[lo:hi + 1])
+			self._paragraphs[lo:hi + 1] = new_paragraphs
+			self._paragraph_lines[lo:hi + 1] = new_lines
+			self._looseness[lo:hi + 1] = [0] * len(new_paragraphs)
+
+		self._signatures = signatures
+		self._index_paragraphs()
+		first_line = old_starts[ranges[0][0]] if ranges else old_starts[-1]
+		self.layout, n_rebuilt = self._rebuild_columns(first_line)
+		self.last_stats = {
+			'changed_pasukim': len(changed),
+			'paragraphs_broken': n_broken,
+			'columns_rebuilt': n_rebuilt,
+			'full_relayout': False
+		}
+		return self.layout
+
+	def _line_starts(self):
+		"""Index of the first line of each paragraph in the layout."""
+		starts = []
+		n = 0
+		last = len(self._paragraphs) - 1
+		for i, paragraph in enumerate(self._paragraphs):
+			starts.append(n)
+			n += len(self._paragraph_lines[i])
+			n += self.engine.n_blank_lines_after(paragraph, i == last)
+		return starts
+
+	def _affected_ranges(self, changed):
+		"""Returns sorted, disjoint (lo, hi) ranges of paragraphs to redo.
+
+		A range covers every paragraph holding a word of any of its
+		pasukim, so it can be rebuilt from whole PasukFragments.
+		"""
+		indices = set()
+		for pasuk_id in changed:
+			i = self._position[pasuk_id]
+			# A pasuk without words lies in its neighbour's paragraph.
+			probe = i
+			while probe >= 0 and self._order[probe] not in self._pasuk_paragraphs:
+				probe -= 1
+			if probe < 0:
+				probe = i
+				while self._order[probe] not in self._pasuk_paragraphs:
+					probe += 1
+			indices.update(self._pasuk_paragraphs[self._order[probe]])
+
+		ranges = []
+		for i in sorted(indices):
+			lo, hi = self._expand(i, i)
+			if ranges and lo <= ranges[-1][1] + 1:
+				lo = ranges[-1][0]
+				hi = max(hi, ranges[-1][1])
+				ranges.pop()
+			ranges.append((lo, hi))
+		return ranges
+
+	def _expand(self, lo, hi):
+		"""Grows [lo, hi] until no pasuk straddles its ends."""
+		while True:
+			new_lo = self._pasuk_paragraphs[
+				self._paragraphs[lo].first_pasuk_id][0]
+			new_hi = self._pasuk_paragraphs[
+				self._paragraphs[hi].words[-1].pasuk_id][-1]
+			if (new_lo, new_hi) == (lo, hi):
+				return lo, hi
+			lo, hi = new_lo, new_hi
+
+	def _rebuild_range(self, lo, hi, fragments):
+		"""Re-itemizes the pasukim of paragraphs lo..hi from the new model.
+
+		The range is extended forwards if an edit removed the forced
+		break which used to end it. If an edit removed every word of the
+		last paragraph of a sefer, the paragraph before it, which breaks
+		the same way whatever its end_kind, is marked as the end of the
+		sefer instead.
+
+		Returns:
+			The triple (lo, hi, new Paragraphs).
+		"""
+		position = self._position
+		builder = self.engine.builder
+		while True:
+			first = position[self._paragraphs[lo].first_pasuk_id]
+			last_paragraph = self._paragraphs[hi]
+			last = position[last_paragraph.words[-1].pasuk_id]
+			# Take in any trailing pasukim without words.
+			while (last + 1 < len(self._order) and
+					self._order[last + 1] not in self._pasuk_paragraphs):
+				last += 1
+			pasuk_fragments = [
+				f for pasuk_id in self._order[first:last + 1]
+				for f in fragments[pasuk_id]]
+			new_paragraphs = builder.paragraphs_for_fragments(
+				last_paragraph.sefer_idx, pasuk_fragments)
+			if last_paragraph.end_kind == Paragraph.SEFER_END:
+				if new_paragraphs:
+					new_paragraphs[-1].end_kind = Paragraph.SEFER_END
+				elif (lo > 0 and self._paragraphs[lo - 1].sefer_idx ==
+						last_paragraph.sefer_idx):
+					self._paragraphs[lo - 1].end_kind = Paragraph.SEFER_END
+				return lo, hi, new_paragraphs
+			if new_paragraphs and new_paragraphs[-1].end_kind is not None:
+				return lo, hi, new_paragraphs
+			hi = self._expand(hi + 1, hi + 1)[1]
+
+	def _absorb(self, start, new_lines, old_lines):
+		"""Loosens or tightens paragraphs from start to keep line counts.
+
+		Only the paragraphs within a column's worth of lines after the
+		edit are considered. Paragraphs loosened or tightened by earlier
+		edits are preferably returned to their optimum.
+
+		Returns:
+			The number of paragraphs re-broken.
+		"""
+		delta = (
+			sum(len(l) for l in new_lines) - sum(len(l) for l in old_lines))
+		if not delta:
+			return 0
+		lpc = self.engine.params.lines_per_col
+		end = start
+		n_lines = 0
+		while end < len(self._paragraphs) and n_lines < lpc:
+			n_lines += len(self._paragraph_lines[end])
+			end += 1
+		plan = column_solver.plan_looseness(
+			self.engine.breaker, self._paragraphs[start:end],
+			self._paragraph_lines[start:end], -1 if delta > 0 else 1,
+			abs(delta), self._looseness[start:end])
+		if plan is None:
+			return 0
+		_, chosen = plan
+		for i, (looseness, lines) in chosen.items():
+			self._looseness[start + i] = looseness
+			self._paragraph_lines[start + i] = lines
+		return len(chosen)
+
+	def _rebuild_columns(self, first_line):
+		"""Deals the lines into columns, reusing unchanged old Columns.
+
+		Returns:
+			The pair (new Layout, number of Columns rebuilt).
+		"""
+		params = self.engine.params
+		lpc = params.lines_per_col
+		lines = self.engine.join_lines(
+			self._paragraphs, self._paragraph_lines)
+		old_columns = self.layout.columns
+		c0 = first_line // lpc
+		columns = old_columns[:c0]
+		n_rebuilt = 0
+		for c, start in enumerate(range(c0 * lpc, len(lines), lpc), c0):
+			chunk = lines[start:start + lpc]
+			old = old_columns[c] if c < len(old_columns) else None
+			if (old is not None and len(old.lines) == len(chunk) and
+					all(a is b or (a.is_blank and b.is_blank)
+						for a, b in zip(old.lines, chunk))):
+				columns.append(old)
+			else:
+				columns.append(Column(c, chunk))
+				n_rebuilt += 1
+		return Layout(
+			lines, lpc, params.line_width, columns=columns), n_rebuilt
@@ -0,0 +1,222 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Timers, counters and profiles of the stages of the pipeline.
+
+Code of the pipeline wraps its stages in instrumentation.stage(name) and
+counts what it processed with instrumentation.count(name, n). The report
+of an Instrumentation is a JSON-serializable dict of the number of calls
+and total seconds of each stage and of the counters. Stages may also be
+profiled with cProfile, one pstats file per stage.
+
+Instrumentation is configured in the [instrumentation] section of the
+KavlarConfig and is off by default, in which case the shared
+NULL_INSTRUMENTATION is used, whose methods do nothing.
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import time
+
+
+def count_nodes(elt):
+	"""Number of elements of a model subtree, e.g. of a Torah."""
+	n = 0
+	pending = [elt]
+	while pending:
+		elt = pending.pop()
+		n += 1
+		stream = getattr(elt, 'stream', None)
+		if stream:
+			pending.extend(stream)
+	return n
+
+
+class _NullTimer(object):
+	"""Context manager timing nothing."""
+
+	__slots__ = ()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class NullInstrumentation(object):
+	"""Instrumentation which records nothing, at next to no cost."""
+
+	enabled = False
+
+	def stage(self, name):
+		return _NULL_TIMER
+
+	def iter_stage(self, name, iterable):
+		return iterable
+
+	def count(self, name, n=1):
+		pass
+
+	def report(self):
+		return {'stages': {}, 'counters': {}}
+
+	def save(self):
+		pass
+
+
+NULL_INSTRUMENTATION = NullInstrumentation()
+
+
+class _Timer(object):
+	"""Context manager adding its duration to a stage."""
+
+	__slots__ = ('instrumentation', 'name', 'start', 'profile')
+
+	def __init__(self, instrumentation, name):
+		self.instrumentation = instrumentation
+		self.name = name
+
+	def __enter__(self):
+		self.profile = self.instrumentation._start_profile(self.name)
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *exc_info):
+		elapsed = time.perf_counter() - self.start
+		self.instrumentation.add_time(self.name, elapsed)
+		self.instrumentation._stop_profile(self.name, self.profile)
+		return False
+
+
+class Instrumentation(object):
+	"""Records the time spent in named stages and named counters."""
+
+	enabled = True
+
+	# Value of the profile option to profile every stage.
+	ALL_STAGES = 'all'
+
+	def __init__(self, profile_stages=(), profile_dir=None, output=None):
+		"""Initialize.
+
+		Args:
+			profile_stages: names of the stages to profile with cProfile,
+				or ALL_STAGES.
+			profile_dir: directory save() writes a <stage>.prof pstats
+				file to for each profiled stage.
+			output: file save() writes the JSON report to.
+		"""
+		self.profile_stages = frozenset(profile_stages)
+		self.profile_dir = profile_dir
+		self.output = output
+		# [calls, seconds] by stage name.
+		self.timings = {}
+		self.counters = {}
+		# pstats.Stats by stage name.
+		self.profiles = {}
+		self._profiling = False
+
+	@classmethod
+	def from_config(cls, config):
+		"""Returns the configured Instrumentation, or NULL_INSTRUMENTATION."""
+		if not config.has_section('instrumentation'):
+			return NULL_INSTRUMENTATION
+		if not config.getboolean('instrumentation', 'enabled'):
+			return NULL_INSTRUMENTATION
+		profile = config.get('instrumentation', 'profile')
+		profile_stages = [s.strip() for s in profile.split(',') if s.strip()]
+		return cls(
+			profile_stages,
+			config.get('instrumentation', 'profile_dir') or None,
+			config.get('instrumentation', 'output') or None)
+
+	def stage(self, name):
+		"""Context manager timing one call of a stage."""
+		return _Timer(self, name)
+
+	def iter_stage(self, name, iterable):
+		"""Yields from iterable, timing the iteration as one call of a stage.
+
+		Only the time spent producing the items is counted, not the time
+		the consumer spends between them.
+		"""
+		it = iter(iterable)
+		self.add_time(name, 0.0)
+		while True:
+			profile = self._start_profile(name)
+			start = time.perf_counter()
+			try:
+				item = next(it)
+			except StopIteration:
+				return
+			finally:
+				self.add_time(name, time.perf_counter() - start, calls=0)
+				self._stop_profile(name, profile)
+			yield item
+
+	def add_time(self, name, seconds, calls=1):
+		timing = self.timings.get(name)
+		if timing is None:
+			timing = self.timings[name] = [0, 0.0]
+		timing[0] += calls
+		timing[1] += seconds
+
+	def count(self, name, n=1):
+		self.counters[name] = self.counters.get(name, 0) + n
+
+	def _start_profile(self, name):
+		"""Returns a running cProfile.Profile if the stage is profiled.
+
+		Only one profile runs at a time; stages nested in a profiled
+		stage are part of its profile.
+		"""
+		if self._profiling or not (
+				name in self.profile_stages or
+				self.ALL_STAGES in self.profile_stages):
+			return None
+		self._profiling = True
+		profile = cProfile.Profile()
+		profile.enable()
+		return profile
+
+	def _stop_profile(self, name, profile):
+		if profile is None:
+			return
+		profile.disable()
+		self._profiling = False
+		stats = self.profiles.get(name)
+		if stats is None:
+			self.profiles[name] = pstats.Stats(profile)
+		else:
+			stats.add(profile)
+
+	def report(self):
+		"""Returns the timings and counters as a JSON-serializable dict."""
+		return {
+			'stages': dict(
+				(name, {'calls': calls, 'seconds': seconds})
+				for name, (calls, seconds) in self.timings.items()),
+			'counters': dict(self.counters)
+		}
+
+	def to_json(self):
+		return json.dumps(self.report(), indent=2, sort_keys=True)
+
+	def save(self):
+		"""Writes the report and the profiles where configured."""
+		if self.output:
+			with open(self.output, 'w', encoding='utf-8') as f:
+				f.write(self.to_json())
+				f.write('\n')
+		if self.profile_dir:
+			if not os.path.isdir(self.profile_dir):
+				os.makedirs(self.profile_dir)
+			for name, stats in self.profiles.items():
+				stats.dump_stats(
+					os.path.join(self.profile_dir, name + '.prof'))
@@ -5,10 +5,20 @@
 
 """
 
+import fragment_cache
+import instrumentation
+import jinja2
+import layout
+import metrics
+import multiprocessing.util
 import re
+import shared_store
 import tex_templating
 import torah_model
+import torah_store
+import xml_offsets
 
+from concurrent.futures import ProcessPoolExecutor
 from configparser import ConfigParser
 
 
@@ -25,6 +35,47 @@ class KavlarConfig(object):
 		config.set('formatting', 'strip_vowels', 'True')
 		config.set(
 			'formatting', 'strip_cantillation_marks', 'True')
+		# Punctuation policies: keep, remove, or for the maqaf, space.
+		config.set('formatting', 'maqaf', 'space')
+		config.set('formatting', 'sof_pasuk', 'remove')
+		config.set('formatting', 'paseq', 'remove')
+		config.add_section('layout')
+		# Distances in the layout section are in units of letter widths.
+		config.set('layout', 'line_height', '3.5')
+		config.set('layout', 'space_width', '1.0')
+		config.set('layout', 'space_stretch', '0.5')
+		config.set('layout', 'space_shrink', '0.25')
+		config.set('layout', 'setuma_width', '9.0')
+		config.set('layout', 'setuma_stretch', '4.5')
+		config.set('layout', 'setuma_penalty', '-50')
+		config.set('layout', 'tolerance', '2.0')
+		config.set('layout', 'line_penalty', '10')
+		config.set('layout', 'fitness_demerits', '100')
+		config.set('layout', 'book_end_lines', '4')
+		config.add_section('metrics')
+		# Font file to measure words with; widths default to
+		# counting letters when empty.
+		config.set('metrics', 'font_file', '')
+		config.set('metrics', 'metrics_table', '')
+		config.set('metrics', 'width_cache_size', '65536')
+		config.add_section('cache')
+		# Directory of parsed model snapshots; no caching when empty.
+		config.set('cache', 'snapshot_dir', '')
+		# Directory of rendered TeX fragments; no caching when empty.
+		config.set('cache', 'fragment_dir', '')
+		config.set('cache', 'fragment_max_bytes', '67108864')
+		# Directory of the byte offset indices of XML files; next to
+		# each file when empty.
+		config.set('cache', 'offsets_dir', '')
+		config.add_section('instrumentation')
+		# Stage timers and counters; off by default.
+		config.set('instrumentation', 'enabled', 'False')
+		# File to write the JSON report of each compile to, if any.
+		config.set('instrumentation', 'output', '')
+		# Comma-separated stages to run under cProfile, or 'all', and
+		# the directory to write their pstats files to.
+		config.set('instrumentation', 'profile', '')
+		config.set('instrumentation', 'profile_dir', '')
 		config.add_section('templates')
 		config.set(
 			'templates', 'template_path', 'templates')
@@ -32,13 +83,38 @@ class KavlarConfig(object):
 
 	@classmethod
 	def read_config(cls, fname):
-		return cls.default_config().read(fname)
+		"""The default config, overridden by the options in fname."""
+		config = cls.default_config()
+		config.read(fname, encoding='utf-8')
+		return config
+
+	@classmethod
+	def copy_config(cls, config):
+		"""Returns an independent copy of config."""
+		copy = ConfigParser()
+		copy.read_dict(dict(
+			(section, dict(config.items(section, raw=True)))
+			for section in config.sections()))
+		return copy
 
 
 class KavlarCompiler(object):
 
-	def __init__(self, config):
+	def __init__(self, config, max_workers=1):
+		"""Initialize.
+
+		Args:
+			config: the KavlarConfig to compile with.
+			max_workers: size of the process pool sefarim are compiled
+				in. Sefarim are compiled serially in this process if 1;
+				None means one process per CPU.
+		"""
 		self.config = config
+		self.max_workers = max_workers
+		self.fragment_cache = fragment_cache.FragmentCache.from_config(
+			config)
+		self.instrumentation = instrumentation.Instrumentation.from_config(
+			config)
 
 		t_path = config.get('templates', 'template_path')
 		self.template_env = tex_templating.make_tex_env(
@@ -60,13 +136,157 @@ class KavlarCompiler(object):
 		return template_data
 
 	def compile_torah_model(self, root_torah_elt):
+		return ''.join(self.generate_torah_model(root_torah_elt))
+
+	def generate_torah_model(self, root_torah_elt):
+		"""Yields the TeX document of the model in pieces as compiled.
+
+		When instrumented, the time spent producing the TeX of the model
+		is the tex.content stage, and the time spent producing the whole
+		document, including the template, is the tex.document stage.
+		"""
 		assert type(root_torah_elt) == torah_model.Torah
+		instr = self.instrumentation
 
 		template_data = self.config_template_data()
+		if self.max_workers == 1 or len(root_torah_elt.stream) < 2:
+			if self.fragment_cache is not None:
+				content = self.fragment_cache.iter_torah_tex(
+					root_torah_elt, self.config)
+			else:
+				content = root_torah_elt.iter_tex(self.config)
+		else:
+			content = self._iter_parallel_tex(root_torah_elt)
 		template_data.update({
-			'tikkun_content': root_torah_elt.to_tex(self.config)
+			'tikkun_content': instr.iter_stage('tex.content', content)
 			})
 
 		# Render from template that includes header/footer
 		template = self.template_env.get_template('tikkun.tex')
-		return template.render(template_data)
+		document = template.generate(template_data)
+		if not instr.enabled:
+			return document
+		instr.count('tex.nodes', instrumentation.count_nodes(root_torah_elt))
+		return self._iter_instrumented(document)
+
+	def _iter_instrumented(self, document):
+		"""Yields the pieces of document, then saves the report."""
+		instr = self.instrumentation
+		cache = self.fragment_cache
+		if cache is not None:
+			hits, misses = cache.hits, cache.misses
+		n_chars = 0
+		for piece in instr.iter_stage('tex.document', document):
+			n_chars += len(piece)
+			yield piece
+		instr.count('tex.chars', n_chars)
+		if cache is not None:
+			instr.count('fragment_cache.hits', cache.hits - hits)
+			instr.count('fragment_cache.misses', cache.misses - misses)
+		instr.save()
+
+	def compile_xml_range(self, fname, sefer_key, first_perek=0,
+						  last_perek=None):
+		"""Compiles a range of perakim of an intermediate XML file.
+
+		Only the requested perakim are read and parsed, using the byte
+		offsets of xml_offsets.XmlOffsetIndex.
+
+		Args:
+			fname: path of the XML file.
+			sefer_key: sefer index or name.
+			first_perek, last_perek: perek indices, inclusive. Defaults
+				to the rest of the sefer.
+		"""
+		with self.instrumentation.stage('parse_xml.range'):
+			index = xml_offsets.XmlOffsetIndex.for_filename(
+				fname, self.config.get('cache', 'offsets_dir'))
+			root = index.parse_range_filename(
+				fname, sefer_key, first_perek, last_perek)
+		return self.compile_torah_model(root)
+
+	def _iter_parallel_tex(self, root_torah_elt):
+		"""Yields the TeX of each Sefer, compiled in a process pool.
+
+		The model is published once to shared memory, which each worker
+		attaches to, so a job is only the position of its Sefer. The TeX
+		is yielded in order as soon as it is ready.
+		"""
+		store = torah_store.TorahStore.from_model(root_torah_elt)
+		instr = self.instrumentation
+		with shared_store.SharedTorahStore.publish(store) as shared:
+			with ProcessPoolExecutor(
+					max_workers=self.max_workers,
+					initializer=_init_compile_worker,
+					initargs=(self.config, shared.name)) as executor:
+				jobs = range(len(root_torah_elt.stream))
+				for tex, hits, misses in executor.map(
+						_compile_sefer_job, jobs):
+					instr.count('fragment_cache.hits', hits)
+					instr.count('fragment_cache.misses', misses)
+					yield tex
+
+	def stream_torah_model(self, root_torah_elt, f, encoding=None,
+						   buffer_size=64):
+		"""Writes the TeX document of the model to f as it is compiled.
+
+		Args:
+			root_torah_elt: the Torah to compile.
+			f: a file-like object with a write method.
+			encoding: encoding to write with, for binary files.
+			buffer_size: number of pieces gathered per write.
+		"""
+		stream = jinja2.environment.TemplateStream(
+			self.generate_torah_model(root_torah_elt))
+		if buffer_size > 1:
+			stream.enable_buffering(buffer_size)
+		stream.dump(f, encoding=encoding)
+
+	def layout_torah_model(self, root_torah_elt, measure=None):
+		"""Lays out the model into lines and columns without TeX.
+
+		Args:
+			root_torah_elt: the Torah to lay out.
+			measure: optional callable giving the width of a word in
+				letters. Defaults to the metrics of the configured font,
+				or to counting letters if there is none.
+
+		Returns:
+			A layout.Layout.
+		"""
+		assert type(root_torah_elt) == torah_model.Torah
+		if measure is None:
+			measure = (
+				metrics.WordWidthService.from_config(self.config) or
+				layout.letter_count_width)
+		engine = layout.LayoutEngine.from_config(self.config, measure)
+		return engine.layout_torah(root_torah_elt)
+
+
+# The config, shared_store.SharedTorahStore and fragment_cache.FragmentCache
+# of each worker process.
+_worker_config = None
+_worker_store = None
+_worker_cache = None
+
+
+def _init_compile_worker(config, name):
+	global _worker_config, _worker_store, _worker_cache
+	_worker_config = config
+	_worker_store = shared_store.SharedTorahStore.attach(name)
+	# Forked workers leave through os._exit, which skips atexit hooks but
+	# runs multiprocessing finalizers.
+	multiprocessing.util.Finalize(
+		None, _worker_store.close, exitpriority=10)
+	_worker_cache = fragment_cache.FragmentCache.from_config(config)
+
+
+def _compile_sefer_job(n):
+	config = _worker_config
+	sefer = _worker_store.sefer(n)
+	cache = _worker_cache
+	if cache is None:
+		return sefer.to_tex(config), 0, 0
+	cache.hits = cache.misses = 0
+	tex = ''.join(cache.iter_torah_tex(sefer, config))
+	return tex, cache.hits, cache.misses
@@ -0,0 +1,669 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Native line and column layout of a torah model hierarchy.
+
+Implements a total-fit line breaker in the style of Knuth & Plass,
+"Breaking paragraphs into lines" (1981), specialized to the torah stream.
+The text is cut into paragraphs at forced breaks (petuhot, the shirah line
+breaks and the ends of sefarim). Each paragraph is a sequence of measured
+words separated by glue; a setuma is a wide glue at which breaking is
+encouraged but not required. Lines are then dealt into columns of
+lines_per_col lines.
+"""
+
+import collections
+import itertools
+import normalize
+import torah_model
+import torah_store
+
+from torah_model import ParashaDelimiter, PasukFragment
+
+
+# Widths are measured in "letters": the advance of a typical Hebrew letter.
+HEBREW_LETTERS = frozenset(chr(c) for c in range(0x05D0, 0x05EB))
+
+
+def letters_of(word):
+	"""Returns the consonantal skeleton of a word, as written in a scroll."""
+	return ''.join(c for c in word if c in HEBREW_LETTERS)
+
+
+def letter_count_width(word):
+	"""Default word measure: the number of Hebrew letters in the word.
+
+	Vowels, cantillation marks and punctuation are not written in a
+	scroll and so take up no room.
+	"""
+	return float(sum(1 for c in word if c in HEBREW_LETTERS))
+
+
+# A measured word. pasuk_id identifies the verse it came from.
+Word = collections.namedtuple('Word', ['text', 'width', 'pasuk_id'])
+
+
+class LayoutParams(object):
+	"""Numeric layout parameters, read from a KavlarConfig.
+
+	Kept as a small plain object so it can be shipped to worker processes.
+	"""
+
+	def __init__(self, line_width, lines_per_col=42,
+				 space_width=1.0, space_stretch=0.5, space_shrink=0.25,
+				 setuma_width=9.0, setuma_stretch=4.5, setuma_penalty=-50.0,
+				 tolerance=2.0, line_penalty=10.0, fitness_demerits=100.0,
+				 book_end_lines=4):
+		"""Initialize.
+
+		Args:
+			line_width: the width of a line in letters.
+			lines_per_col: number of lines in a column.
+			space_width: natural width of an inter-word space.
+			space_stretch: stretchability of an inter-word space.
+			space_shrink: shrinkability of an inter-word space.
+			setuma_width: natural width of the gap left by a setuma.
+			setuma_stretch: stretchability of a setuma gap.
+			setuma_penalty: penalty for breaking a line at a setuma.
+				Negative values encourage the break.
+			tolerance: largest adjustment ratio of a feasible line.
+			line_penalty: demerits charged for every line.
+			fitness_demerits: demerits for adjacent lines whose
+				tightness differs by more than one fitness class.
+			book_end_lines: blank lines left between sefarim.
+		"""
+		self.line_width = float(line_width)
+		self.lines_per_col = int(lines_per_col)
+		self.space_width = float(space_width)
+		self.space_stretch = float(space_stretch)
+		self.space_shrink = float(space_shrink)
+		self.setuma_width = float(setuma_width)
+		self.setuma_stretch = float(setuma_stretch)
+		self.setuma_penalty = float(setuma_penalty)
+		self.tolerance = float(tolerance)
+		self.line_penalty = float(line_penalty)
+		self.fitness_demerits = float(fitness_demerits)
+		self.book_end_lines = int(book_end_lines)
+
+	@classmethod
+	def from_config(cls, config):
+		"""Reads the formatting and layout sections of a KavlarConfig.
+
+		The line width is derived from the column shape: a column of
+		lines_per_col lines of line_height letters has height
+		lines_per_col * line_height, and aspect_ratio is height / width.
+		"""
+		lines_per_col = config.getint('formatting', 'lines_per_col')
+		aspect_ratio = config.getfloat('formatting', 'aspect_ratio')
+		line_height = config.getfloat('layout', 'line_height')
+		line_width = lines_per_col * line_height / aspect_ratio
+		return cls(
+			line_width, lines_per_col=lines_per_col,
+			space_width=config.getfloat('layout', 'space_width'),
+			space_stretch=config.getfloat('layout', 'space_stretch'),
+			space_shrink=config.getfloat('layout', 'space_shrink'),
+			setuma_width=config.getfloat('layout', 'setuma_width'),
+			setuma_stretch=config.getfloat('layout', 'setuma_stretch'),
+			setuma_penalty=config.getfloat('layout', 'setuma_penalty'),
+			tolerance=config.getfloat('layout', 'tolerance'),
+			line_penalty=config.getfloat('layout', 'line_penalty'),
+			fitness_demerits=config.getfloat('layout', 'fitness_demerits'),
+			book_end_lines=config.getint('layout', 'book_end_lines'))
+
+
+class Paragraph(object):
+	"""A run of words between two forced breaks."""
+
+	# Kinds of glue following a word.
+	SPACE = 0
+	SETUMA = 1
+
+	# Kinds of the end of the paragraph other than a ParashaDelimiter.
+	SEFER_END = 1
+	COLUMN_END = 2
+
+	def __init__(self, sefer_idx, words=None, glues=None, end_kind=None):
+		"""Initialize.
+
+		Args:
+			sefer_idx: index of the sefer the paragraph belongs to.
+			words: list of Words.
+			glues: list of glue kinds, one per word, for the glue
+				following that word. The last entry is ignored.
+			end_kind: the ParashaDelimiter kind which ended the
+				paragraph, Paragraph.SEFER_END or Paragraph.COLUMN_END.
+		"""
+		self.sefer_idx = sefer_idx
+		self.words = words or []
+		self.glues = glues or []
+		self.end_kind = end_kind
+
+	def __len__(self):
+		return len(self.words)
+
+	def append_word(self, word):
+		self.words.append(word)
+		self.glues.append(self.SPACE)
+
+	def mark_setuma(self):
+		"""A setuma follows the last word."""
+		if self.glues:
+			self.glues[-1] = self.SETUMA
+
+	@property
+	def first_pasuk_id(self):
+		return self.words[0].pasuk_id
+
+	def split_at(self, word_idx):
+		"""Splits before word_idx; the first part ends its column.
+
+		Returns:
+			The pair of Paragraphs.
+		"""
+		head = Paragraph(
+			self.sefer_idx, self.words[:word_idx], self.glues[:word_idx],
+			self.COLUMN_END)
+		tail = Paragraph(
+			self.sefer_idx, self.words[word_idx:], self.glues[word_idx:],
+			self.end_kind)
+		return head, tail
+
+	def key(self):
+		"""Hashable summary of everything the line breaker looks at."""
+		return (
+			tuple((w.text, w.width) for w in self.words),
+			tuple(self.glues))
+
+
+class ParagraphBuilder(object):
+	"""Cuts the word stream of a torah model into Paragraphs."""
+
+	# Delimiters which force a line break.
+	FORCED_BREAKS = (
+		ParashaDelimiter.PETUHA,
+		ParashaDelimiter.BOOK_END,
+		ParashaDelimiter.SHIRAH_LINE_BREAK)
+
+	def __init__(self, measure=letter_count_width, normalize=None):
+		"""Initialize.
+
+		Args:
+			measure: callable returning the width of a word in letters.
+			normalize: optional callable mapping text to the form
+				written in the scroll, applied before splitting words.
+		"""
+		self.measure = measure
+		self.normalize = normalize
+
+	def paragraphs_for_torah(self, torah):
+		"""Returns the list of Paragraphs of all the sefarim in order."""
+		ret = []
+		for sefer in torah.iter_stream:
+			ret.extend(self.paragraphs_for_sefer(sefer))
+		return ret
+
+	def paragraphs_for_sefer(self, sefer):
+		"""Returns the list of Paragraphs in this Sefer.
+
+		The last paragraph of a sefer always ends with SEFER_END.
+		"""
+		paragraphs = self.paragraphs_for_events(
+			sefer.sefer_idx, torah_model.ModelEvents(sefer))
+		if paragraphs:
+			paragraphs[-1].end_kind = Paragraph.SEFER_END
+		return paragraphs
+
+	def paragraphs_for_store(self, store):
+		"""Returns the Paragraphs of a torah_store.TorahStore.
+
+		The same as paragraphs_for_torah on the stored model, read
+		directly from the arrays of the store.
+		"""
+		ret = []
+		kinds = store.kinds
+		for sefer in store.find(torah_store.SEFER):
+			self._paragraphs = []
+			self._current = Paragraph(store.indices[sefer])
+			for i in range(sefer + 1, store.ends[sefer]):
+				if kinds[i] == torah_store.PASUK_FRAGMENT:
+					self._add_stored_fragment(store, i)
+			self._end_paragraph(None)
+			if self._paragraphs:
+				self._paragraphs[-1].end_kind = Paragraph.SEFER_END
+			ret.extend(self._paragraphs)
+			del self._paragraphs, self._current
+		return ret
+
+	def paragraphs_for_fragments(self, sefer_idx, fragments):
+		"""Returns the Paragraphs of consecutive PasukFragments of a sefer.
+
+		Words following the last forced break form a final paragraph
+		whose end_kind is None.
+		"""
+		events = itertools.chain.from_iterable(
+			torah_model.ModelEvents(f) for f in fragments)
+		return self.paragraphs_for_events(sefer_idx, events)
+
+	def paragraphs_for_events(self, sefer_idx, events):
+		"""Returns the Paragraphs of the PasukFragments of a traversal.
+
+		Args:
+			sefer_idx: index of the sefer of the fragments.
+			events: the events of torah_model.ModelEvents of the sefer,
+				or of consecutive fragments of it.
+		"""
+		self._paragraphs = []
+		self._current = Paragraph(sefer_idx)
+		# The text of the open PasukFragment since its last delimiter.
+		text = None
+		for kind, elt, _, _, _ in events:
+			t = type(elt)
+			if t is PasukFragment:
+				if kind == torah_model.ENTER:
+					pasuk_id = elt.pasuk_id
+					text = []
+				else:
+					self._add_text(''.join(text), pasuk_id)
+					text = None
+			elif text is None:
+				continue
+			elif t is ParashaDelimiter:
+				self._add_text(''.join(text), pasuk_id)
+				text = []
+				self._add_delimiter(elt.kind)
+			else:
+				text.append(elt.text or '')
+		self._end_paragraph(None)
+		ret = self._paragraphs
+		del self._paragraphs, self._current
+		return ret
+
+	def _add_stored_fragment(self, store, i):
+		kinds = store.kinds
+		labels = store.labels
+		strings = store.strings
+		pasuk_id = strings[store.idents[i]]
+		text = []
+		for j in range(i + 1, store.ends[i]):
+			kind = kinds[j]
+			if kind in torah_store.DELIMITER_CODES:
+				self._add_text(''.join(text), pasuk_id)
+				text = []
+				self._add_delimiter(torah_store.DELIMITER_CODES[kind])
+			elif labels[j] >= 0:
+				text.append(strings[labels[j]])
+		self._add_text(''.join(text), pasuk_id)
+
+	def _add_text(self, text, pasuk_id):
+		if self.normalize is not None:
+			text = self.normalize(text)
+		for w in text.split():
+			width = self.measure(w)
+			if width > 0:
+				self._current.append_word(Word(w, width, pasuk_id))
+
+	def _add_delimiter(self, kind):
+		if kind in self.FORCED_BREAKS:
+			self._end_paragraph(kind)
+		elif kind == ParashaDelimiter.SETUMA:
+			self._current.mark_setuma()
+
+	def _end_paragraph(self, end_kind):
+		if not self._current.words:
+			return
+		self._current.end_kind = end_kind
+		self._paragraphs.append(self._current)
+		self._current = Paragraph(self._current.sefer_idx)
+
+
+class Line(object):
+	"""A line of the layout."""
+
+	def __init__(self, words, ratio=0.0, natural_width=0.0,
+				 stretch=0.0, shrink=0.0, demerits=0.0, is_last=False):
+		"""Initialize.
+
+		Args:
+			words: list of Words on the line. Empty for a blank line.
+			ratio: the adjustment ratio of the glue on the line.
+			natural_width: width of the line with unadjusted glue.
+			stretch: total stretchability of the glue on the line.
+			shrink: total shrinkability of the glue on the line.
+			demerits: demerits charged for breaking after this line.
+			is_last: whether this line ends its paragraph.
+		"""
+		self.words = words
+		self.ratio = ratio
+		self.natural_width = natural_width
+		self.stretch = stretch
+		self.shrink = shrink
+		self.demerits = demerits
+		self.is_last = is_last
+
+	@property
+	def is_blank(self):
+		return not self.words
+
+	@property
+	def first_pasuk_id(self):
+		if not self.words:
+			return None
+		return self.words[0].pasuk_id
+
+	def __str__(self):
+		return ' '.join(w.text for w in self.words)
+
+
+class Column(object):
+	"""A column of the layout."""
+
+	def __init__(self, column_idx, lines):
+		self.column_idx = column_idx
+		self.lines = lines
+
+	def __len__(self):
+		return len(self.lines)
+
+	@property
+	def first_word(self):
+		for line in self.lines:
+			if line.words:
+				return line.words[0]
+		return None
+
+
+class Layout(object):
+	"""Result of laying out a torah: lines dealt into columns."""
+
+	def __init__(self, lines, lines_per_col, line_width, columns=None):
+		"""Initialize.
+
+		Args:
+			lines: all the Lines in order.
+			lines_per_col: number of lines in a full column.
+			line_width: the width of a line in letters.
+			columns: the Columns, if not simply consecutive runs of
+				lines_per_col lines.
+		"""
+		self.lines = lines
+		self.lines_per_col = lines_per_col
+		self.line_width = line_width
+		if columns is None:
+			columns = self.make_columns(lines, lines_per_col)
+		self.columns = columns
+
+	@staticmethod
+	def make_columns(lines, lines_per_col, first_column_idx=0):
+		return [
+			Column(first_column_idx + i, lines[start:start + lines_per_col])
+			for i, start in enumerate(range(0, len(lines), lines_per_col))]
+
+	@property
+	def n_columns(self):
+		return len(self.columns)
+
+	@property
+	def total_demerits(self):
+		return sum(line.demerits for line in self.lines)
+
+
+class _Breakpoint(object):
+	"""An active node of the line breaker."""
+
+	__slots__ = ('position', 'line', 'fitness', 'demerits', 'ratio', 'prev')
+
+	def __init__(self, position, line, fitness, demerits, ratio, prev):
+		self.position = position
+		self.line = line
+		self.fitness = fitness
+		self.demerits = demerits
+		self.ratio = ratio
+		self.prev = prev
+
+
+class KnuthPlassBreaker(object):
+	"""Total-fit line breaking of a single Paragraph."""
+
+	AWFUL_BADNESS = 10000.0
+
+	# Fitness classes, as in TeX.
+	VERY_LOOSE = 0
+	LOOSE = 1
+	DECENT = 2
+	TIGHT = 3
+
+	def __init__(self, params):
+		self.params = params
+
+	@classmethod
+	def fitness_class(cls, ratio):
+		if ratio < -0.5:
+			return cls.TIGHT
+		if ratio <= 0.5:
+			return cls.DECENT
+		if ratio <= 1.0:
+			return cls.LOOSE
+		return cls.VERY_LOOSE
+
+	def _glue_metrics(self, paragraph):
+		"""Prefix sums of the word widths and glue of a paragraph."""
+		p = self.params
+		glue_table = {
+			Paragraph.SPACE: (
+				p.space_width, p.space_stretch, p.space_shrink),
+			Paragraph.SETUMA: (
+				p.setuma_width, p.setuma_stretch, 0.0)
+		}
+		n = len(paragraph.words)
+		widths = [0.0] * (n + 1)
+		glue = [0.0] * (n + 1)
+		stretch = [0.0] * (n + 1)
+		shrink = [0.0] * (n + 1)
+		w_sum = g_sum = y_sum = z_sum = 0.0
+		for i, word in enumerate(paragraph.words):
+			w_sum += word.width
+			widths[i + 1] = w_sum
+			g, y, z = glue_table[paragraph.glues[i]]
+			g_sum += g
+			y_sum += y
+			z_sum += z
+			glue[i + 1] = g_sum
+			stretch[i + 1] = y_sum
+			shrink[i + 1] = z_sum
+		return widths, glue, stretch, shrink
+
+	def break_paragraph(self, paragraph, looseness=0):
+		"""Returns a list of Lines for this paragraph.
+
+		Args:
+			paragraph: the Paragraph to break.
+			looseness: as in TeX, prefer a layout with this many more
+				(or fewer, if negative) lines than the optimum.
+		"""
+		if not paragraph.words:
+			return []
+		best = self._break(paragraph, self.params.tolerance, looseness)
+		if best is None:
+			# Emergency pass: accept arbitrarily loose lines. Looseness is
+			# not honored, since almost any number of lines is feasible.
+			best = self._break(paragraph, float('inf'), 0)
+		return self._make_lines(paragraph, best)
+
+	def _break(self, paragraph, tolerance, looseness):
+		p = self.params
+		line_width = p.line_width
+		emergency = tolerance == float('inf')
+		widths, glue, stretch, shrink = self._glue_metrics(paragraph)
+		setuma_penalty = p.setuma_penalty
+		line_penalty = p.line_penalty
+		fitness_demerits = p.fitness_demerits
+		n = len(paragraph.words)
+		glues = paragraph.glues
+
+		active = [_Breakpoint(0, 0, self.DECENT, 0.0, 0.0, None)]
+		for b in range(1, n + 1):
+			is_last = b == n
+			penalty = 0.0
+			if not is_last and glues[b - 1] == Paragraph.SETUMA:
+				penalty = setuma_penalty
+
+			candidates = {}
+			kept = []
+			for i, node in enumerate(active):
+				a = node.position
+				natural = widths[b] - widths[a] + glue[b - 1] - glue[a]
+				if natural < line_width:
+					if is_last:
+						ratio = 0.0
+					else:
+						y = stretch[b - 1] - stretch[a]
+						ratio = (
+							(line_width - natural) / y if y > 0
+							else float('inf'))
+				elif natural > line_width:
+					z = shrink[b - 1] - shrink[a]
+					ratio = (
+						(line_width - natural) / z if z > 0
+						else float('-inf'))
+				else:
+					ratio = 0.0
+
+				if ratio < -1.0:
+					# Overfull: the node can never start a feasible
+					# line again and is deactivated.
+					if (emergency and not kept and not candidates and
+							i == len(active) - 1):
+						# Nothing else fits: accept an overfull line.
+						ratio = -1.0
+					else:
+						continue
+				else:
+					kept.append(node)
+				if ratio > tolerance:
+					continue
+
+				badness = min(
+					100.0 * abs(ratio) ** 3, self.AWFUL_BADNESS)
+				demerits = (line_penalty + badness) ** 2
+				if penalty > 0:
+					demerits += penalty ** 2
+				elif penalty < 0:
+					demerits -= penalty ** 2
+				fitness = self.fitness_class(ratio)
+				if abs(fitness - node.fitness) > 1:
+					demerits += fitness_demerits
+				demerits += node.demerits
+
+				key = fitness
+				if looseness:
+					key = (fitness, node.line + 1)
+				prior = candidates.get(key)
+				if prior is None or demerits < prior.demerits:
+					candidates[key] = _Breakpoint(
+						b, node.line + 1, fitness, demerits, ratio, node)
+
+			active = kept
+			if is_last:
+				if not candidates:
+					return None
+				return self._choose(list(candidates.values()), looseness)
+			if not active and not candidates:
+				return None
+			active.extend(candidates.values())
+		return None
+
+	@staticmethod
+	def _choose(finals, looseness):
+		best = min(finals, key=lambda node: node.demerits)
+		if not looseness:
+			return best
+		target = best.line + looseness
+		return min(
+			finals,
+			key=lambda node: (abs(node.line - target), node.demerits))
+
+	def _make_lines(self, paragraph, final):
+		breaks = []
+		node = final
+		while node.prev is not None:
+			breaks.append(node)
+			node = node.prev
+		breaks.reverse()
+
+		widths, glue, stretch, shrink = self._glue_metrics(paragraph)
+		lines = []
+		a = 0
+		for node in breaks:
+			b = node.position
+			lines.append(Line(
+				paragraph.words[a:b], ratio=node.ratio,
+				natural_width=widths[b] - widths[a] + glue[b - 1] - glue[a],
+				stretch=stretch[b - 1] - stretch[a],
+				shrink=shrink[b - 1] - shrink[a],
+				demerits=node.demerits - node.prev.demerits,
+				is_last=b == len(paragraph.words)))
+			a = b
+		return lines
+
+
+class LayoutEngine(object):
+	"""Lays out a whole torah model into lines and columns."""
+
+	def __init__(self, params, measure=letter_count_width, normalize=None):
+		"""Initialize.
+
+		Args:
+			params: LayoutParams.
+			measure: callable returning the width of a word in letters.
+			normalize: optional callable applied to the text before it
+				is split into words.
+		"""
+		self.params = params
+		self.builder = ParagraphBuilder(measure, normalize)
+		self.breaker = KnuthPlassBreaker(params)
+
+	@classmethod
+	def from_config(cls, config, measure=letter_count_width):
+		"""Lays out the text as normalized by the formatting options."""
+		normalizer = normalize.TextNormalizer.from_config(config)
+		return cls(
+			LayoutParams.from_config(config), measure, normalizer.normalize)
+
+	def join_lines(self, paragraphs, paragraph_lines):
+		"""Concatenates the lines of consecutive broken paragraphs.
+
+		Blank lines are left after the end of each sefer but the last.
+
+		Args:
+			paragraphs: list of Paragraphs.
+			paragraph_lines: list of the Lines of each paragraph.
+		"""
+		lines = []
+		last = len(paragraphs) - 1
+		for i, paragraph in enumerate(paragraphs):
+			lines.extend(paragraph_lines[i])
+			lines.extend(
+				Line([]) for _ in range(self.n_blank_lines_after(
+					paragraph, i == last)))
+		return lines
+
+	def n_blank_lines_after(self, paragraph, is_final=False):
+		"""Number of blank lines left after a paragraph."""
+		if paragraph.end_kind == Paragraph.SEFER_END and not is_final:
+			return self.params.book_end_lines
+		return 0
+
+	def break_paragraphs(self, paragraphs):
+		"""Returns the lines of consecutive paragraphs."""
+		broken = [self.breaker.break_paragraph(p) for p in paragraphs]
+		return self.join_lines(paragraphs, broken)
+
+	def layout_paragraphs(self, paragraphs):
+		lines = self.break_paragraphs(paragraphs)
+		return Layout(
+			lines, self.params.lines_per_col, self.params.line_width)
+
+	def layout_torah(self, torah):
+		"""Returns the Layout of this Torah."""
+		paragraphs = self.builder.paragraphs_for_torah(torah)
+		return self.layout_paragraphs(paragraphs)
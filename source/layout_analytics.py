@@ -0,0 +1,315 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Quality statistics of a computed layout, with NumPy.
+
+LayoutAnalytics copies the lines of a layout.Layout into flat arrays once
+and computes everything else with array operations over all the lines
+together: the adjustment ratio and badness of each line as the line
+breaker defines them, the mean inter-word space the ratio leaves, and how
+the whitespace is spread over the columns. Scoring the ~10k lines of a
+whole Torah takes a few milliseconds, so that every candidate of a
+sweep.ConfigSweep can be scored. The report, a summary with histograms,
+per-column statistics and the worst lines, is exported as JSON. Run from
+the source directory:
+
+	python layout_analytics.py -o report.json
+"""
+
+import argparse
+import itertools
+import json
+import layout
+import numpy as np
+import snapshot
+import sys
+
+from kavlar import KavlarCompiler, KavlarConfig
+from operator import attrgetter, itemgetter
+
+
+# Justified lines whose ratio is above LOOSE_RATIO stretch their glue by
+# more than its stretchability; those below TIGHT_RATIO shrink it by more
+# than half its shrinkability, and those below -1 are overfull.
+LOOSE_RATIO = 1.0
+TIGHT_RATIO = -0.5
+
+# Edges of the bins of the ratio histogram. Ratios beyond the outer edges
+# are counted in the outer bins.
+RATIO_BINS = np.linspace(-1.0, 3.0, 17)
+
+# Number of bins of the inter-word space histogram, which spans zero to
+# four natural spaces.
+N_SPACING_BINS = 16
+
+
+def _number(x):
+	"""A float for JSON, or None if x is not finite."""
+	x = float(x)
+	return x if np.isfinite(x) else None
+
+
+class LayoutAnalytics(object):
+	"""Per-line and per-column statistics of a layout.Layout.
+
+	Arrays hold one entry per line, in order. Justified lines are the
+	lines with words which do not end a paragraph; the summary statistics
+	of ratios and spacing are over those only.
+
+	Attributes:
+		ratios: adjustment ratio of the glue of each line; 0 for blank
+			lines and for last lines shorter than the line width. Unlike
+			Line.ratio, overfull lines keep their ratio below -1.
+		badness: badness of each line, as in the line breaker.
+		spacing: mean width of the gaps between the words of each line as
+			set, i.e. with the glue adjusted; NaN for lines of fewer than
+			two words.
+		column_of: index in lay.columns of the column of each line.
+	"""
+
+	def __init__(self, lay, params):
+		"""Initialize.
+
+		Args:
+			lay: the layout.Layout to analyze.
+			params: the layout.LayoutParams it was laid out with.
+		"""
+		self.layout = lay
+		self.params = params
+		lines = lay.lines
+		n = len(lines)
+		line_width = float(lay.line_width)
+
+		self.n_words = np.fromiter(
+			map(len, map(attrgetter('words'), lines)), np.int64, n)
+		self.natural = np.fromiter(
+			map(attrgetter('natural_width'), lines), np.float64, n)
+		self.stretch = np.fromiter(
+			map(attrgetter('stretch'), lines), np.float64, n)
+		self.shrink = np.fromiter(
+			map(attrgetter('shrink'), lines), np.float64, n)
+		self.is_last = np.fromiter(
+			map(attrgetter('is_last'), lines), np.bool_, n)
+		word_widths = np.fromiter(
+			map(itemgetter(1), itertools.chain.from_iterable(
+				map(attrgetter('words'), lines))),
+			np.float64, int(self.n_words.sum()))
+
+		ends = np.cumsum(self.n_words)
+		sums = np.concatenate(([0.0], np.cumsum(word_widths)))
+		self.word_width = sums[ends] - sums[ends - self.n_words]
+
+		self.has_words = self.n_words > 0
+		self.justified = self.has_words & ~self.is_last
+
+		slack = line_width - self.natural
+		ratios = np.zeros(n)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			loose = self.justified & (slack > 0)
+			ratios[loose] = slack[loose] / self.stretch[loose]
+			over = self.has_words & (slack < 0)
+			ratios[over] = slack[over] / self.shrink[over]
+		self.ratios = ratios
+		self.badness = np.minimum(
+			100.0 * np.abs(ratios) ** 3,
+			layout.KnuthPlassBreaker.AWFUL_BADNESS)
+
+		# The glue fills the line on justified lines and keeps its
+		# natural width on the others.
+		self.interword = np.where(
+			self.justified, line_width - self.word_width,
+			np.where(self.has_words, self.natural - self.word_width, 0.0))
+		with np.errstate(divide='ignore', invalid='ignore'):
+			self.spacing = np.where(
+				self.n_words > 1, self.interword / (self.n_words - 1), np.nan)
+
+		sizes = [len(column) for column in lay.columns]
+		if sum(sizes) != n:
+			raise ValueError('The columns do not hold the lines of the layout')
+		self.column_of = np.repeat(np.arange(len(sizes)), sizes)
+		starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+		self.line_in_column = np.arange(n) - np.repeat(
+			starts.astype(np.int64), sizes)
+
+	def __len__(self):
+		return len(self.ratios)
+
+	def summary(self):
+		"""Statistics of the whole layout, as a dict of plain values."""
+		ratios = self.ratios[self.justified]
+		abs_ratios = np.abs(ratios)
+		finite = np.isfinite(ratios)
+		badness = self.badness[self.justified]
+		spacing = self.spacing[self.justified & (self.n_words > 1)]
+		n = len(ratios)
+
+		def stat(f, values):
+			return _number(f(values)) if len(values) else None
+
+		return dict(
+			n_lines=len(self),
+			n_columns=self.layout.n_columns,
+			n_blank_lines=int(np.count_nonzero(~self.has_words)),
+			n_justified_lines=n,
+			total_demerits=_number(self.layout.total_demerits),
+			mean_abs_ratio=stat(np.mean, abs_ratios[finite]),
+			median_abs_ratio=stat(np.median, abs_ratios[finite]),
+			p95_abs_ratio=stat(
+				lambda a: np.percentile(a, 95), abs_ratios[finite]),
+			max_ratio=stat(np.max, ratios),
+			min_ratio=stat(np.min, ratios),
+			mean_badness=stat(np.mean, badness),
+			total_badness=_number(badness.sum()),
+			loose_lines=int(np.count_nonzero(ratios > LOOSE_RATIO)),
+			tight_lines=int(np.count_nonzero(ratios < TIGHT_RATIO)),
+			overfull_lines=int(np.count_nonzero(
+				self.has_words & (self.ratios < -1.0))),
+			infeasible_lines=int(np.count_nonzero(
+				ratios > self.params.tolerance)),
+			mean_spacing=stat(np.mean, spacing),
+			spacing_std=stat(np.std, spacing),
+			column_whitespace_std=stat(
+				np.std, self.column_whitespace()[:-1]))
+
+	def column_whitespace(self):
+		"""Fraction of the width of each column's lines left between words.
+
+		Blank lines and the space after the last line of a paragraph are
+		not counted as whitespace, but their lines are.
+		"""
+		n_columns = self.layout.n_columns
+		total = np.bincount(
+			self.column_of, weights=self.interword, minlength=n_columns)
+		n_lines = np.bincount(self.column_of, minlength=n_columns)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			return total / (n_lines * float(self.layout.line_width))
+
+	def column_stats(self):
+		"""Statistics of each column, as a dict of per-column lists."""
+		n_columns = self.layout.n_columns
+		columns = self.column_of
+		justified = self.justified
+		abs_ratios = np.where(
+			justified & np.isfinite(self.ratios), np.abs(self.ratios), 0.0)
+		n_justified = np.bincount(
+			columns, weights=justified, minlength=n_columns)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			mean_abs_ratio = np.bincount(
+				columns, weights=abs_ratios, minlength=n_columns) / n_justified
+		max_badness = np.zeros(n_columns)
+		np.maximum.at(max_badness, columns, self.badness)
+
+		def count(mask):
+			return np.bincount(columns[mask], minlength=n_columns).tolist()
+
+		return dict(
+			column_idx=[column.column_idx for column in self.layout.columns],
+			n_lines=np.bincount(columns, minlength=n_columns).tolist(),
+			blank_lines=count(~self.has_words),
+			whitespace=[_number(x) for x in self.column_whitespace()],
+			mean_abs_ratio=[_number(x) for x in mean_abs_ratio],
+			max_badness=max_badness.tolist(),
+			loose_lines=count(justified & (self.ratios > LOOSE_RATIO)),
+			tight_lines=count(justified & (self.ratios < TIGHT_RATIO)))
+
+	def histograms(self):
+		"""Histograms of the ratios and spacing of the justified lines.
+
+		Returns:
+			A dict of histograms, each a dict of the bin edges and the
+			counts of the bins.
+		"""
+		ratios = self.ratios[self.justified]
+		clipped = np.clip(ratios, RATIO_BINS[0], RATIO_BINS[-1])
+		ratio_counts, _ = np.histogram(clipped, RATIO_BINS)
+
+		spacing_bins = np.linspace(
+			0.0, 4.0 * self.params.space_width, N_SPACING_BINS + 1)
+		spacing = self.spacing[self.justified & (self.n_words > 1)]
+		spacing = np.clip(
+			spacing[np.isfinite(spacing)], spacing_bins[0], spacing_bins[-1])
+		spacing_counts, _ = np.histogram(spacing, spacing_bins)
+		return dict(
+			ratio=dict(
+				edges=RATIO_BINS.tolist(), counts=ratio_counts.tolist()),
+			spacing=dict(
+				edges=spacing_bins.tolist(), counts=spacing_counts.tolist()))
+
+	def worst_lines(self, n=10):
+		"""The n lines with the most badness, worst first.
+
+		Lines of equal badness are ordered by the size of their ratio, so
+		overfull lines and lines without glue come first.
+
+		Returns:
+			A list of dicts describing the lines.
+		"""
+		candidates = np.flatnonzero(self.has_words & (self.badness > 0))
+		order = np.lexsort((
+			-np.abs(self.ratios[candidates]), -self.badness[candidates]))
+		ret = []
+		for i in candidates[order[:n]]:
+			line = self.layout.lines[i]
+			ret.append(dict(
+				line=int(i),
+				column=int(self.layout.columns[self.column_of[i]].column_idx),
+				line_in_column=int(self.line_in_column[i]),
+				pasuk_id=line.first_pasuk_id,
+				ratio=_number(self.ratios[i]),
+				badness=float(self.badness[i]),
+				spacing=_number(self.spacing[i]),
+				n_words=int(self.n_words[i]),
+				is_last=bool(self.is_last[i]),
+				text=str(line)))
+		return ret
+
+	def report(self, n_worst=10):
+		"""The full report of the layout, as a JSON-serializable dict."""
+		return dict(
+			line_width=float(self.layout.line_width),
+			lines_per_col=self.layout.lines_per_col,
+			summary=self.summary(),
+			histograms=self.histograms(),
+			columns=self.column_stats(),
+			worst_lines=self.worst_lines(n_worst))
+
+	def write_json(self, f, n_worst=10):
+		"""Writes the report to the file object f."""
+		json.dump(self.report(n_worst), f, indent=2, ensure_ascii=False)
+		f.write('\n')
+
+
+def main():
+	parser = argparse.ArgumentParser(
+		description='Reports the quality of the native layout of the Torah.')
+	parser.add_argument(
+		'-x', '--xml_filename', default='../data/xml_torah/torah.xml',
+		help='Intermediate XML file of the Torah.')
+	parser.add_argument(
+		'-c', '--config_filename', default=None,
+		help='Config file of the layout.')
+	parser.add_argument(
+		'-o', '--output_filename', default=None,
+		help='File to write the JSON report to; standard output if none.')
+	parser.add_argument(
+		'-n', '--n_worst', type=int, default=10,
+		help='Number of worst lines to list.')
+	args = parser.parse_args()
+
+	if args.config_filename:
+		config = KavlarConfig.read_config(args.config_filename)
+	else:
+		config = KavlarConfig.default_config()
+	torah = snapshot.parse_xml_filename(args.xml_filename, config)
+	lay = KavlarCompiler(config).layout_torah_model(torah)
+	analytics = LayoutAnalytics(lay, layout.LayoutParams.from_config(config))
+	if args.output_filename:
+		with open(args.output_filename, 'w', encoding='utf-8') as f:
+			analytics.write_json(f, args.n_worst)
+	else:
+		analytics.write_json(sys.stdout, args.n_worst)
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
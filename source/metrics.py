@@ -0,0 +1,243 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Glyph metrics of the tikkun font and a memoized word-width service.
+
+The advance widths (and legacy kern-table kerning, where present) of a
+TTF/OTF font are read once with fontTools and stored in a compact table
+of sorted arrays, which can be saved to disk and loaded back without
+fontTools. A saved table records the SHA-256 of the font it was read
+from, so that a table is rebuilt when its font changes. WordWidthService
+measures words with such a table, caching the widths of recently seen
+word forms.
+"""
+
+import array
+import bisect
+import functools
+import hashlib
+import struct
+import unicodedata
+
+try:
+	from fontTools.ttLib import TTFont
+except ImportError:
+	TTFont = None
+
+
+# The letters whose mean advance is the unit of layout widths.
+HEBREW_LETTERS = u''.join(chr(c) for c in range(0x05D0, 0x05EB))
+
+
+def font_digest(fname):
+	"""SHA-256 of the contents of a font file."""
+	h = hashlib.sha256()
+	with open(fname, 'rb') as f:
+		for chunk in iter(lambda: f.read(1 << 20), b''):
+			h.update(chunk)
+	return h.digest()
+
+
+def strip_marks(word):
+	"""Drops combining marks (vowels, cantillation), which take no room."""
+	return u''.join(c for c in word if not unicodedata.combining(c))
+
+
+class GlyphMetrics(object):
+	"""Advance widths and kerning by code point, in ems."""
+
+	MAGIC = b'KVGM'
+	VERSION = 2
+	_HEADER = struct.Struct('<4sHfII32s')
+
+	def __init__(self, codepoints, advances, kern_pairs=None,
+				 kern_values=None, default_advance=0.0, font_digest=None):
+		"""Initialize.
+
+		Args:
+			codepoints: sorted array('I') of mapped code points.
+			advances: array('f') of the advance of each code point.
+			kern_pairs: sorted array('Q') of (left << 32 | right)
+				code point pairs.
+			kern_values: array('f') of the kerning of each pair.
+			default_advance: advance of unmapped characters.
+			font_digest: font_digest() of the font the metrics were read
+				from, or None if unknown.
+		"""
+		self.codepoints = codepoints
+		self.advances = advances
+		self.kern_pairs = kern_pairs or array.array('Q')
+		self.kern_values = kern_values or array.array('f')
+		self.default_advance = default_advance
+		self.font_digest = font_digest
+
+	@classmethod
+	def from_font_file(cls, fname):
+		"""Extracts the metrics of a TTF/OTF file. Requires fontTools."""
+		if TTFont is None:
+			raise ImportError('fontTools is required to read font files')
+		font = TTFont(fname, lazy=True)
+		units = float(font['head'].unitsPerEm)
+		hmtx = font['hmtx'].metrics
+		cmap = font.getBestCmap()
+
+		codepoints = array.array('I', sorted(cmap))
+		advances = array.array(
+			'f', (hmtx[cmap[c]][0] / units for c in codepoints))
+		default_advance = 0.0
+		if '.notdef' in hmtx:
+			default_advance = hmtx['.notdef'][0] / units
+
+		kerning = {}
+		if 'kern' in font:
+			glyph_codepoints = {}
+			for c in codepoints:
+				glyph_codepoints.setdefault(cmap[c], []).append(c)
+			for table in font['kern'].kernTables:
+				pairs = getattr(table, 'kernTable', {})
+				for (left, right), value in pairs.items():
+					for lc in glyph_codepoints.get(left, ()):
+						for rc in glyph_codepoints.get(right, ()):
+							kerning[lc << 32 | rc] = value / units
+		pairs = sorted(kerning)
+		return cls(
+			codepoints, advances, array.array('Q', pairs),
+			array.array('f', (kerning[p] for p in pairs)),
+			default_advance, font_digest(fname))
+
+	@classmethod
+	def load(cls, fname):
+		"""Reads a table written by save()."""
+		with open(fname, 'rb') as f:
+			header = f.read(cls._HEADER.size)
+			if len(header) != cls._HEADER.size:
+				raise ValueError('%s is not a glyph metrics table' % fname)
+			magic, version, default_advance, n_glyphs, n_kern, digest = (
+				cls._HEADER.unpack(header))
+			if magic != cls.MAGIC or version != cls.VERSION:
+				raise ValueError('%s is not a glyph metrics table' % fname)
+			codepoints = array.array('I')
+			codepoints.fromfile(f, n_glyphs)
+			advances = array.array('f')
+			advances.fromfile(f, n_glyphs)
+			kern_pairs = array.array('Q')
+			kern_pairs.fromfile(f, n_kern)
+			kern_values = array.array('f')
+			kern_values.fromfile(f, n_kern)
+		return cls(
+			codepoints, advances, kern_pairs, kern_values, default_advance,
+			digest if any(digest) else None)
+
+	def save(self, fname):
+		"""Writes the table in a compact binary form."""
+		with open(fname, 'wb') as f:
+			f.write(self._HEADER.pack(
+				self.MAGIC, self.VERSION, self.default_advance,
+				len(self.codepoints), len(self.kern_pairs),
+				self.font_digest or bytes(32)))
+			self.codepoints.tofile(f)
+			self.advances.tofile(f)
+			self.kern_pairs.tofile(f)
+			self.kern_values.tofile(f)
+
+	def advance(self, char):
+		c = ord(char)
+		i = bisect.bisect_left(self.codepoints, c)
+		if i < len(self.codepoints) and self.codepoints[i] == c:
+			return self.advances[i]
+		return self.default_advance
+
+	def kerning(self, left, right):
+		if not self.kern_pairs:
+			return 0.0
+		pair = ord(left) << 32 | ord(right)
+		i = bisect.bisect_left(self.kern_pairs, pair)
+		if i < len(self.kern_pairs) and self.kern_pairs[i] == pair:
+			return self.kern_values[i]
+		return 0.0
+
+	def text_width(self, text):
+		"""Width of a run of text in ems, including kerning."""
+		width = 0.0
+		prev = None
+		for char in text:
+			width += self.advance(char)
+			if prev is not None:
+				width += self.kerning(prev, char)
+			prev = char
+		return width
+
+	def mean_advance(self, chars=HEBREW_LETTERS):
+		"""Mean advance of the mapped characters among chars."""
+		mapped = frozenset(self.codepoints)
+		advances = [self.advance(c) for c in chars if ord(c) in mapped]
+		if not advances:
+			return self.default_advance
+		return sum(advances) / len(advances)
+
+
+class WordWidthService(object):
+	"""Memoized word widths for the layout engine.
+
+	Words are measured in units of the font's mean Hebrew letter advance,
+	the unit of the layout section of KavlarConfig. Instances are callable
+	and can be passed as the measure of a layout.LayoutEngine.
+	"""
+
+	def __init__(self, metrics, cache_size=65536, normalize=strip_marks):
+		"""Initialize.
+
+		Args:
+			metrics: the GlyphMetrics to measure with.
+			cache_size: most distinct word forms kept in the cache.
+			normalize: maps a word to the text which is actually
+				written, and is the cache key.
+		"""
+		self.metrics = metrics
+		self.normalize = normalize
+		self.unit = metrics.mean_advance() or 1.0
+		self._width = functools.lru_cache(maxsize=cache_size)(
+			self._measure)
+
+	@classmethod
+	def from_font_file(cls, fname, cache_size=65536):
+		return cls(GlyphMetrics.from_font_file(fname), cache_size)
+
+	@classmethod
+	def from_config(cls, config):
+		"""Returns the service for the configured font, or None.
+
+		Reads the metrics table from metrics_table if it exists and was
+		read from the current contents of font_file, else extracts it from
+		font_file and saves it to metrics_table. Without a font_file, the
+		table is used as is.
+		"""
+		font_file = config.get('metrics', 'font_file')
+		table = config.get('metrics', 'metrics_table')
+		cache_size = config.getint('metrics', 'width_cache_size')
+		if table:
+			try:
+				metrics = GlyphMetrics.load(table)
+				if (not font_file or
+						metrics.font_digest == font_digest(font_file)):
+					return cls(metrics, cache_size)
+			except (IOError, OSError, ValueError):
+				pass
+		if not font_file:
+			return None
+		metrics = GlyphMetrics.from_font_file(font_file)
+		if table:
+			metrics.save(table)
+		return cls(metrics, cache_size)
+
+	def _measure(self, key):
+		return self.metrics.text_width(key) / self.unit
+
+	def word_width(self, word):
+		"""Width of the written form of word, in letters."""
+		return self._width(self.normalize(word))
+
+	__call__ = word_width
+
+	def cache_info(self):
+		return self._width.cache_info()
@@ -0,0 +1,133 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Normalization of the Hebrew text for the scroll.
+
+A Torah scroll is written without vowels, cantillation marks or verse
+punctuation. The Mechon Mamre text carries all of them. TextNormalizer
+removes them according to the formatting options of a KavlarConfig, using
+precomputed str.translate tables, either over the text of a torah model or
+directly over the characters of an XML file.
+"""
+
+import codecs
+import functools
+
+
+# Cantillation marks (te'amim).
+CANTILLATION_MARKS = frozenset(range(0x0591, 0x05B0))
+
+# Vowel points, dagesh, meteg, rafe, shin and sin dots, and the joiners
+# Mechon Mamre places between marks. The upper dot (U+05C4) of the puncta
+# extraordinaria and the inverted nun (U+05C6) are written in the scroll
+# and are kept.
+VOWEL_MARKS = frozenset(
+	list(range(0x05B0, 0x05BE)) +
+	[0x05BF, 0x05C1, 0x05C2, 0x05C5, 0x05C7, 0x200D])
+
+MAQAF = u'־'
+PASEQ = u'׀'
+SOF_PASUK = u'׃'
+
+# Punctuation policies.
+KEEP = 'keep'
+REMOVE = 'remove'
+SPACE = 'space'
+
+
+@functools.lru_cache(maxsize=None)
+def make_translate_table(strip_vowels, strip_cantillation,
+						 maqaf=KEEP, sof_pasuk=KEEP, paseq=KEEP):
+	"""Returns a str.translate table for these options.
+
+	Args:
+		strip_vowels: whether to remove vowel points.
+		strip_cantillation: whether to remove cantillation marks.
+		maqaf: KEEP, REMOVE, or SPACE to write the joined words apart.
+		sof_pasuk: KEEP or REMOVE.
+		paseq: KEEP or REMOVE.
+	"""
+	table = {}
+	if strip_vowels:
+		table.update(dict.fromkeys(VOWEL_MARKS))
+	if strip_cantillation:
+		table.update(dict.fromkeys(CANTILLATION_MARKS))
+	for char, policy in ((MAQAF, maqaf), (SOF_PASUK, sof_pasuk),
+						 (PASEQ, paseq)):
+		if policy == REMOVE:
+			table[ord(char)] = None
+		elif policy == SPACE:
+			table[ord(char)] = u' '
+		elif policy != KEEP:
+			raise ValueError('Unknown policy %r for %r' % (policy, char))
+	return table
+
+
+class TextNormalizer(object):
+	"""Strips the text down to what is written in the scroll."""
+
+	def __init__(self, strip_vowels=True, strip_cantillation=True,
+				 maqaf=KEEP, sof_pasuk=KEEP, paseq=KEEP):
+		self.table = make_translate_table(
+			strip_vowels, strip_cantillation, maqaf, sof_pasuk, paseq)
+
+	@classmethod
+	def from_config(cls, config):
+		return cls(
+			config.getboolean('formatting', 'strip_vowels'),
+			config.getboolean('formatting', 'strip_cantillation_marks'),
+			config.get('formatting', 'maqaf'),
+			config.get('formatting', 'sof_pasuk'),
+			config.get('formatting', 'paseq'))
+
+	@property
+	def is_identity(self):
+		return not self.table
+
+	def normalize(self, text):
+		if not text or not self.table:
+			return text
+		return text.translate(self.table)
+
+	def normalize_torah(self, elt):
+		"""Normalizes the text of a model hierarchy in place.
+
+		Args:
+			elt: any element of the model, e.g. a Torah.
+
+		Returns:
+			elt, for convenience.
+		"""
+		if self.is_identity:
+			return elt
+		pending = [elt]
+		while pending:
+			node = pending.pop()
+			text = getattr(node, 'text', None)
+			if text:
+				node.text = text.translate(self.table)
+			stream = getattr(node, 'stream', None)
+			if stream:
+				pending.extend(stream)
+		return elt
+
+	def normalize_xml_file(self, in_f, out_f, chunk_size=1 << 20):
+		"""Normalizes the text of an XML file, copying it in chunks.
+
+		The marks and punctuation never occur in the markup of the
+		intermediate XML, so the file need not be parsed.
+
+		Args:
+			in_f: binary file of UTF-8 encoded XML to read.
+			out_f: binary file to write to.
+			chunk_size: bytes read at a time.
+		"""
+		decoder = codecs.getincrementaldecoder('utf-8')()
+		while True:
+			data = in_f.read(chunk_size)
+			text = decoder.decode(data, final=not data)
+			if text:
+				out_f.write(self.normalize(text).encode('utf-8'))
+			if not data:
+				break
+
@@ -10,16 +10,44 @@ which were downloaded on 09/20/2016 and are checked into
 	../data/mamre.cantillation/
 """
 
+import instrumentation as instrumentation_module
+import itertools
+import lxml.html
 import re
 import torah_model
+import torah_store
 
 from bs4 import BeautifulSoup
+from concurrent.futures import ProcessPoolExecutor
 
 
 class MechonMamreParser(object):
-	
-	def __init__(self):
-		pass
+
+	# Bump when a change to the parser changes its output.
+	VERSION = 2
+
+	# HTML backends.
+	SOUP = 'soup'
+	LXML = 'lxml'
+
+	def __init__(self, max_workers=1, backend=SOUP, instrumentation=None):
+		"""Initialize.
+
+		Args:
+			max_workers: size of the process pool parse_torah_filenames
+				parses sefarim in. Sefarim are parsed serially in this
+				process if 1; None means one process per CPU.
+			backend: SOUP to read the HTML with BeautifulSoup, or LXML
+				to read it directly with lxml.html, which is faster.
+			instrumentation: optional instrumentation.Instrumentation
+				recording the parse_mm stages.
+		"""
+		if backend not in (self.SOUP, self.LXML):
+			raise ValueError('Unknown backend %r' % backend)
+		self.max_workers = max_workers
+		self.backend = backend
+		self.instrumentation = (
+			instrumentation or instrumentation_module.NULL_INSTRUMENTATION)
 
 	PARASHA_PATTERN = re.compile(r'({.})')
 
@@ -53,6 +81,11 @@ class MechonMamreParser(object):
 	# Tags on which to break the fragment
 	BREAKING_TAGS = ('br', 'b')
 
+	# Tags whose content is not text of the pasuk: the verse anchors of
+	# the per-chapter files, and links, e.g. the * linking a pasuk to its
+	# alternate cantillation.
+	SKIPPED_TAGS = ('a',)
+
 	def parse_sefer_filename(self, fname, sefer_idx=0):
 		"""Parses the Mechon Mamre file pointed to by f.
 
@@ -68,19 +101,89 @@ class MechonMamreParser(object):
 		Args:
 			f: file handle to Mechon Mamre file.
 		"""
+		with self.instrumentation.stage('parse_mm.sefer'):
+			return self._parse_sefer_file(f, sefer_idx)
 
-		parsed = BeautifulSoup(f, 'lxml')
-		seforim = parsed.findChildren(name='h1')
+	def _parse_sefer_file(self, f, sefer_idx):
+		name, pasukim = self._read(f)
+		return self._build_sefer(name, pasukim, sefer_idx)
+
+	# Separates the sefer name from the perek in the heading of a chapter
+	# file, e.g. "בראשית פרק א".
+	PEREK_HEADING = u' פרק '
+
+	def parse_chapter_filenames(self, fnames, sefer_idx=0):
+		"""Parses the chapter files of a sefer, e.g. c0101.htm, c0102.htm.
+
+		Chapter files are headed with the name of the sefer and of the
+		perek, and their pasukim are marked with the pasuk alone.
+
+		Args:
+			fnames: paths of the chapter files, in order.
+			sefer_idx: the index of the Sefer in the compilation.
+
+		Returns:
+			The Sefer, numbered as if parsed from a whole-sefer file.
+		"""
+		with self.instrumentation.stage('parse_mm.sefer'):
+			names = []
+			pasukim = self._iter_chapter_pasukim(fnames, names)
+			first = next(pasukim, None)
+			if first is None:
+				raise ValueError('No pasukim in %s' % ', '.join(fnames))
+			return self._build_sefer(
+				names[0], itertools.chain([first], pasukim), sefer_idx)
+
+	def _iter_chapter_pasukim(self, fnames, names):
+		"""Yields the (marker, children) of the pasukim of chapter files.
+
+		The name of the sefer in the heading of each file is appended to
+		names as the file is read.
+		"""
+		for fname in fnames:
+			with open(fname, 'r', encoding='utf-8') as f:
+				heading, pasukim = self._read(f)
+			name, sep, perek_str = heading.strip().rpartition(
+				self.PEREK_HEADING)
+			if not sep:
+				raise ValueError(
+					'%s is not a chapter file: %r' % (fname, heading))
+			names.append(name)
+			for pasuk_str, children in pasukim:
+				yield u'%s,%s' % (perek_str, pasuk_str), children
+
+	def _read(self, f):
+		"""Reads a file with the backend.
+
+		Returns:
+			The pair (text of the heading, iterator of (pasuk marker
+			text, list of the TextFragments and ParashaDelimiters of the
+			pasuk)).
+		"""
+		with self.instrumentation.stage('parse_mm.read'):
+			if self.backend == self.LXML:
+				return self._read_lxml(f)
+			return self._read_soup(f)
+
+	def _build_sefer(self, name, pasukim, sefer_idx):
+		"""Numbers the perakim and pasukim of a sefer.
+
+		Args:
+			name: the name of the sefer.
+			pasukim: iterable of ("perek,pasuk" marker, children).
+			sefer_idx: the index of the Sefer in the compilation.
+		"""
+		instr = self.instrumentation
 		sefer_id = 'sefer_%d' % sefer_idx
-		sefer = torah_model.Sefer(seforim[0].text, sefer_idx, sefer_id)
+		sefer = torah_model.Sefer(name, sefer_idx, sefer_id)
 
 		perek_idx = -1
 		pasuk_idx = -1
+		n_pasukim = 0
 		current_perek = None
-		perek_pasuk_children = parsed.findChildren(name='b')
 
-		for i, pp in enumerate(perek_pasuk_children):
-			perek_str, pasuk_str = pp.text.split(',')
+		for marker, children in pasukim:
+			perek_str, pasuk_str = marker.split(',')
 
 			# May need to open a new perek.
 			if (current_perek is None or
@@ -94,6 +197,7 @@ class MechonMamreParser(object):
 
 			# Mark the start of a new pasuk.
 			pasuk_idx += 1
+			n_pasukim += 1
 			pasuk_id = 'pasuk_%d:%d:%d' % (sefer_idx, perek_idx, pasuk_idx)
 			# TODO: how do we handle the case the petuha/setumah
 			# come in the middle of a pasuk?
@@ -101,28 +205,82 @@ class MechonMamreParser(object):
 				pasuk_str, pasuk_idx, pasuk_id)
 			current_perek.append_to_stream(current_pasuk)
 
+			current_pasuk_fragment = torah_model.PasukFragment(pasuk_id)
+			for c in children:
+				current_pasuk_fragment.append_to_stream(c)
+			current_perek.append_to_stream(current_pasuk_fragment)
+
+		instr.count('parse_mm.perakim', perek_idx + 1)
+		instr.count('parse_mm.pasukim', n_pasukim)
+		return sefer
+
+	def _read_soup(self, f):
+		"""Reads a sefer file with BeautifulSoup.
+
+		Returns:
+			The pair (sefer name, iterator of (pasuk marker text, list of
+			the TextFragments and ParashaDelimiters of the pasuk)).
+		"""
+		parsed = BeautifulSoup(f, 'lxml')
+		seforim = parsed.findChildren(name='h1')
+		return seforim[0].text, self._iter_soup_pasukim(parsed)
+
+	def _iter_soup_pasukim(self, parsed):
+		for pp in parsed.findChildren(name='b'):
 			# Iterate over the text of the pasuk, until we hit the next one.
+			children = []
 			sib = pp.nextSibling
-			current_pasuk_fragment = torah_model.PasukFragment(pasuk_id)
 			while sib:
 				tag_name = self.get_tag_name(sib)
 				if tag_name and tag_name.lower() in self.BREAKING_TAGS:
 					break
+				elif tag_name and tag_name in self.SKIPPED_TAGS:
+					pass
 				elif tag_name:
-					child = torah_model.FormattedText.from_tag_name(
-						sib.text, tag_name)
-					current_pasuk_fragment.append_to_stream(child)
+					children.append(torah_model.FormattedText.from_tag_name(
+						sib.text, tag_name))
 				else:
-					text = str(sib)
-					children = self.split_on_parsha_delimiter(text)
-					for c in children:
-						current_pasuk_fragment.append_to_stream(c)
+					children.extend(self.split_on_parsha_delimiter(str(sib)))
 
 				# Move to next sibling
 				sib = sib.nextSibling
-			current_perek.append_to_stream(current_pasuk_fragment)
+			yield pp.text, children
 
-		return sefer
+	def _read_lxml(self, f):
+		"""Reads a sefer file with lxml.html, like _read_soup.
+
+		BeautifulSoup builds its tree with the same lxml HTML parser, so
+		the documents agree. Text siblings of BeautifulSoup are the tails
+		of lxml elements.
+		"""
+		data = f.read()
+		if isinstance(data, bytes):
+			data = data.decode('utf-8')
+		parsed = lxml.html.document_fromstring(data)
+		seforim = parsed.iter('h1')
+		return next(seforim).text_content(), self._iter_lxml_pasukim(parsed)
+
+	def _iter_lxml_pasukim(self, parsed):
+		split = self.split_on_parsha_delimiter
+		for pp in parsed.iter('b'):
+			children = []
+			if pp.tail:
+				children.extend(split(pp.tail))
+			sib = pp.getnext()
+			while sib is not None:
+				tag_name = sib.tag
+				if not isinstance(tag_name, str):
+					# Comments are plain strings to BeautifulSoup.
+					children.extend(split(sib.text or ''))
+				elif tag_name in self.BREAKING_TAGS:
+					break
+				elif tag_name not in self.SKIPPED_TAGS:
+					children.append(torah_model.FormattedText.from_tag_name(
+						sib.text_content(), tag_name))
+				if sib.tail:
+					children.extend(split(sib.tail))
+				sib = sib.getnext()
+			yield pp.text_content(), children
 
 	def parse_torah_files(self, fs):
 		"""Parses a list of Sefer files into a Torah object."""
@@ -133,11 +291,33 @@ class MechonMamreParser(object):
 		return t
 
 	def parse_torah_filenames(self, fnames):
-		"""Parses a list of Sefer files into a Torah object."""
+		"""Parses a list of Sefer files into a Torah object.
+
+		With more than one worker each file is parsed in its own process
+		and sent back as a compact torah_store.TorahStore. Sefarim are
+		numbered by their position in fnames either way.
+		"""
+		fnames = list(fnames)
 		t = torah_model.Torah()
-		for i, fname in enumerate(fnames):
-			sefer = self.parse_sefer_filename(fname, sefer_idx=i)
-			t.append_to_stream(sefer)
+		if self.max_workers == 1 or len(fnames) < 2:
+			for i, fname in enumerate(fnames):
+				sefer = self.parse_sefer_filename(fname, sefer_idx=i)
+				t.append_to_stream(sefer)
+			return t
+
+		jobs = [(fname, i, self.backend) for i, fname in enumerate(fnames)]
+		with self.instrumentation.stage('parse_mm.parallel'):
+			with ProcessPoolExecutor(
+					max_workers=self.max_workers) as executor:
+				for store in executor.map(_parse_sefer_job, jobs):
+					t.append_to_stream(store.to_model())
 		return t
 
 
+def _parse_sefer_job(job):
+	fname, sefer_idx, backend = job
+	sefer = MechonMamreParser(backend=backend).parse_sefer_filename(
+		fname, sefer_idx)
+	return torah_store.TorahStore.from_model(sefer)
+
+
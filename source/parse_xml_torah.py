@@ -3,6 +3,9 @@
 from lxml import etree
 """Parses XML intermediate format into torah model hierarchy."""
 
+import gzip
+import instrumentation as instrumentation_module
+import lzma
 import re
 import torah_model
 
@@ -29,14 +32,57 @@ FORMATTED_TEXT_MAPPING = dict(
 XML_CLASS_MAPPING.update(PARASHA_DELIMITER_MAPPING)
 XML_CLASS_MAPPING.update(FORMATTED_TEXT_MAPPING)
 
+# Openers of compressed files by their magic bytes.
+COMPRESSED_OPENERS = (
+	(b'\x1f\x8b', gzip.open),
+	(b'\xfd7zXZ\x00', lzma.open))
+
+
+def compressed_opener(fname):
+	"""Returns the opener of fname if it is compressed, else None."""
+	with open(fname, 'rb') as f:
+		head = f.read(6)
+	for magic, opener in COMPRESSED_OPENERS:
+		if head.startswith(magic):
+			return opener
+	return None
+
+
+def is_compressed(fname):
+	"""Whether fname is gzip or xz compressed."""
+	return compressed_opener(fname) is not None
+
+
+def open_xml_filename(fname):
+	"""Opens an XML file for reading in binary mode.
+
+	gzip and xz compressed files are decompressed as they are read.
+	"""
+	opener = compressed_opener(fname) or open
+	return opener(fname, 'rb')
+
 
 class XmlTorahParser(object):
 
-	def __init__(self):
-		pass
+	# Bump when a change to the parser changes its output.
+	VERSION = 1
+
+	def __init__(self, streaming=False, instrumentation=None):
+		"""Initialize.
+
+		Args:
+			streaming: whether parse_xml_file builds the model while
+				reading with iterparse, instead of from a parsed tree.
+			instrumentation: optional instrumentation.Instrumentation
+				recording the parse_xml stages.
+		"""
+		self.streaming = streaming
+		self.instrumentation = (
+			instrumentation or instrumentation_module.NULL_INSTRUMENTATION)
 
 	def parse_xml_filename(self, fname):
-		with open(fname, 'rb') as f:
+		"""Parses an XML file, which may be gzip or xz compressed."""
+		with open_xml_filename(fname) as f:
 			return self.parse_xml_file(f)
 
 	def parse_xml_elt(self, xml_elt):
@@ -52,6 +98,74 @@ class XmlTorahParser(object):
 		return torah_model
 
 	def parse_xml_file(self, f):
-		xml_root = etree.parse(f).getroot()
-		torah_root = self.parse_xml_elt(xml_root)
+		instr = self.instrumentation
+		with instr.stage('parse_xml'):
+			if self.streaming:
+				torah_root = self.iterparse_xml_file(f)
+			else:
+				with instr.stage('parse_xml.read'):
+					xml_root = etree.parse(f).getroot()
+				with instr.stage('parse_xml.model'):
+					torah_root = self.parse_xml_elt(xml_root)
+		if instr.enabled:
+			instr.count(
+				'parse_xml.nodes',
+				instrumentation_module.count_nodes(torah_root))
 		return torah_root
+
+	def iterparse_xml_file(self, f):
+		"""Streaming parse of a whole file into the model.
+
+		Only the model is kept; XML elements are discarded as soon as
+		they are converted.
+		"""
+		root = None
+		for elt in self._iter_model(f, yield_sefarim=False):
+			root = elt
+		return root
+
+	def iter_sefarim_filename(self, fname):
+		with open_xml_filename(fname) as f:
+			for sefer in self.iter_sefarim(f):
+				yield sefer
+
+	def iter_sefarim(self, f):
+		"""Yields each Sefer of a file as soon as it has been read.
+
+		Sefarim are not attached to the enclosing Torah, so only one
+		book's worth of model need be in memory at a time.
+		"""
+		return self._iter_model(f, yield_sefarim=True)
+
+	def _iter_model(self, f, yield_sefarim):
+		"""Builds model elements on the end events of iterparse.
+
+		The children of the element being read are collected on a stack
+		of lists. Yields each Sefer if yield_sefarim, else the root.
+		"""
+		children = [[]]
+		context = etree.iterparse(f, events=('start', 'end'))
+		for event, xml_elt in context:
+			if event == 'start':
+				children.append([])
+				continue
+
+			elt = XML_CLASS_MAPPING[xml_elt.tag].from_xml_elt(xml_elt)
+			for child in children.pop():
+				elt.append_to_stream(child)
+			if yield_sefarim and type(elt) == Sefer:
+				yield elt
+			else:
+				children[-1].append(elt)
+
+			# Drop the element and its converted preceding siblings.
+			xml_elt.clear()
+			parent = xml_elt.getparent()
+			if parent is not None:
+				while xml_elt.getprevious() is not None:
+					del parent[0]
+		del context
+
+		if not yield_sefarim:
+			for elt in children.pop():
+				yield elt
@@ -0,0 +1,349 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Checks a computed layout against the scribal layout traditions.
+
+The rules are those of the README which concern the layout of lines and
+columns:
+
+* biya shemo: the six anchored words begin a column.
+* vavei ha'amudim: every other column begins with a vav.
+* forced breaks: a petuha, a shirah line break or the end of a sefer ends
+  its line.
+* petuha: the line of a petuha leaves at least the gap of a setuma open
+  at its end, or else the next line is left blank.
+* setuma: a setuma does not fall at the end of a justified line, where
+  its gap would be lost. Within a line a setuma never shrinks, so it
+  always keeps its gap.
+* book end: book_end_lines blank lines are left between sefarim.
+
+ScribalRules finds the positions of the anchors, delimiters and verses in
+the word stream of a Torah once. Validating a layout is then a single pass
+over its lines which looks only at the first and last word of each, so it
+is cheap enough to run on every candidate of a search. Run from the source
+directory:
+
+	python scribal_rules.py -a
+"""
+
+import argparse
+import collections
+import column_solver
+import layout
+import metrics
+import normalize
+import snapshot
+import sys
+
+from kavlar import KavlarCompiler, KavlarConfig
+from layout import Paragraph
+from torah_model import ParashaDelimiter
+
+
+# The rules.
+BIYA_SHEMO = 'biya_shemo'
+VAVEI_HAAMUDIM = 'vavei_haamudim'
+FORCED_BREAK = 'forced_break'
+PETUHA = 'petuha'
+SETUMA = 'setuma'
+BOOK_END = 'book_end'
+RULES = (BIYA_SHEMO, VAVEI_HAAMUDIM, FORCED_BREAK, PETUHA, SETUMA, BOOK_END)
+
+VAV = u'ו'
+
+# Names of the delimiters which force a line break, for messages.
+BREAK_NAMES = {
+	ParashaDelimiter.PETUHA: 'petuha',
+	ParashaDelimiter.SHIRAH_LINE_BREAK: 'shirah line break',
+	ParashaDelimiter.BOOK_END: 'sefer end delimiter',
+	Paragraph.SEFER_END: 'sefer end',
+}
+
+# A broken rule. pasuk_id is the verse of the word at fault, line the index
+# of its line in the layout and column the column_idx of the line's column.
+Violation = collections.namedtuple('Violation', [
+	'rule', 'pasuk_id', 'line', 'column', 'description'])
+
+
+class ScribalRules(object):
+	"""The word positions of a Torah at which scribal rules apply.
+
+	Positions count the words of the paragraphs of the Torah, which are
+	the words of the lines of its layouts, in order.
+	"""
+
+	def __init__(self, paragraphs, anchors, params):
+		"""Initialize.
+
+		Args:
+			paragraphs: the layout.Paragraphs of the Torah, as built for
+				its layouts.
+			anchors: the column_solver.Anchors of the Torah.
+			params: the layout.LayoutParams of the layouts.
+		"""
+		self.params = params
+		self.pasuk_ids = []
+		# Sorted positions of the anchored words.
+		self.anchors = []
+		# Sorted positions of the words followed by a forced break, and the
+		# kinds of the breaks.
+		self.breaks = []
+		self.break_kinds = []
+		# Sorted positions of the words followed by a setuma.
+		self.setumot = []
+
+		by_pasuk = dict((a.pasuk_id, a.letters) for a in anchors)
+		for paragraph in paragraphs:
+			start = len(self.pasuk_ids)
+			for i, word in enumerate(paragraph.words):
+				self.pasuk_ids.append(word.pasuk_id)
+				letters = by_pasuk.get(word.pasuk_id)
+				if (letters is not None and
+						layout.letters_of(word.text).startswith(letters)):
+					# Each anchor is used once, as in split_segments.
+					del by_pasuk[word.pasuk_id]
+					self.anchors.append(start + i)
+			last = len(self.pasuk_ids) - 1
+			self.setumot.extend(
+				start + i for i, glue in enumerate(paragraph.glues[:-1])
+				if glue == Paragraph.SETUMA)
+			if paragraph.end_kind in BREAK_NAMES:
+				self.breaks.append(last)
+				self.break_kinds.append(paragraph.end_kind)
+
+	@classmethod
+	def from_torah(cls, torah, params, builder=None,
+				   column_tops=column_solver.BIYA_SHEMO):
+		"""The rules of a Torah model.
+
+		Args:
+			torah: the torah_model.Torah.
+			params: the layout.LayoutParams of the layouts.
+			builder: the layout.ParagraphBuilder the layouts are built
+				with; one measuring letters if None.
+			column_tops: see column_solver.find_anchors.
+		"""
+		builder = builder or layout.ParagraphBuilder()
+		return cls(
+			builder.paragraphs_for_torah(torah),
+			column_solver.find_anchors(torah, column_tops), params)
+
+	@classmethod
+	def from_config(cls, torah, config, measure=layout.letter_count_width):
+		"""The rules of the layouts of a Torah under a KavlarConfig."""
+		normalizer = normalize.TextNormalizer.from_config(config)
+		return cls.from_torah(
+			torah, layout.LayoutParams.from_config(config),
+			layout.ParagraphBuilder(measure, normalizer.normalize))
+
+	def __len__(self):
+		return len(self.pasuk_ids)
+
+	def validate(self, lay, rules=RULES, limit=None):
+		"""Checks a layout of the Torah.
+
+		Args:
+			lay: the layout.Layout to check.
+			rules: the rules to check.
+			limit: stop after finding this many violations, if not None.
+
+		Returns:
+			The list of Violations, in the order of the text.
+
+		Raises:
+			ValueError: if the lines of lay do not hold the words of the
+				Torah.
+		"""
+		return _Validation(self, lay, rules, limit).run()
+
+	def is_valid(self, lay, rules=RULES):
+		"""Whether a layout breaks none of the rules."""
+		return not self.validate(lay, rules, limit=1)
+
+
+class _Validation(object):
+	"""A pass of ScribalRules.validate over one layout."""
+
+	class _Done(Exception):
+		pass
+
+	def __init__(self, rules, lay, checked, limit):
+		self.rules = rules
+		self.layout = lay
+		self.checked = frozenset(checked)
+		self.limit = limit
+		self.violations = []
+
+	def report(self, rule, pasuk_id, line_idx, column_idx, description):
+		if rule not in self.checked:
+			return
+		self.violations.append(
+			Violation(rule, pasuk_id, line_idx, column_idx, description))
+		if self.limit is not None and len(self.violations) >= self.limit:
+			raise self._Done()
+
+	def run(self):
+		try:
+			self._check_lines()
+		except self._Done:
+			pass
+		return self.violations
+
+	def _check_lines(self):
+		rules = self.rules
+		params = rules.params
+		line_width = self.layout.line_width
+		pasuk_ids = rules.pasuk_ids
+		anchors = rules.anchors
+		breaks = rules.breaks
+		break_kinds = rules.break_kinds
+		setumot = rules.setumot
+		# The next anchor, break and setuma not yet reached.
+		a = b = s = 0
+		pos = 0
+		line_idx = 0
+		# The (position, line_idx, column_idx) of a petuha whose line is
+		# full, and the position of a sefer end, until the next line with
+		# words; the blank lines before that line.
+		open_petuha = None
+		book_end = None
+		n_blank = 0
+
+		for column in self.layout.columns:
+			column_idx = column.column_idx
+			at_top = True
+			for line in column.lines:
+				words = line.words
+				n = len(words)
+				if not n:
+					n_blank += 1
+					open_petuha = None
+					line_idx += 1
+					continue
+
+				first = pos
+				last = pos + n - 1
+				if last >= len(pasuk_ids) or (
+						words[0].pasuk_id != pasuk_ids[first]):
+					raise ValueError(
+						'Line %d does not hold the words of the Torah' %
+						line_idx)
+				if open_petuha is not None:
+					self._report_petuha(open_petuha)
+					open_petuha = None
+				if book_end is not None:
+					if n_blank < params.book_end_lines:
+						self.report(
+							BOOK_END, pasuk_ids[book_end], line_idx,
+							column_idx,
+							'%d blank lines between sefarim, expected %d' % (
+								n_blank, params.book_end_lines))
+					book_end = None
+
+				is_anchor = a < len(anchors) and anchors[a] == first
+				if at_top and not is_anchor and (
+						not layout.letters_of(words[0].text).startswith(VAV)):
+					self.report(
+						VAVEI_HAAMUDIM, words[0].pasuk_id, line_idx,
+						column_idx, 'column begins with %s' % words[0].text)
+				while a < len(anchors) and anchors[a] <= last:
+					if not (at_top and anchors[a] == first):
+						self.report(
+							BIYA_SHEMO, pasuk_ids[anchors[a]], line_idx,
+							column_idx, 'anchored word is not at the top '
+							'of a column')
+					a += 1
+				at_top = False
+
+				while b < len(breaks) and breaks[b] <= last:
+					kind = break_kinds[b]
+					if breaks[b] < last:
+						self.report(
+							FORCED_BREAK, pasuk_ids[breaks[b]], line_idx,
+							column_idx, 'text follows the %s on its line' %
+							BREAK_NAMES[kind])
+					elif kind == ParashaDelimiter.PETUHA:
+						gap = line_width - line.natural_width
+						if not line.is_last or gap < params.setuma_width:
+							open_petuha = (last, line_idx, column_idx)
+					elif kind == Paragraph.SEFER_END:
+						book_end = last
+					b += 1
+
+				while s < len(setumot) and setumot[s] <= last:
+					if setumot[s] == last and not line.is_last:
+						self.report(
+							SETUMA, pasuk_ids[last], line_idx, column_idx,
+							'setuma ends a justified line and leaves no gap')
+					s += 1
+
+				pos = last + 1
+				n_blank = 0
+				line_idx += 1
+
+		if pos != len(pasuk_ids):
+			raise ValueError(
+				'The layout holds %d of the %d words of the Torah' % (
+					pos, len(pasuk_ids)))
+		if open_petuha is not None:
+			self._report_petuha(open_petuha)
+
+	def _report_petuha(self, open_petuha):
+		pos, line_idx, column_idx = open_petuha
+		self.report(
+			PETUHA, self.rules.pasuk_ids[pos], line_idx, column_idx,
+			'petuha ends a full line but the next line is not blank')
+
+
+def print_violations(violations, n_shown):
+	counts = collections.Counter(v.rule for v in violations)
+	for rule in RULES:
+		print('%s\t%d' % (rule, counts[rule]))
+	for v in violations[:n_shown]:
+		print('%s\t%s\tcolumn %d\tline %d\t%s' % (
+			v.rule, v.pasuk_id, v.column, v.line, v.description))
+
+
+def main():
+	parser = argparse.ArgumentParser(
+		description='Checks the native layout of the Torah against the '
+		'scribal layout traditions.')
+	parser.add_argument(
+		'-x', '--xml_filename', default='../data/xml_torah/torah.xml',
+		help='Intermediate XML file of the Torah.')
+	parser.add_argument(
+		'-c', '--config_filename', default=None,
+		help='Config file of the layout.')
+	parser.add_argument(
+		'-a', '--anchored', action='store_true',
+		help='Check the layout anchored at the biya shemo column tops.')
+	parser.add_argument(
+		'-r', '--rule', action='append', choices=RULES,
+		help='Rule to check; repeatable. All rules if none.')
+	parser.add_argument(
+		'-n', '--n_shown', type=int, default=20,
+		help='Number of violations to list.')
+	args = parser.parse_args()
+
+	if args.config_filename:
+		config = KavlarConfig.read_config(args.config_filename)
+	else:
+		config = KavlarConfig.default_config()
+	torah = snapshot.parse_xml_filename(args.xml_filename, config)
+	if args.anchored:
+		solver = column_solver.AnchoredColumnSolver.from_config(config)
+		lay = solver.solve(torah)
+		measure = solver.builder.measure
+	else:
+		measure = (
+			metrics.WordWidthService.from_config(config) or
+			layout.letter_count_width)
+		lay = KavlarCompiler(config).layout_torah_model(torah, measure)
+	scribal_rules = ScribalRules.from_config(torah, config, measure)
+	print_violations(
+		scribal_rules.validate(lay, args.rule or RULES), args.n_shown)
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -7,10 +7,11 @@
 import argparse
 import json
 
-from lxml import etree
+from instrumentation import Instrumentation
 from os import path
 from parse_mm import MechonMamreParser
-from torah_model import Perek, TextFragment, Sefer
+from snapshot import SnapshotCache
+from write_xml_torah import XmlTorahWriter
 
 
 def main():
@@ -20,7 +21,33 @@ def main():
 		'-c', '--config_filename', dest='config_filename',
 		default='scripts/gen_torah_xml_config.json',
 		help='Paths of JSON config file.')
+	parser.add_argument(
+		'-s', '--snapshot_dir', dest='snapshot_dir', default=None,
+		help='Directory caching parsed snapshots of the HTML files.')
+	parser.add_argument(
+		'-j', '--jobs', dest='jobs', type=int, default=1,
+		help='Number of processes parsing sefarim; 0 for one per CPU.')
+	parser.add_argument(
+		'-b', '--backend', dest='backend', default=MechonMamreParser.LXML,
+		choices=(MechonMamreParser.LXML, MechonMamreParser.SOUP),
+		help='HTML parser backend.')
+	parser.add_argument(
+		'-z', '--compression', dest='compression', default=None,
+		choices=(XmlTorahWriter.GZIP, XmlTorahWriter.XZ),
+		help='Compression of the output; defaults to its suffix, '
+		'.gz or .xz.')
+	parser.add_argument(
+		'-r', '--report', dest='report', default=None,
+		help='JSON file to write stage timings and counters to.')
+	parser.add_argument(
+		'-p', '--profile_dir', dest='profile_dir', default=None,
+		help='Directory to write a cProfile of each stage to.')
 	args = parser.parse_args()
+	instr = None
+	if args.report or args.profile_dir:
+		instr = Instrumentation(
+			[Instrumentation.ALL_STAGES] if args.profile_dir else (),
+			args.profile_dir, args.report)
 
 	# Load JSON configuration file.
 	print('Reading configuration from', args.config_filename)
@@ -35,16 +62,29 @@ def main():
 	for fname in html_filenames:
 		print(fname)
 
-	parser = MechonMamreParser()
-	torah = parser.parse_torah_filenames(html_filenames)
-	torah_xml_elt = torah.to_xml_elt()
+	parser = MechonMamreParser(
+		max_workers=args.jobs or None, backend=args.backend,
+		instrumentation=instr)
+	if args.snapshot_dir:
+		cache = SnapshotCache(args.snapshot_dir)
+		torah = cache.parse_torah_filenames(html_filenames, parser)
+	elif args.jobs == 1:
+		# Each sefer is written as soon as it is parsed, and dropped.
+		torah = (
+			parser.parse_sefer_filename(fname, sefer_idx=i)
+			for i, fname in enumerate(html_filenames))
+	else:
+		torah = parser.parse_torah_filenames(html_filenames)
 
 	print('Writing XML output to', output_filename)
-	with open(output_filename, 'wb') as out_f:
-		xml_data = etree.tostring(
-			torah_xml_elt, pretty_print=True,
-			xml_declaration=True, encoding='utf-8')
-		out_f.write(xml_data)
+	writer = XmlTorahWriter()
+	if instr is None:
+		writer.write_filename(torah, output_filename, args.compression)
+	else:
+		with instr.stage('write_xml'):
+			writer.write_filename(torah, output_filename, args.compression)
+		instr.count('xml.bytes', path.getsize(output_filename))
+		instr.save()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,149 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Shares a torah model between processes through shared memory.
+
+A SharedTorahStore is a torah_store.TorahStore published once, in the
+binary form of a snapshot.Snapshot, to a block of
+multiprocessing.shared_memory. Worker processes attach to the block by
+name and read the node arrays and strings in place, so sending the model
+to a worker costs the same whatever its size: only the name is pickled.
+The torah_model hierarchy of a Sefer or Perek is rebuilt in the worker
+when it is first asked for.
+
+The process which publishes the store owns the block and must unlink
+it, e.g. by using the store as a context manager:
+
+	with SharedTorahStore.publish(TorahStore.from_model(torah)) as shared:
+		executor.map(job, [(shared.name, i) for i in range(n)])
+"""
+
+from multiprocessing import shared_memory
+from snapshot import Snapshot
+from torah_store import SEFER
+
+
+class SharedTorahStore(object):
+	"""A read-only TorahStore in a block of shared memory."""
+
+	def __init__(self, shm, owner=False):
+		"""Initialize; use publish() or attach() instead.
+
+		Args:
+			shm: the SharedMemory holding the snapshot of the store.
+			owner: whether this process created the block.
+		"""
+		self.shm = shm
+		self.owner = owner
+		self._view = shm.buf.toreadonly()
+		self.store = Snapshot.from_buffer(self._view, shm.name)
+		# Rebuilt models by node.
+		self._models = {}
+		self._sefer_nodes = None
+
+	@classmethod
+	def publish(cls, store):
+		"""Copies store to a new block of shared memory.
+
+		Args:
+			store: the TorahStore to share.
+
+		Returns:
+			The SharedTorahStore owning the block.
+		"""
+		shms = []
+
+		def allocate(size):
+			shms.append(shared_memory.SharedMemory(create=True, size=size))
+			return shms[0].buf
+
+		try:
+			Snapshot.pack(store, allocate)
+			return cls(shms[0], owner=True)
+		except BaseException:
+			for shm in shms:
+				shm.close()
+				shm.unlink()
+			raise
+
+	@classmethod
+	def attach(cls, name):
+		"""Attaches to the store published under name, e.g. in a worker."""
+		return cls(shared_memory.SharedMemory(name=name))
+
+	@property
+	def name(self):
+		"""The name of the block, which workers attach() to."""
+		return self.shm.name
+
+	def __len__(self):
+		return len(self.store)
+
+	def sefer_nodes(self):
+		"""The nodes of the Sefarim, in order.
+
+		The root is either a Sefer or the Torah of the Sefarim.
+		"""
+		if self._sefer_nodes is None:
+			store = self.store
+			if store.kinds[0] == SEFER:
+				self._sefer_nodes = [0]
+			else:
+				self._sefer_nodes = [
+					i for i in store.children(0) if store.kinds[i] == SEFER]
+		return self._sefer_nodes
+
+	def model(self, i=0):
+		"""The torah_model hierarchy rooted at node i, e.g. the Torah.
+
+		Each node is rebuilt once; the same objects are returned on
+		later calls.
+		"""
+		model = self._models.get(i)
+		if model is None:
+			model = self.store.to_model(i)
+			self._models[i] = model
+		return model
+
+	def sefer(self, n):
+		"""The n-th Sefer, counting from 0."""
+		return self.model(self.sefer_nodes()[n])
+
+	def perek(self, n, perek_idx):
+		"""The Perek of the n-th Sefer with the given perek_idx."""
+		store = self.store
+		for i in store.children(self.sefer_nodes()[n]):
+			if store.indices[i] == perek_idx:
+				return self.model(i)
+		raise IndexError('No perek %d in sefer %d' % (perek_idx, n))
+
+	def close(self):
+		"""Detaches from the block, which can no longer be read.
+
+		Models already rebuilt remain usable.
+		"""
+		if self.store is None:
+			return
+		store = self.store
+		self.store = None
+		for name in ('kinds', 'parents', 'ends', 'indices', 'labels',
+					 'idents'):
+			getattr(store, name).release()
+		store.strings.data.release()
+		store.strings.offsets.release()
+		self._view.release()
+		self.shm.close()
+
+	def unlink(self):
+		"""Closes and frees the block; only its owner should call this."""
+		self.close()
+		self.shm.unlink()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		if self.owner:
+			self.unlink()
+		else:
+			self.close()
@@ -0,0 +1,243 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Binary snapshots of parsed torah models, cached by content.
+
+A snapshot is a torah_store.TorahStore written out as flat arrays, which
+are memory-mapped back on load instead of being parsed. SnapshotCache
+names each snapshot by a hash of the input files together with the
+version of the parser which read them, so a snapshot is never used once
+its inputs or the parser change.
+
+Mapping a snapshot takes well under a millisecond, and readers of the
+store, such as layout.ParagraphBuilder.paragraphs_for_store, skip parsing
+altogether. Rebuilding the torah_model objects from the store still
+costs about half as much as parsing the intermediate XML, so the cache
+pays off most against the Mechon Mamre HTML, or for readers of the store.
+"""
+
+import array
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+from parse_mm import MechonMamreParser
+from parse_xml_torah import XmlTorahParser
+from torah_store import EncodedStrings, TorahStore
+
+
+class Snapshot(object):
+	"""Reads and writes the binary form of a TorahStore.
+
+	Layout: a header, the int32 columns of the store, the int32 byte
+	offsets of each string in the string table, the int8 node kinds,
+	then the UTF-8 encoded string table.
+	"""
+
+	MAGIC = b'KVTS'
+	VERSION = 2
+	# magic, version, little endian, nodes, strings, table bytes, unused.
+	_HEADER = struct.Struct('<4sHHIIII')
+	_INT_COLUMNS = ('parents', 'ends', 'indices', 'labels', 'idents')
+
+	@classmethod
+	def _pieces(cls, store):
+		"""The bytes-like pieces of the binary form of store, in order."""
+		encoded = [s.encode('utf-8') for s in store.strings]
+		offsets = array.array('i', [0])
+		for s in encoded:
+			offsets.append(offsets[-1] + len(s))
+		table = b''.join(encoded)
+		pieces = [cls._HEADER.pack(
+			cls.MAGIC, cls.VERSION, sys.byteorder == 'little', len(store),
+			len(encoded), len(table), 0)]
+		for name in cls._INT_COLUMNS:
+			pieces.append(memoryview(getattr(store, name)).cast('B'))
+		pieces.append(memoryview(offsets).cast('B'))
+		pieces.append(memoryview(store.kinds).cast('B'))
+		pieces.append(table)
+		return pieces
+
+	@classmethod
+	def save(cls, store, fname):
+		"""Writes store to fname, atomically replacing any old file."""
+		dirname = os.path.dirname(os.path.abspath(fname))
+		fd, tmp_fname = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+		try:
+			with os.fdopen(fd, 'wb') as f:
+				for piece in cls._pieces(store):
+					f.write(piece)
+			os.replace(tmp_fname, fname)
+		except BaseException:
+			os.unlink(tmp_fname)
+			raise
+
+	@classmethod
+	def pack(cls, store, allocate):
+		"""Writes store into a buffer, e.g. of shared memory.
+
+		Args:
+			store: the TorahStore.
+			allocate: called with the size in bytes of the binary form
+				to return a writable buffer at least that large.
+
+		Returns:
+			The buffer returned by allocate.
+		"""
+		pieces = [memoryview(p).cast('B') for p in cls._pieces(store)]
+		buf = allocate(sum(len(p) for p in pieces))
+		view = memoryview(buf)
+		pos = 0
+		for piece in pieces:
+			view[pos:pos + len(piece)] = piece
+			pos += len(piece)
+		view.release()
+		return buf
+
+	@classmethod
+	def load(cls, fname):
+		"""Maps a snapshot written by save() back into a TorahStore.
+
+		The columns of the returned store are read-only views of the
+		mapped file; no nodes can be added to it.
+		"""
+		with open(fname, 'rb') as f:
+			mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		return cls.from_buffer(memoryview(mapped), fname)
+
+	@classmethod
+	def from_buffer(cls, view, source='buffer'):
+		"""Reads the TorahStore of the binary form in a memoryview.
+
+		Nothing is copied or decoded: the columns of the store are views
+		of the buffer, whose strings are decoded as they are looked up.
+		Trailing bytes, e.g. the rounding of shared memory to pages, are
+		ignored.
+
+		Args:
+			view: memoryview of the binary form.
+			source: name of the buffer in error messages.
+
+		Raises:
+			ValueError: if the buffer does not hold a compatible snapshot.
+		"""
+		size = cls._HEADER.size
+		if len(view) < size:
+			raise ValueError('%s is not a torah snapshot' % source)
+		magic, version, little, n_nodes, n_strings, n_bytes, _ = (
+			cls._HEADER.unpack(view[:size]))
+		if (magic != cls.MAGIC or version != cls.VERSION or
+				bool(little) != (sys.byteorder == 'little')):
+			raise ValueError('%s is not a compatible snapshot' % source)
+		expected = size + 4 * 5 * n_nodes + 4 * (n_strings + 1)
+		expected += n_nodes + n_bytes
+		if len(view) < expected:
+			raise ValueError('%s is truncated' % source)
+
+		columns = {}
+		pos = size
+		for name in cls._INT_COLUMNS:
+			columns[name] = view[pos:pos + 4 * n_nodes].cast('i')
+			pos += 4 * n_nodes
+		offsets = view[pos:pos + 4 * (n_strings + 1)].cast('i')
+		pos += 4 * (n_strings + 1)
+		columns['kinds'] = view[pos:pos + n_nodes].cast('b')
+		pos += n_nodes
+		strings = EncodedStrings(view[pos:pos + n_bytes], offsets)
+		return TorahStore(strings=strings, **columns)
+
+
+class SnapshotCache(object):
+	"""A directory of snapshots keyed by inputs and parser version."""
+
+	def __init__(self, cache_dir):
+		self.cache_dir = cache_dir
+
+	@classmethod
+	def from_config(cls, config):
+		"""Returns the cache of the configured directory, or None."""
+		cache_dir = config.get('cache', 'snapshot_dir')
+		if not cache_dir:
+			return None
+		return cls(cache_dir)
+
+	@staticmethod
+	def key(fnames, parser_name, parser_version):
+		"""Hash of the contents of fnames and the parser version."""
+		h = hashlib.sha256()
+		h.update(('%s:%s:%d:%d\n' % (
+			parser_name, parser_version, Snapshot.VERSION,
+			len(fnames))).encode('utf-8'))
+		for fname in fnames:
+			with open(fname, 'rb') as f:
+				for chunk in iter(lambda: f.read(1 << 20), b''):
+					h.update(chunk)
+			h.update(b'\0')
+		return h.hexdigest()
+
+	def path_for(self, key):
+		return os.path.join(self.cache_dir, key + '.snapshot')
+
+	def load(self, key):
+		"""Returns the cached TorahStore for key, or None."""
+		try:
+			return Snapshot.load(self.path_for(key))
+		except (IOError, OSError, ValueError):
+			return None
+
+	def save(self, key, store):
+		if not os.path.isdir(self.cache_dir):
+			os.makedirs(self.cache_dir)
+		Snapshot.save(store, self.path_for(key))
+
+	def load_store(self, fnames, parser_name, parser_version, parse):
+		"""Returns the TorahStore of fnames, parsing only on a miss.
+
+		Args:
+			fnames: the input files.
+			parser_name, parser_version: identify the parser.
+			parse: called with no arguments on a miss to return the
+				torah model of the inputs.
+		"""
+		key = self.key(fnames, parser_name, parser_version)
+		store = self.load(key)
+		if store is None:
+			store = TorahStore.from_model(parse())
+			self.save(key, store)
+		return store
+
+	def xml_store(self, fname, parser=None):
+		"""The TorahStore of an intermediate XML file, through the cache."""
+		parser = parser or XmlTorahParser()
+		return self.load_store(
+			[fname], type(parser).__name__, parser.VERSION,
+			lambda: parser.parse_xml_filename(fname))
+
+	def parse_xml_filename(self, fname, parser=None):
+		"""XmlTorahParser.parse_xml_filename, through the cache."""
+		return self.xml_store(fname, parser).to_model()
+
+	def parse_torah_filenames(self, fnames, parser=None):
+		"""MechonMamreParser.parse_torah_filenames, through the cache."""
+		parser = parser or MechonMamreParser()
+		return self.load_store(
+			list(fnames), type(parser).__name__, parser.VERSION,
+			lambda: parser.parse_torah_filenames(fnames)).to_model()
+
+
+def parse_xml_filename(fname, config, parser=None):
+	"""Parses an intermediate XML file, through the snapshot cache of config.
+
+	Args:
+		fname: the XML file.
+		config: a KavlarConfig; the file is parsed directly unless its
+			[cache] snapshot_dir is set.
+		parser: the XmlTorahParser to parse with, if not the default.
+	"""
+	cache = SnapshotCache.from_config(config)
+	if cache is None:
+		return (parser or XmlTorahParser()).parse_xml_filename(fname)
+	return cache.parse_xml_filename(fname, parser)
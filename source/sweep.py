@@ -0,0 +1,364 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Lays out one parsed Torah under many configurations.
+
+A ConfigSweep evaluates a list of KavlarConfigs, e.g. a grid of
+lines_per_col and aspect_ratio values, reporting the number of columns
+and statistics of the whitespace of each layout, as scored by
+layout_analytics. The model is parsed once, and its measured paragraphs
+are built once per distinct text normalization and font. Candidates of
+equal line width share their lines, and results are remembered across
+calls. The line width is lines_per_col * line_height / aspect_ratio, so
+most points of a grid of both have a width of their own. Each distinct
+width costs a run of the line breaker over the whole Torah, about a
+second, since the breaker's work depends on the width throughout.
+Distinct widths are broken in a process pool, whose workers receive the
+paragraphs once. Scoring needs NumPy. Run from the source directory:
+
+	python sweep.py -o formatting.lines_per_col=38,42,48 \\
+		-o formatting.aspect_ratio=3.5,4.0,4.5
+"""
+
+import argparse
+import collections
+import itertools
+import json
+import layout
+import math
+import metrics
+import normalize
+import snapshot
+import sys
+
+from concurrent.futures import ProcessPoolExecutor
+from kavlar import KavlarConfig
+from layout_analytics import LayoutAnalytics
+from parse_xml_torah import XmlTorahParser
+from torah_store import TorahStore
+
+
+# Formatting options which change the layout parameters only, not the
+# measured paragraphs.
+LAYOUT_ONLY_OPTIONS = frozenset(['aspect_ratio', 'lines_per_col', 'font'])
+
+# Statistics of a layout, from layout_analytics.LayoutAnalytics.
+# Adjustment ratios are over the justified lines, i.e. the lines with words
+# which do not end a paragraph. Loose lines stretch their glue by more than
+# its stretchability, tight lines shrink it by more than half its
+# shrinkability. column_whitespace_std is the spread over the full columns
+# of the fraction of their width left between words. Lines without glue
+# to stretch or shrink have infinite ratios: they count in max_ratio and
+# min_ratio, in infeasible_lines (ratio above the tolerance) and in
+# overfull_lines (ratio below -1), but not in the mean or percentile.
+LayoutStats = collections.namedtuple('LayoutStats', [
+	'line_width', 'lines_per_col', 'n_lines', 'n_columns',
+	'last_column_lines', 'total_demerits', 'mean_abs_ratio', 'max_ratio',
+	'min_ratio', 'loose_lines', 'tight_lines', 'p95_abs_ratio',
+	'mean_badness', 'column_whitespace_std', 'overfull_lines',
+	'infeasible_lines'])
+
+
+def layout_stats(lay, params=None):
+	"""Returns the LayoutStats of a layout.Layout.
+
+	Args:
+		lay: the layout.Layout.
+		params: the layout.LayoutParams it was laid out with, for the
+			tolerance of infeasible_lines; the default parameters at its
+			line width if None.
+	"""
+	if params is None:
+		params = layout.LayoutParams(lay.line_width, lay.lines_per_col)
+	analytics = LayoutAnalytics(lay, params)
+	summary = analytics.summary()
+	ratios = analytics.ratios[analytics.justified]
+	last_column_lines = len(lay.columns[-1]) if lay.columns else 0
+	return LayoutStats(
+		lay.line_width, lay.lines_per_col, len(lay.lines), lay.n_columns,
+		last_column_lines, lay.total_demerits,
+		summary['mean_abs_ratio'] or 0.0,
+		float(ratios.max()) if len(ratios) else 0.0,
+		float(ratios.min()) if len(ratios) else 0.0,
+		summary['loose_lines'], summary['tight_lines'],
+		summary['p95_abs_ratio'] or 0.0,
+		summary['mean_badness'] or 0.0,
+		summary['column_whitespace_std'] or 0.0,
+		summary['overfull_lines'], summary['infeasible_lines'])
+
+
+def paragraph_key(config):
+	"""Key of the options of config on which the paragraphs depend."""
+	formatting = tuple(sorted(
+		(option, value) for option, value in config.items('formatting')
+		if option not in LAYOUT_ONLY_OPTIONS))
+	return formatting + tuple(sorted(config.items('metrics')))
+
+
+# Layout parameters which do not affect the breaking of paragraphs.
+JOIN_ONLY_PARAMS = frozenset(['lines_per_col', 'book_end_lines'])
+
+
+def params_key(params):
+	"""Hashable key of a layout.LayoutParams."""
+	return tuple(sorted(vars(params).items()))
+
+
+def break_key(params):
+	"""Key of the parameters on which the lines of paragraphs depend."""
+	return tuple(sorted(
+		(name, value) for name, value in vars(params).items()
+		if name not in JOIN_ONLY_PARAMS))
+
+
+def config_grid(base_config, grid):
+	"""Yields (options, config) for each point of a grid of options.
+
+	Args:
+		base_config: the KavlarConfig of the options not in the grid.
+		grid: list of ((section, option), values) pairs.
+
+	Yields:
+		The dict of the (section, option) values of the point, and a copy
+		of base_config with those values set.
+	"""
+	keys = [key for key, _ in grid]
+	for values in itertools.product(*[values for _, values in grid]):
+		config = KavlarConfig.copy_config(base_config)
+		for (section, option), value in zip(keys, values):
+			config.set(section, option, str(value))
+		yield dict(zip(keys, values)), config
+
+
+# Paragraphs by paragraph key in each worker process.
+_worker_paragraphs = None
+
+
+def _init_worker(paragraphs):
+	global _worker_paragraphs
+	_worker_paragraphs = paragraphs
+
+
+def _sweep_job(job):
+	key, params_list = job
+	return _layout_stats(_worker_paragraphs[key], params_list)
+
+
+def _layout_stats(paragraphs, params_list):
+	"""LayoutStats for each of params_list, which share a break_key."""
+	breaker = layout.KnuthPlassBreaker(params_list[0])
+	broken = [breaker.break_paragraph(p) for p in paragraphs]
+	ret = []
+	for params in params_list:
+		engine = layout.LayoutEngine(params)
+		lines = engine.join_lines(paragraphs, broken)
+		ret.append(layout_stats(layout.Layout(
+			lines, params.lines_per_col, params.line_width), params))
+	return ret
+
+
+class ConfigSweep(object):
+	"""Evaluates the layouts of a Torah under many configs."""
+
+	def __init__(self, torah, max_workers=1):
+		"""Initialize.
+
+		Args:
+			torah: the torah_model.Torah to lay out, or its
+				torah_store.TorahStore.
+			max_workers: size of the process pool candidates are broken
+				in. Candidates are broken serially in this process if 1;
+				None means one process per CPU.
+		"""
+		self.torah = torah
+		self.max_workers = max_workers
+		self._paragraphs = {}
+		self._measures = {}
+		# LayoutStats by (paragraph key, params key), so that a config
+		# is only laid out once across calls.
+		self._stats = {}
+
+	@classmethod
+	def from_xml_filename(cls, fname, max_workers=1, config=None):
+		"""The sweep of an XML file.
+
+		If config has a snapshot cache, the sweep reads the stored model
+		from it without rebuilding the model objects.
+		"""
+		cache = None
+		if config is not None:
+			cache = snapshot.SnapshotCache.from_config(config)
+		if cache is None:
+			return cls(XmlTorahParser().parse_xml_filename(fname), max_workers)
+		return cls(cache.xml_store(fname), max_workers)
+
+	def _measure(self, config):
+		"""The word measure of config, shared by configs of one font."""
+		key = tuple(sorted(config.items('metrics')))
+		measure = self._measures.get(key)
+		if measure is None:
+			measure = (
+				metrics.WordWidthService.from_config(config) or
+				layout.letter_count_width)
+			self._measures[key] = measure
+		return measure
+
+	def paragraphs_for(self, config):
+		"""The measured paragraphs of the Torah under config."""
+		key = paragraph_key(config)
+		paragraphs = self._paragraphs.get(key)
+		if paragraphs is None:
+			normalizer = normalize.TextNormalizer.from_config(config)
+			builder = layout.ParagraphBuilder(
+				self._measure(config), normalizer.normalize)
+			if isinstance(self.torah, TorahStore):
+				paragraphs = builder.paragraphs_for_store(self.torah)
+			else:
+				paragraphs = builder.paragraphs_for_torah(self.torah)
+			self._paragraphs[key] = paragraphs
+		return paragraphs
+
+	def evaluate(self, configs):
+		"""Returns the LayoutStats of each config, in order."""
+		jobs = []
+		for config in configs:
+			self.paragraphs_for(config)
+			params = layout.LayoutParams.from_config(config)
+			jobs.append((paragraph_key(config), params))
+
+		# Configs to lay out, grouped by the lines they break into.
+		todo = collections.OrderedDict()
+		for key, params in jobs:
+			stats_key = (key, params_key(params))
+			if stats_key in self._stats:
+				continue
+			group = todo.setdefault((key, break_key(params)), {})
+			group[stats_key] = params
+		groups = [
+			(key, list(group.values()))
+			for (key, _), group in todo.items()]
+
+		if self.max_workers == 1 or len(groups) < 2:
+			results = (
+				_layout_stats(self._paragraphs[key], params_list)
+				for key, params_list in groups)
+			self._add_stats(todo, results)
+		else:
+			paragraphs = dict(
+				(key, self._paragraphs[key]) for key, _ in groups)
+			with ProcessPoolExecutor(
+					max_workers=self.max_workers, initializer=_init_worker,
+					initargs=(paragraphs,)) as executor:
+				self._add_stats(todo, executor.map(_sweep_job, groups))
+
+		return [
+			self._stats[(key, params_key(params))] for key, params in jobs]
+
+	def _add_stats(self, todo, results):
+		for group, stats_list in zip(todo.values(), results):
+			for stats_key, stats in zip(group, stats_list):
+				self._stats[stats_key] = stats
+
+	def sweep(self, base_config, grid):
+		"""Evaluates a grid of options.
+
+		Args:
+			base_config: the KavlarConfig of the options not in the grid.
+			grid: list of ((section, option), values) pairs.
+
+		Returns:
+			A list of (options, LayoutStats) pairs, as in config_grid.
+		"""
+		points = list(config_grid(base_config, grid))
+		stats = self.evaluate([config for _, config in points])
+		return [(options, s) for (options, _), s in zip(points, stats)]
+
+
+def _json_value(x):
+	"""x, or None if it is a float which is not finite."""
+	if isinstance(x, float) and not math.isfinite(x):
+		return None
+	return x
+
+
+def results_json(results):
+	"""The (options, LayoutStats) pairs of a sweep, as plain dicts.
+
+	Infinite ratios are None, as in the layout_analytics report, so that
+	the result is valid JSON.
+	"""
+	return [
+		dict(
+			options=dict(
+				('%s.%s' % key, value) for key, value in options.items()),
+			**dict(
+				(name, _json_value(value))
+				for name, value in stats._asdict().items()))
+		for options, stats in results]
+
+
+def parse_grid_option(s):
+	"""Parses 'section.option=v1,v2,...' into ((section, option), values)."""
+	name, _, values = s.partition('=')
+	section, _, option = name.partition('.')
+	if not (section and option and values):
+		raise ValueError('Expected section.option=v1,v2,...: %r' % s)
+	return (section, option), [v.strip() for v in values.split(',')]
+
+
+def main():
+	parser = argparse.ArgumentParser(
+		description='Lays out the Torah under a grid of configurations '
+		'and scores each layout. Requires NumPy.')
+	parser.add_argument(
+		'-x', '--xml_filename', default='../data/xml_torah/torah.xml',
+		help='Intermediate XML file of the Torah.')
+	parser.add_argument(
+		'-c', '--config_filename', default=None,
+		help='Config file of the options not in the grid.')
+	parser.add_argument(
+		'-o', '--option', action='append', default=[],
+		help='Swept option, as section.option=v1,v2,...; repeatable.')
+	parser.add_argument(
+		'-j', '--jobs', type=int, default=1,
+		help='Number of processes breaking lines; 0 for one per CPU.')
+	parser.add_argument(
+		'--json', action='store_true',
+		help='Print the results as JSON.')
+	args = parser.parse_args()
+
+	try:
+		grid = [parse_grid_option(o) for o in args.option]
+	except ValueError as e:
+		parser.error(str(e))
+	if args.config_filename:
+		base_config = KavlarConfig.read_config(args.config_filename)
+	else:
+		base_config = KavlarConfig.default_config()
+
+	config_sweep = ConfigSweep.from_xml_filename(
+		args.xml_filename, args.jobs or None, base_config)
+	results = config_sweep.sweep(base_config, grid)
+
+	if args.json:
+		json.dump(
+			results_json(results), sys.stdout, indent=2, allow_nan=False)
+		print()
+		return
+	names = ['%s.%s' % key for key, _ in grid]
+	header = names + [
+		'columns', 'lines', 'last_col', 'mean|r|', 'p95|r|', 'max r',
+		'loose', 'tight', 'infeasible', 'badness']
+	print('\t'.join(header))
+	for options, s in results:
+		print('\t'.join(
+			[str(options[key]) for key, _ in grid] + [
+				str(s.n_columns), str(s.n_lines), str(s.last_column_lines),
+				'%.3f' % s.mean_abs_ratio, '%.3f' % s.p95_abs_ratio,
+				'%.2f' % s.max_ratio, str(s.loose_lines),
+				str(s.tight_lines), str(s.infeasible_lines),
+				'%.1f' % s.mean_badness]))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,94 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import benchmark
+from benchmark import Result, Stage
+
+
+class BenchmarkTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp_dir)
+
+	def test_measure(self):
+		calls = []
+		stage = Stage(
+			'alloc', lambda n: calls.append(bytearray(n)),
+			lambda: (1 << 20,))
+		result = stage.measure(repeat=2, min_seconds=0)
+		# Two timed runs and one traced run.
+		self.assertEqual(3, len(calls))
+		self.assertGreater(result.seconds, 0)
+		self.assertGreaterEqual(result.peak_bytes, 1 << 20)
+		self.assertEqual(round(result.seconds, 6), result.seconds)
+
+	def test_regressions(self):
+		baseline = Result(1.0, 1000)
+		self.assertEqual(
+			[], benchmark.regressions(
+				Result(1.2, 1050), baseline, 0.25, 0.1, memory_floor=0))
+		problems = benchmark.regressions(
+			Result(1.3, 1200), baseline, 0.25, 0.1, memory_floor=0)
+		self.assertEqual(['time', 'peak'], [p.split()[0] for p in problems])
+		self.assertEqual('peak 1200 B > 1000 B', problems[1])
+
+		# Short stages and small peaks do not regress on noise.
+		self.assertEqual(
+			[], benchmark.regressions(
+				Result(0.017, 1000), Result(0.011, 1000), 0.5, 0.1))
+		self.assertEqual(
+			['time 37.0 ms > 11.0 ms'],
+			benchmark.regressions(
+				Result(0.037, 1000), Result(0.011, 1000), 0.5, 0.1))
+		self.assertEqual(
+			[], benchmark.regressions(Result(1.0, 1200), baseline, 0.25, 0.1))
+		self.assertEqual(
+			['peak 2.20 MB > 2.00 MB'],
+			benchmark.regressions(
+				Result(1.0, 2200000), Result(1.0, 2000000), 0.25, 0.05))
+
+	def test_run_and_baselines(self):
+		stages = [Stage('noop', lambda: None)]
+		out = io.StringIO()
+		results, failed = benchmark.run(
+			stages, {}, repeat=1, out=out, min_seconds=0)
+		self.assertEqual([], failed)
+		self.assertIn('no baseline', out.getvalue())
+
+		fname = os.path.join(self.tmp_dir, 'sub', 'baseline.json')
+		benchmark.save_baselines(fname, results)
+		self.assertEqual(results, benchmark.load_baselines(fname))
+
+		# Anything regresses against a zero baseline without floors...
+		_, failed = benchmark.run(
+			stages, {'noop': Result(0.0, 0)}, repeat=1, out=io.StringIO(),
+			min_seconds=0, memory_floor=0, time_floor=0)
+		self.assertEqual(['noop'], failed)
+		# ...but not by less than the floors.
+		_, failed = benchmark.run(
+			stages, {'noop': Result(0.0, 0)}, repeat=1, out=io.StringIO(),
+			min_seconds=0)
+		self.assertEqual([], failed)
+
+	def test_default_stages(self):
+		names = [s.name for s in benchmark.default_stages()]
+		self.assertEqual(len(names), len(set(names)))
+		for name in ('html_parse_1', 'xml_parse', 'xml_build',
+					 'xml_serialize', 'tex_compile', 'layout_torah'):
+			self.assertIn(name, names)
+		stage = dict((s.name, s) for s in benchmark.default_stages())
+		result = stage['html_parse_lxml_5'].measure(repeat=1, min_seconds=0)
+		self.assertGreater(result.peak_bytes, 0)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,53 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from column_solver import AnchoredColumnSolver, find_anchors
+from kavlar import KavlarConfig
+from layout import letters_of
+from parse_xml_torah import XmlTorahParser
+
+
+class AnchoredColumnSolverTest(unittest.TestCase):
+
+	def test_find_anchors(self):
+		parser = XmlTorahParser()
+		torah = parser.parse_xml_filename('../data/xml_torah/torah.xml')
+		anchors = find_anchors(torah)
+		self.assertEqual(6, len(anchors))
+		self.assertEqual('pasuk_0:0:0', anchors[0].pasuk_id)
+		self.assertEqual('pasuk_4:30:27', anchors[-1].pasuk_id)
+
+	def test_solve_shemot(self):
+		parser = XmlTorahParser()
+		shemot = parser.parse_xml_filename('../data/xml_torah/shemot.xml')
+		config = KavlarConfig.default_config()
+		solver = AnchoredColumnSolver.from_config(config, max_workers=2)
+
+		segments = solver.segments_for_torah(shemot)
+		# Ex. 14:28 and 34:11 split Shemot in three.
+		self.assertEqual(3, len(segments))
+
+		layout = solver.solve(shemot)
+		column_tops = [
+			letters_of(c.first_word.text) for c in layout.columns]
+		self.assertIn(u'הבאים', column_tops)
+		self.assertIn(u'שמר', column_tops)
+		# Words joined by a maqaf are written apart.
+		self.assertNotIn(u'שמרלך', column_tops)
+		for i, column in enumerate(layout.columns):
+			self.assertEqual(i, column.column_idx)
+
+		# Segments are solved independently but lose no words.
+		serial = AnchoredColumnSolver.from_config(config, max_workers=1)
+		serial_layout = serial.solve(shemot)
+		self.assertEqual(
+			[str(l) for l in serial_layout.lines],
+			[str(l) for l in layout.lines])
+		n_words = sum(len(p) for seg in segments for p in seg)
+		self.assertEqual(n_words, sum(len(l.words) for l in layout.lines))
+
+
+if __name__ == '__main__':
+	unittest.main()
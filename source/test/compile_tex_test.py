@@ -2,11 +2,15 @@
 # -*- coding: utf-8 -*-
 
 import codecs
+import io
+import os
+import shutil
+import tempfile
 import unittest
 
 from lxml import etree
 from os import path
-from kavlar import KavlarCompiler
+from kavlar import KavlarCompiler, KavlarConfig
 from parse_xml_torah import XmlTorahParser
 from torah_model import Perek, TextFragment
 from torah_model import Sefer, PasukStart
@@ -22,9 +26,45 @@ class XmlTorahParserTest(unittest.TestCase):
 		root = parser.parse_xml_filename(fname)
 
 		tex = compiler.compile_torah_model(root)
-		fname = '../test_tex/test_compile.tex'
-		with codecs.open(fname, 'w', encoding='utf-8') as f:
-			f.write(tex)
+		tmp_dir = tempfile.mkdtemp()
+		try:
+			fname = os.path.join(tmp_dir, 'test_compile.tex')
+			with codecs.open(fname, 'w', encoding='utf-8') as f:
+				f.write(tex)
+			with codecs.open(fname, 'r', encoding='utf-8') as f:
+				self.assertEqual(tex, f.read())
+		finally:
+			shutil.rmtree(tmp_dir)
+		self.assertIn(u'\\section{שמות}', tex)
+
+	def test_stream_shemot(self):
+		fname = '../data/xml_torah/shemot.xml'
+		compiler = KavlarCompiler.default_instance()
+		root = XmlTorahParser().parse_xml_filename(fname)
+		tex = compiler.compile_torah_model(root)
+		self.assertIn(u'\\section{שמות}', tex)
+
+		f = io.StringIO()
+		compiler.stream_torah_model(root, f)
+		self.assertEqual(tex, f.getvalue())
+
+		f = io.BytesIO()
+		compiler.stream_torah_model(root, f, encoding='utf-8', buffer_size=1)
+		self.assertEqual(tex.encode('utf-8'), f.getvalue())
+
+		pieces = list(compiler.generate_torah_model(root))
+		self.assertGreater(len(pieces), 1000)
+		self.assertEqual(tex, ''.join(pieces))
+
+	def test_parallel_compile(self):
+		fname = '../data/xml_torah/torah.xml'
+		root = XmlTorahParser().parse_xml_filename(fname)
+		serial = KavlarCompiler.default_instance()
+		parallel = KavlarCompiler(
+			KavlarConfig.default_config(), max_workers=2)
+		self.assertEqual(
+			serial.compile_torah_model(root),
+			parallel.compile_torah_model(root))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,130 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import corpus
+from corpus import CorpusIngester
+from lxml import etree
+from parse_mm import MechonMamreParser
+from parse_xml_torah import XmlTorahParser
+from snapshot import Snapshot
+
+HTML_DIR = '../data/mamre.cantillation'
+
+
+class CorpusTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp_dir)
+
+	def test_discover_books(self):
+		books = corpus.discover_books(HTML_DIR)
+		self.assertEqual(39, len(books))
+		codes = [book.code for book in books]
+		self.assertEqual(['01', '02', '03', '04', '05', '06'], codes[:6])
+		self.assertEqual(['08a', '08b'], codes[7:9])
+		self.assertEqual(list(range(39)), [book.index for book in books])
+
+		tehillim = books[codes.index('26')]
+		self.assertEqual(150, len(tehillim.fnames))
+		self.assertTrue(tehillim.fnames[98].endswith('c2699.htm'))
+		self.assertTrue(tehillim.fnames[99].endswith('c26a0.htm'))
+		self.assertTrue(tehillim.fnames[-1].endswith('c26f0.htm'))
+
+		selected = corpus.discover_books(HTML_DIR, ['08b', '02'])
+		self.assertEqual(
+			[('02', 1), ('08b', 8)],
+			[(book.code, book.index) for book in selected])
+		self.assertRaises(
+			ValueError, corpus.discover_books, HTML_DIR, ['99'])
+
+	def test_expand_book_codes(self):
+		codes = [book.code for book in corpus.discover_books(HTML_DIR)]
+		self.assertEqual(
+			['01', '08a', '08b', '09a', '09b', '10'],
+			corpus.expand_book_codes(['08a-10', '01'], codes))
+		self.assertRaises(
+			ValueError, corpus.expand_book_codes, ['08-10'], codes)
+
+	def test_chapters_match_whole_sefer(self):
+		for backend in (MechonMamreParser.LXML, MechonMamreParser.SOUP):
+			parser = MechonMamreParser(backend=backend)
+			for book in corpus.discover_books(HTML_DIR, ['02', '05']):
+				whole = parser.parse_sefer_filename(
+					os.path.join(HTML_DIR, 'c%s.htm' % book.code),
+					sefer_idx=book.index)
+				chapters = parser.parse_chapter_filenames(
+					book.fnames, sefer_idx=book.index)
+				self.assertEqual(
+					self._to_xml(whole), self._to_xml(chapters))
+
+		self.assertRaises(
+			ValueError, MechonMamreParser().parse_chapter_filenames,
+			[os.path.join(HTML_DIR, 'c02.htm')])
+
+	def _to_xml(self, sefer):
+		holder = etree.Element('Holder')
+		sefer.add_to_xml_tree(holder)
+		return etree.tostring(holder)
+
+	def test_ingest_torah(self):
+		books = corpus.discover_books(HTML_DIR, ['01', '02', '03', '04', '05'])
+		progress = []
+		ingester = CorpusIngester(
+			self.tmp_dir, max_workers=2, max_pending=3,
+			progress=lambda *args: progress.append(args))
+		results = ingester.ingest(books)
+		self.assertEqual(['01', '02', '03', '04', '05'], [
+			r.code for r in results])
+		self.assertEqual(
+			[1, 2, 3, 4, 5], sorted(n_done for n_done, _, _ in progress))
+		self.assertEqual(set([5]), set(n for _, n, _ in progress))
+
+		# The books are those of the Torah XML generated from whole sefarim.
+		torah = XmlTorahParser().parse_xml_filename(
+			'../data/xml_torah/torah.xml')
+		for result, sefer in zip(results, torah.iter_stream):
+			book_torah = XmlTorahParser().parse_xml_filename(
+				result.output_filename)
+			self.assertEqual(
+				[self._to_xml(sefer)],
+				[self._to_xml(s) for s in book_torah.iter_stream])
+			self.assertEqual(len(sefer.stream), result.n_perakim)
+		self.assertEqual(1209, results[1].n_pasukim)
+
+		with open(os.path.join(self.tmp_dir, 'corpus.json')) as f:
+			manifest = json.load(f)
+		self.assertEqual('xml', manifest['format'])
+		self.assertEqual(
+			['01.xml', '02.xml', '03.xml', '04.xml', '05.xml'],
+			[book['filename'] for book in manifest['books']])
+		self.assertEqual(u'שמות', manifest['books'][1]['name'])
+
+	def test_ingest_snapshots(self):
+		books = corpus.discover_books(HTML_DIR, ['29', '35a', '35b'])
+		ingester = CorpusIngester(self.tmp_dir, CorpusIngester.SNAPSHOT)
+		results = ingester.ingest(books)
+		self.assertEqual(
+			[u'רות', u'עזרא', u'נחמיה'], [r.name for r in results])
+		self.assertEqual(4, results[0].n_perakim)
+		self.assertEqual(85, results[0].n_pasukim)
+
+		ruth = Snapshot.load(results[0].output_filename).to_model()
+		sefarim = list(ruth.iter_stream)
+		self.assertEqual(1, len(sefarim))
+		self.assertEqual(u'רות', sefarim[0].name)
+		self.assertEqual('sefer_31', sefarim[0].sefer_id)
+
+		self.assertRaises(ValueError, CorpusIngester, self.tmp_dir, 'html')
+
+
+if __name__ == '__main__':
+	unittest.main()
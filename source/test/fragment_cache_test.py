@@ -0,0 +1,117 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import kavlar
+import unittest
+
+from fragment_cache import FragmentCache
+from kavlar import KavlarCompiler, KavlarConfig
+from parse_xml_torah import XmlTorahParser
+from shared_store import SharedTorahStore
+from torah_store import TorahStore
+from torah_model import PasukFragment, TextFragment
+
+
+class FragmentCacheTest(unittest.TestCase):
+
+	def setUp(self):
+		self.cache_dir = tempfile.mkdtemp()
+		parser = XmlTorahParser()
+		self.shemot = parser.parse_xml_filename(
+			'../data/xml_torah/shemot.xml')
+		self.config = KavlarConfig.default_config()
+		self.config.set('cache', 'fragment_dir', self.cache_dir)
+
+	def tearDown(self):
+		shutil.rmtree(self.cache_dir)
+
+	def _uncached_tex(self):
+		return KavlarCompiler.default_instance().compile_torah_model(
+			self.shemot)
+
+	def test_recompile_after_edit(self):
+		compiler = KavlarCompiler(self.config)
+		cache = compiler.fragment_cache
+		self.assertEqual(
+			self._uncached_tex(), compiler.compile_torah_model(self.shemot))
+		# The 40 perakim of the sefer.
+		self.assertEqual((0, 40), (cache.hits, cache.misses))
+
+		self.assertEqual(
+			self._uncached_tex(), compiler.compile_torah_model(self.shemot))
+		self.assertEqual((40, 40), (cache.hits, cache.misses))
+
+		fragment = next(
+			e for e in self.shemot.stream[0].stream[9].stream
+			if type(e) == PasukFragment)
+		text = [c for c in fragment.stream if type(c) == TextFragment][-1]
+		text.text += u' אבג'
+		tex = compiler.compile_torah_model(self.shemot)
+		self.assertEqual(self._uncached_tex(), tex)
+		self.assertIn(u'אבג', tex)
+		# Only the edited perek is rendered again.
+		self.assertEqual((79, 41), (cache.hits, cache.misses))
+		# Each version of a perek is stored once.
+		self.assertEqual(41, len(os.listdir(self.cache_dir)))
+
+	def test_config_change(self):
+		compiler = KavlarCompiler(self.config)
+		compiler.compile_torah_model(self.shemot)
+		self.config.set('formatting', 'strip_vowels', 'False')
+		compiler = KavlarCompiler(self.config)
+		tex = compiler.compile_torah_model(self.shemot)
+		self.assertEqual(0, compiler.fragment_cache.hits)
+		self.assertIn(u'ַ', tex)
+
+	def test_eviction(self):
+		sefer_size = len(
+			self.shemot.stream[0].to_tex(self.config).encode('utf-8'))
+		last_perek_size = len(
+			self.shemot.stream[0].stream[-1].to_tex(self.config).encode(
+				'utf-8'))
+		# Room for about half the perakim.
+		max_bytes = sefer_size // 2
+		cache = FragmentCache(self.cache_dir, max_bytes)
+		tex = u''.join(cache.iter_torah_tex(self.shemot, self.config))
+		self.assertEqual(self.shemot.to_tex(self.config), tex)
+
+		sizes = [
+			os.path.getsize(os.path.join(self.cache_dir, name))
+			for name in os.listdir(self.cache_dir)]
+		self.assertLessEqual(sum(sizes), max_bytes)
+		self.assertLess(len(sizes), 40)
+		# The most recent fragment, the last perek, is kept.
+		self.assertIn(last_perek_size, sizes)
+		self.assertEqual(sum(sizes), FragmentCache(self.cache_dir).n_bytes)
+
+	def test_put_overwrite(self):
+		cache = FragmentCache(self.cache_dir)
+		cache.put('a', u'אבג')
+		cache.put('a', u'אב')
+		cache.put('b', u'א')
+		self.assertEqual(6, cache.n_bytes)
+		self.assertEqual(
+			cache.n_bytes, FragmentCache(self.cache_dir).n_bytes)
+
+	def test_compile_worker(self):
+		store = TorahStore.from_model(self.shemot)
+		with SharedTorahStore.publish(store) as shared:
+			kavlar._init_compile_worker(self.config, shared.name)
+			try:
+				cache = kavlar._worker_cache
+				tex, hits, misses = kavlar._compile_sefer_job(0)
+				self.assertEqual(self.shemot.stream[0].to_tex(self.config), tex)
+				self.assertEqual((0, 40), (hits, misses))
+				# The counts are per job, from the same cache.
+				tex, hits, misses = kavlar._compile_sefer_job(0)
+				self.assertEqual((40, 0), (hits, misses))
+				self.assertIs(cache, kavlar._worker_cache)
+			finally:
+				kavlar._worker_store.close()
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,141 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from incremental import IncrementalLayout
+from kavlar import KavlarConfig
+from layout import LayoutEngine
+from parse_xml_torah import XmlTorahParser
+from torah_model import ParashaDelimiter, PasukFragment, Torah
+
+
+class IncrementalLayoutTest(unittest.TestCase):
+
+	def setUp(self):
+		parser = XmlTorahParser()
+		self.shemot = parser.parse_xml_filename(
+			'../data/xml_torah/shemot.xml')
+		self.config = KavlarConfig.default_config()
+		self.incremental = IncrementalLayout.from_config(self.config)
+		self.incremental.layout_torah(self.shemot)
+
+	def _fragment(self, perek_idx, pasuk_idx):
+		perek = self.shemot.stream[0].stream[perek_idx]
+		fragments = [
+			e for e in perek.iter_stream if type(e) == PasukFragment]
+		return fragments[pasuk_idx]
+
+	def _assert_matches_full_layout(self, layout, torah=None):
+		full = LayoutEngine.from_config(self.config).layout_torah(
+			torah or self.shemot)
+		self.assertEqual(
+			[str(l) for l in full.lines], [str(l) for l in layout.lines])
+		self.assertEqual(
+			[[str(l) for l in c.lines] for c in full.columns],
+			[[str(l) for l in c.lines] for c in layout.columns])
+
+	def test_no_edit(self):
+		before = self.incremental.layout
+		after = self.incremental.relayout(self.shemot)
+		self.assertEqual(0, self.incremental.last_stats['columns_rebuilt'])
+		self.assertEqual(0, self.incremental.last_stats['paragraphs_broken'])
+		for old, new in zip(before.columns, after.columns):
+			self.assertIs(old, new)
+
+	def test_edit_text(self):
+		first_column = self.incremental.layout.columns[0]
+		fragment = self._fragment(29, 11)
+		fragment.stream[-1].text += u' אבג'
+		layout = self.incremental.relayout(self.shemot)
+
+		stats = self.incremental.last_stats
+		self.assertEqual(1, stats['changed_pasukim'])
+		self.assertFalse(stats['full_relayout'])
+		self.assertLess(stats['paragraphs_broken'], 5)
+		# Columns before the edit are reused as they were.
+		self.assertIs(first_column, layout.columns[0])
+		words = [w.text for l in layout.lines for w in l.words]
+		self.assertIn(u'אבג', words)
+
+	def test_remove_petuha(self):
+		for perek in self.shemot.stream[0].iter_stream:
+			for elt in perek.iter_stream:
+				if type(elt) != PasukFragment:
+					continue
+				kinds = [getattr(c, 'kind', None) for c in elt.stream]
+				if ParashaDelimiter.PETUHA in kinds:
+					del elt.stream[kinds.index(ParashaDelimiter.PETUHA)]
+					break
+			else:
+				continue
+			break
+		layout = self.incremental.relayout(self.shemot)
+		self.assertEqual(1, self.incremental.last_stats['changed_pasukim'])
+		self._assert_matches_full_layout(layout)
+
+	def test_restore_converges(self):
+		before = [str(l) for l in self.incremental.layout.lines]
+		fragment = self._fragment(19, 2)
+		text = fragment.stream[-1].text
+		fragment.stream[-1].text = text + u' אבגדהוזח' * 12
+		self.incremental.relayout(self.shemot)
+		fragment.stream[-1].text = text
+		layout = self.incremental.relayout(self.shemot)
+		self.assertEqual(before, [str(l) for l in layout.lines])
+
+	def test_absorb(self):
+		incremental = IncrementalLayout.from_config(self.config, absorb=True)
+		before = incremental.layout_torah(self.shemot)
+		# Dropping the end of a verse takes a line out of its paragraph.
+		fragment = self._fragment(3, 2)
+		fragment.stream[-1].text = u' '.join(
+			fragment.stream[-1].text.split()[:2])
+		layout = incremental.relayout(self.shemot)
+
+		self.assertEqual(len(before.lines), len(layout.lines))
+		self.assertLess(incremental.last_stats['columns_rebuilt'], 6)
+		for old, new in zip(before.columns[-10:], layout.columns[-10:]):
+			self.assertIs(old, new)
+
+	def test_empty_last_paragraph(self):
+		torah = XmlTorahParser().parse_xml_filename(
+			'../data/xml_torah/torah.xml')
+		del torah.stream[2:]
+		self.incremental.layout_torah(torah)
+		before = [str(l) for l in self.incremental.layout.lines]
+		builder = self.incremental.engine.builder
+		last = builder.paragraphs_for_sefer(torah.stream[0])[-1]
+		pasuk_ids = set(w.pasuk_id for w in last.words)
+		texts = []
+		for perek in torah.stream[0].iter_stream:
+			for elt in perek.iter_stream:
+				if (type(elt) == PasukFragment and
+						elt.pasuk_id in pasuk_ids):
+					texts.extend(
+						c for c in elt.iter_stream if hasattr(c, 'text'))
+		old_texts = [c.text for c in texts]
+
+		# The paragraph before ends the sefer, with the blank lines.
+		for c in texts:
+			c.text = u''
+		layout = self.incremental.relayout(torah)
+		self.assertFalse(self.incremental.last_stats['full_relayout'])
+		self._assert_matches_full_layout(layout, torah)
+
+		for c, text in zip(texts, old_texts):
+			c.text = text
+		layout = self.incremental.relayout(torah)
+		self._assert_matches_full_layout(layout, torah)
+		self.assertEqual(before, [str(l) for l in layout.lines])
+
+	def test_empty(self):
+		incremental = IncrementalLayout.from_config(self.config)
+		incremental.layout_torah(Torah())
+		layout = incremental.relayout(Torah())
+		self.assertEqual([], layout.lines)
+		self.assertTrue(incremental.last_stats['full_relayout'])
+
+
+if __name__ == '__main__':
+	unittest.main()
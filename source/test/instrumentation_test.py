@@ -0,0 +1,116 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import pstats
+import shutil
+import tempfile
+import unittest
+
+from instrumentation import Instrumentation, NULL_INSTRUMENTATION
+from kavlar import KavlarCompiler, KavlarConfig
+from parse_mm import MechonMamreParser
+from parse_xml_torah import XmlTorahParser
+from torah_model import PasukStart
+
+
+class InstrumentationTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.mkdtemp()
+		self.shemot = XmlTorahParser().parse_xml_filename(
+			'../data/xml_torah/shemot.xml')
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp_dir)
+
+	def _config(self, **options):
+		config = KavlarConfig.default_config()
+		config.set('instrumentation', 'enabled', 'True')
+		for option, value in options.items():
+			config.set('instrumentation', option, value)
+		return config
+
+	def test_disabled_by_default(self):
+		compiler = KavlarCompiler.default_instance()
+		self.assertIs(NULL_INSTRUMENTATION, compiler.instrumentation)
+		compiler.compile_torah_model(self.shemot)
+		self.assertEqual(
+			{'stages': {}, 'counters': {}},
+			compiler.instrumentation.report())
+
+	def test_compile_report(self):
+		output = os.path.join(self.tmp_dir, 'report.json')
+		profile_dir = os.path.join(self.tmp_dir, 'profiles')
+		config = self._config(
+			output=output, profile='tex.content', profile_dir=profile_dir)
+		compiler = KavlarCompiler(config)
+		tex = compiler.compile_torah_model(self.shemot)
+		self.assertEqual(
+			KavlarCompiler.default_instance().compile_torah_model(
+				self.shemot),
+			tex)
+
+		with open(output, 'r', encoding='utf-8') as f:
+			report = json.load(f)
+		stages = report['stages']
+		self.assertEqual(1, stages['tex.content']['calls'])
+		self.assertEqual(1, stages['tex.document']['calls'])
+		self.assertLessEqual(
+			stages['tex.content']['seconds'],
+			stages['tex.document']['seconds'])
+		self.assertEqual(len(tex), report['counters']['tex.chars'])
+		self.assertGreater(report['counters']['tex.nodes'], 1000)
+
+		stats = pstats.Stats(os.path.join(profile_dir, 'tex.content.prof'))
+		self.assertGreater(stats.total_calls, 0)
+		self.assertFalse(os.path.exists(
+			os.path.join(profile_dir, 'tex.document.prof')))
+
+	def test_fragment_cache_counters(self):
+		config = self._config()
+		config.set('cache', 'fragment_dir', os.path.join(self.tmp_dir, 'tex'))
+		KavlarCompiler(config).compile_torah_model(self.shemot)
+		compiler = KavlarCompiler(config)
+		compiler.compile_torah_model(self.shemot)
+		counters = compiler.instrumentation.report()['counters']
+		self.assertEqual(40, counters['fragment_cache.hits'])
+		self.assertEqual(0, counters['fragment_cache.misses'])
+
+	def test_parsers(self):
+		instr = Instrumentation()
+		XmlTorahParser(instrumentation=instr).parse_xml_filename(
+			'../data/xml_torah/shemot.xml')
+		parser = MechonMamreParser(
+			backend=MechonMamreParser.LXML, instrumentation=instr)
+		sefer = parser.parse_sefer_filename(
+			'../data/mamre.cantillation/c02.htm')
+		n_pasukim = sum(
+			1 for perek in sefer.iter_stream for e in perek.iter_stream
+			if type(e) == PasukStart)
+		report = instr.report()
+		for stage in ('parse_xml', 'parse_xml.read', 'parse_xml.model',
+					  'parse_mm.sefer', 'parse_mm.read'):
+			self.assertEqual(1, report['stages'][stage]['calls'])
+		counters = report['counters']
+		self.assertEqual(40, counters['parse_mm.perakim'])
+		self.assertEqual(n_pasukim, counters['parse_mm.pasukim'])
+		self.assertGreater(counters['parse_xml.nodes'], n_pasukim)
+
+	def test_iter_stage(self):
+		instr = Instrumentation()
+		items = list(instr.iter_stage('numbers', iter(range(3))))
+		self.assertEqual([0, 1, 2], items)
+		self.assertEqual(1, instr.report()['stages']['numbers']['calls'])
+		with instr.stage('numbers'):
+			instr.count('things', 2)
+		instr.count('things')
+		report = instr.report()
+		self.assertEqual(2, report['stages']['numbers']['calls'])
+		self.assertEqual(3, report['counters']['things'])
+		json.loads(instr.to_json())
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,123 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import io
+import json
+import unittest
+
+import layout
+import numpy as np
+from kavlar import KavlarCompiler, KavlarConfig
+from layout import Layout, LayoutParams, Line, Word
+from layout_analytics import LayoutAnalytics
+from parse_xml_torah import XmlTorahParser
+
+
+class LayoutAnalyticsTest(unittest.TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		shemot = XmlTorahParser().parse_xml_filename(
+			'../data/xml_torah/shemot.xml')
+		config = KavlarConfig.default_config()
+		cls.layout = KavlarCompiler(config).layout_torah_model(shemot)
+		cls.params = LayoutParams.from_config(config)
+		cls.analytics = LayoutAnalytics(cls.layout, cls.params)
+
+	def test_lines(self):
+		a = self.analytics
+		lines = self.layout.lines
+		self.assertEqual(len(lines), len(a))
+		justified = [
+			i for i, line in enumerate(lines)
+			if line.words and not line.is_last]
+		self.assertEqual(justified, np.flatnonzero(a.justified).tolist())
+		self.assertEqual(
+			[lines[i].ratio for i in justified], a.ratios[justified].tolist())
+		for i in justified[:50]:
+			self.assertAlmostEqual(
+				min(100 * abs(lines[i].ratio) ** 3,
+					layout.KnuthPlassBreaker.AWFUL_BADNESS),
+				a.badness[i])
+
+		i = next(i for i in justified if len(lines[i].words) > 1)
+		gaps = self.layout.line_width - sum(w.width for w in lines[i].words)
+		self.assertAlmostEqual(
+			gaps / (len(lines[i].words) - 1), a.spacing[i])
+
+		column = self.layout.columns[3]
+		first = 3 * self.layout.lines_per_col
+		self.assertEqual(3, a.column_of[first])
+		self.assertEqual(0, a.line_in_column[first])
+		self.assertIs(column.lines[5], lines[first + 5])
+		self.assertEqual(5, a.line_in_column[first + 5])
+
+	def test_report(self):
+		a = self.analytics
+		summary = a.summary()
+		ratios = [
+			line.ratio for line in self.layout.lines
+			if line.words and not line.is_last]
+		self.assertEqual(len(ratios), summary['n_justified_lines'])
+		self.assertAlmostEqual(
+			sum(abs(r) for r in ratios) / len(ratios),
+			summary['mean_abs_ratio'])
+		self.assertEqual(
+			sum(1 for r in ratios if r < -0.5), summary['tight_lines'])
+		self.assertEqual(self.layout.n_columns, summary['n_columns'])
+
+		columns = a.column_stats()
+		self.assertEqual(
+			[len(c) for c in self.layout.columns], columns['n_lines'])
+		self.assertEqual(
+			summary['loose_lines'], sum(columns['loose_lines']))
+		self.assertEqual(
+			summary['n_blank_lines'], sum(columns['blank_lines']))
+
+		histograms = a.histograms()
+		self.assertEqual(len(ratios), sum(histograms['ratio']['counts']))
+
+		worst = a.worst_lines(5)
+		self.assertEqual(5, len(worst))
+		self.assertEqual(
+			sorted((w['badness'] for w in worst), reverse=True),
+			[w['badness'] for w in worst])
+		self.assertEqual(a.badness.max(), worst[0]['badness'])
+		line = self.layout.lines[worst[0]['line']]
+		self.assertEqual(line.first_pasuk_id, worst[0]['pasuk_id'])
+
+		f = io.StringIO()
+		a.write_json(f)
+		report = json.loads(f.getvalue())
+		self.assertEqual(summary, report['summary'])
+		json.dumps(report, allow_nan=False)
+
+	def test_unjustified_lines(self):
+		words = [Word(u'אב', 2.0, 'pasuk_0:0:0')] * 3
+		lines = [
+			# Overfull: natural width 8 with 0.5 of shrink.
+			Line(words, ratio=-1.0, natural_width=8.0, shrink=0.5),
+			# No glue to stretch.
+			Line(words[:1], natural_width=2.0),
+			Line([]),
+			Line(words[:2], natural_width=5.0, stretch=0.5, is_last=True)]
+		a = LayoutAnalytics(Layout(lines, 2, 7.0), LayoutParams(7.0))
+		self.assertEqual(-2.0, a.ratios[0])
+		self.assertEqual(float('inf'), a.ratios[1])
+		self.assertEqual([0.0, 0.0], a.ratios[2:].tolist())
+		self.assertEqual(0.5, a.spacing[0])
+		self.assertTrue(np.isnan(a.spacing[1]))
+		self.assertEqual(1.0, a.spacing[3])
+
+		summary = a.summary()
+		self.assertEqual(1, summary['overfull_lines'])
+		self.assertEqual(1, summary['infeasible_lines'])
+		self.assertIsNone(summary['max_ratio'])
+		self.assertEqual(2.0, summary['mean_abs_ratio'])
+		self.assertEqual(
+			[6.0 / 14, 1.0 / 14], a.column_whitespace().tolist())
+		self.assertEqual([1, 0], [w['line'] for w in a.worst_lines(2)])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,124 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from kavlar import KavlarCompiler
+from layout import KnuthPlassBreaker, LayoutParams, Paragraph
+from layout import ParagraphBuilder, Word
+from parse_xml_torah import XmlTorahParser
+from torah_model import ParashaDelimiter, PasukFragment, PasukStart
+from torah_model import Perek, Sefer, TextFragment
+
+
+class KnuthPlassBreakerTest(unittest.TestCase):
+
+	def _paragraph(self, widths, setuma_after=()):
+		paragraph = Paragraph(0)
+		for i, w in enumerate(widths):
+			paragraph.append_word(Word('w%d' % i, float(w), 'pasuk_0:0:0'))
+			if i in setuma_after:
+				paragraph.mark_setuma()
+		return paragraph
+
+	def test_lines_fit(self):
+		params = LayoutParams(20.0, tolerance=10.0)
+		breaker = KnuthPlassBreaker(params)
+		paragraph = self._paragraph([3, 4, 5, 2, 6, 3, 4, 5, 3, 2, 4, 6, 3])
+		lines = breaker.break_paragraph(paragraph)
+
+		# All the words are laid out exactly once, in order.
+		words = [w for l in lines for w in l.words]
+		self.assertEqual(paragraph.words, words)
+		for line in lines[:-1]:
+			self.assertGreaterEqual(line.ratio, -1.0)
+			self.assertLessEqual(line.ratio, params.tolerance)
+		self.assertTrue(lines[-1].is_last)
+		self.assertLessEqual(lines[-1].natural_width, params.line_width)
+
+	def test_total_fit_beats_first_fit(self):
+		# First-fit would pack "5 5 5" on one line and leave
+		# a lone very loose word; total fit balances the lines.
+		params = LayoutParams(17.0, tolerance=10.0)
+		breaker = KnuthPlassBreaker(params)
+		paragraph = self._paragraph([5, 5, 5, 5, 5, 5])
+		lines = breaker.break_paragraph(paragraph)
+		self.assertEqual([3, 3], [len(l.words) for l in lines])
+
+	def test_setuma_encourages_break(self):
+		params = LayoutParams(12.0, setuma_penalty=-1000.0)
+		breaker = KnuthPlassBreaker(params)
+		paragraph = self._paragraph(
+			[3, 3, 3, 3, 3, 3], setuma_after=(2,))
+		lines = breaker.break_paragraph(paragraph)
+		self.assertEqual(3, len(lines[0].words))
+
+	def test_looseness(self):
+		params = LayoutParams(20.0, tolerance=10.0)
+		breaker = KnuthPlassBreaker(params)
+		paragraph = self._paragraph([4] * 12)
+		n_lines = len(breaker.break_paragraph(paragraph))
+		looser = breaker.break_paragraph(paragraph, looseness=1)
+		self.assertEqual(n_lines + 1, len(looser))
+
+	def test_emergency_overfull_word(self):
+		params = LayoutParams(5.0)
+		breaker = KnuthPlassBreaker(params)
+		paragraph = self._paragraph([2, 9, 2])
+		lines = breaker.break_paragraph(paragraph)
+		words = [w for l in lines for w in l.words]
+		self.assertEqual(paragraph.words, words)
+
+
+class ParagraphBuilderTest(unittest.TestCase):
+
+	def test_forced_breaks(self):
+		sefer = Sefer(u'בראשית', 0, 'sefer_0')
+		perek = Perek(u'א', 0, 'perek_0:0')
+		sefer.append_to_stream(perek)
+		perek.append_to_stream(PasukStart(u'א', 0, 'pasuk_0:0:0'))
+		fragment = PasukFragment('pasuk_0:0:0')
+		fragment.append_to_stream(TextFragment(u'אבג דה'))
+		fragment.append_to_stream(
+			ParashaDelimiter(ParashaDelimiter.SETUMA))
+		fragment.append_to_stream(TextFragment(u'וז'))
+		fragment.append_to_stream(
+			ParashaDelimiter(ParashaDelimiter.PETUHA))
+		fragment.append_to_stream(TextFragment(u'חטי־כל'))
+		perek.append_to_stream(fragment)
+
+		paragraphs = ParagraphBuilder().paragraphs_for_sefer(sefer)
+		self.assertEqual(2, len(paragraphs))
+		first, second = paragraphs
+		self.assertEqual(ParashaDelimiter.PETUHA, first.end_kind)
+		self.assertEqual(
+			[Paragraph.SPACE, Paragraph.SETUMA, Paragraph.SPACE],
+			first.glues)
+		self.assertEqual([3.0, 2.0, 2.0], [w.width for w in first.words])
+		self.assertEqual(Paragraph.SEFER_END, second.end_kind)
+		# Maqaf-joined words are measured as one.
+		self.assertEqual([5.0], [w.width for w in second.words])
+
+
+class LayoutEngineTest(unittest.TestCase):
+
+	def test_layout_shemot(self):
+		parser = XmlTorahParser()
+		shemot = parser.parse_xml_filename('../data/xml_torah/shemot.xml')
+		compiler = KavlarCompiler.default_instance()
+		layout = compiler.layout_torah_model(shemot)
+
+		lines_per_col = compiler.config.getint('formatting', 'lines_per_col')
+		self.assertEqual(lines_per_col, layout.lines_per_col)
+		for column in layout.columns[:-1]:
+			self.assertEqual(lines_per_col, len(column))
+		for line in layout.lines:
+			self.assertGreaterEqual(line.ratio, -1.0)
+
+		# Shemot begins at the top of the first column.
+		first = layout.columns[0].first_word
+		self.assertEqual('pasuk_0:0:0', first.pasuk_id)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from kavlar import KavlarConfig
+from metrics import GlyphMetrics, WordWidthService
+
+try:
+	from fontTools.fontBuilder import FontBuilder
+	from fontTools.pens.ttGlyphPen import TTGlyphPen
+	from fontTools.ttLib.tables._k_e_r_n import KernTable_format_0
+	from fontTools.ttLib import newTable
+except ImportError:
+	FontBuilder = None
+
+
+def build_test_font(fname, alef_advance=600):
+	"""Writes a tiny TrueType font with three Hebrew letters."""
+	glyphs = ['.notdef', 'alef', 'bet', 'gimel']
+	fb = FontBuilder(1000, isTTF=True)
+	fb.setupGlyphOrder(glyphs)
+	fb.setupCharacterMap({0x05D0: 'alef', 0x05D1: 'bet', 0x05D2: 'gimel'})
+	pen = TTGlyphPen(None)
+	empty = pen.glyph()
+	fb.setupGlyf(dict((g, empty) for g in glyphs))
+	fb.setupHorizontalMetrics({
+		'.notdef': (500, 0), 'alef': (alef_advance, 0),
+		'bet': (500, 0), 'gimel': (400, 0)})
+	fb.setupHorizontalHeader(ascent=800, descent=-200)
+	fb.setupNameTable({'familyName': 'Test', 'styleName': 'Regular'})
+	fb.setupOS2()
+	fb.setupPost()
+	kern = newTable('kern')
+	kern.version = 0
+	subtable = KernTable_format_0()
+	subtable.version = 0
+	subtable.coverage = 1
+	subtable.kernTable = {('alef', 'bet'): -100}
+	kern.kernTables = [subtable]
+	fb.font['kern'] = kern
+	fb.save(fname)
+
+
+@unittest.skipIf(FontBuilder is None, 'fontTools is not installed')
+class GlyphMetricsTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.mkdtemp()
+		self.font_fname = os.path.join(self.tmp_dir, 'test.ttf')
+		build_test_font(self.font_fname)
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp_dir)
+
+	def test_from_font_file(self):
+		metrics = GlyphMetrics.from_font_file(self.font_fname)
+		self.assertAlmostEqual(0.6, metrics.advance(u'א'))
+		self.assertAlmostEqual(0.4, metrics.advance(u'ג'))
+		self.assertAlmostEqual(0.5, metrics.advance(u'ת'))  # .notdef
+		self.assertAlmostEqual(-0.1, metrics.kerning(u'א', u'ב'))
+		self.assertAlmostEqual(0.0, metrics.kerning(u'ב', u'א'))
+		self.assertAlmostEqual(1.0, metrics.text_width(u'אב'))
+
+	def test_save_load(self):
+		metrics = GlyphMetrics.from_font_file(self.font_fname)
+		table_fname = os.path.join(self.tmp_dir, 'test.kvgm')
+		metrics.save(table_fname)
+		loaded = GlyphMetrics.load(table_fname)
+		self.assertEqual(list(metrics.codepoints), list(loaded.codepoints))
+		self.assertEqual(list(metrics.advances), list(loaded.advances))
+		self.assertEqual(list(metrics.kern_pairs), list(loaded.kern_pairs))
+		self.assertAlmostEqual(
+			metrics.text_width(u'גבא'), loaded.text_width(u'גבא'))
+
+	def test_word_width(self):
+		service = WordWidthService.from_font_file(
+			self.font_fname, cache_size=2)
+		# Widths are in units of the mean letter advance, 0.5em.
+		self.assertAlmostEqual(2.0, service.word_width(u'אב'))
+		# Vowels and cantillation are ignored and share the cache entry.
+		self.assertAlmostEqual(2.0, service.word_width(u'אָ֑ב'))
+		self.assertEqual(1, service.cache_info().hits)
+
+		for word in (u'א', u'ב', u'ג', u'גג'):
+			service.word_width(word)
+		self.assertEqual(2, service.cache_info().currsize)
+
+	def test_from_config(self):
+		config = KavlarConfig.default_config()
+		table_fname = os.path.join(self.tmp_dir, 'test.metrics')
+		config.set('metrics', 'font_file', self.font_fname)
+		config.set('metrics', 'metrics_table', table_fname)
+		service = WordWidthService.from_config(config)
+		self.assertAlmostEqual(2.0, service.word_width(u'אב'))
+		self.assertEqual(
+			service.metrics.font_digest,
+			GlyphMetrics.load(table_fname).font_digest)
+
+		# The table is used while the font is unchanged...
+		os.utime(table_fname, (0, 0))
+		WordWidthService.from_config(config)
+		self.assertEqual(0, os.path.getmtime(table_fname))
+
+		# ...and rebuilt when it changes. The mean advance is now 0.6em.
+		build_test_font(self.font_fname, alef_advance=900)
+		service = WordWidthService.from_config(config)
+		self.assertAlmostEqual(1.3 / 0.6, service.word_width(u'אב'), 6)
+		self.assertNotEqual(0, os.path.getmtime(table_fname))
+
+		# Without a font, the table is used as is.
+		config.set('metrics', 'font_file', '')
+		service = WordWidthService.from_config(config)
+		self.assertAlmostEqual(1.3 / 0.6, service.word_width(u'אב'), 6)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import io
+import unittest
+
+from kavlar import KavlarCompiler, KavlarConfig
+from lxml import etree
+from normalize import KEEP, REMOVE, SPACE, TextNormalizer
+from parse_xml_torah import XmlTorahParser
+from torah_model import TextFragment
+
+
+class TextNormalizerTest(unittest.TestCase):
+
+	PASUK = u'וַיַּ֧רְא אֱלֹהִ֛ים אֶת־הָא֖וֹר כִּי־ט֑וֹב׃'
+
+	def test_strip_all(self):
+		normalizer = TextNormalizer(True, True, SPACE, REMOVE, REMOVE)
+		self.assertEqual(
+			u'וירא אלהים את האור כי טוב', normalizer.normalize(self.PASUK))
+
+	def test_strip_cantillation_only(self):
+		normalizer = TextNormalizer(False, True)
+		self.assertEqual(
+			u'וַיַּרְא אֱלֹהִים אֶת־הָאוֹר כִּי־טוֹב׃',
+			normalizer.normalize(self.PASUK))
+
+	def test_keep_all(self):
+		normalizer = TextNormalizer(False, False, KEEP, KEEP, KEEP)
+		self.assertTrue(normalizer.is_identity)
+		self.assertEqual(self.PASUK, normalizer.normalize(self.PASUK))
+
+	def test_puncta_extraordinaria_kept(self):
+		normalizer = TextNormalizer(True, True)
+		self.assertEqual(u'אׄ', normalizer.normalize(u'אָׄ'))
+
+	def test_bad_policy(self):
+		self.assertRaises(ValueError, TextNormalizer, True, True, 'bogus')
+
+	def test_xml_file_matches_model(self):
+		fname = '../data/xml_torah/shemot.xml'
+		normalizer = TextNormalizer(True, True, SPACE, REMOVE, REMOVE)
+		out_f = io.BytesIO()
+		with open(fname, 'rb') as in_f:
+			normalizer.normalize_xml_file(in_f, out_f, chunk_size=4093)
+
+		parser = XmlTorahParser()
+		from_xml = parser.parse_xml_file(io.BytesIO(out_f.getvalue()))
+		from_model = normalizer.normalize_torah(
+			parser.parse_xml_filename(fname))
+		self.assertEqual(
+			etree.tostring(from_model.to_xml_elt()),
+			etree.tostring(from_xml.to_xml_elt()))
+
+	def test_to_tex(self):
+		config = KavlarConfig.default_config()
+		fragment = TextFragment(self.PASUK)
+		self.assertEqual(
+			u'וירא אלהים את האור כי טוב', fragment.to_tex(config))
+
+		config.set('formatting', 'strip_vowels', 'False')
+		config.set('formatting', 'strip_cantillation_marks', 'False')
+		config.set('formatting', 'maqaf', 'keep')
+		config.set('formatting', 'sof_pasuk', 'keep')
+		self.assertEqual(self.PASUK, fragment.to_tex(config))
+
+	def test_compile_strips_marks(self):
+		parser = XmlTorahParser()
+		shemot = parser.parse_xml_filename('../data/xml_torah/shemot.xml')
+		tex = KavlarCompiler.default_instance().compile_torah_model(shemot)
+		for c in (u'ַ', u'֑', u'־', u'׃'):
+			self.assertNotIn(c, tex)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -99,6 +99,31 @@ class MechonMamreParserTest(unittest.TestCase):
 		torah_xml_elt = torah.to_xml_elt()
 		xml = etree.tostring(torah_xml_elt, pretty_print=True, encoding='utf-8')
 
+	def test_parse_torah_filenames_parallel(self):
+		base_fname = '../data/mamre.cantillation/'
+		fnames = [
+			path.join(base_fname, 'c0%d.htm' % i) for i in range(1, 6)]
+		serial = MechonMamreParser().parse_torah_filenames(fnames)
+		parallel = MechonMamreParser(
+			max_workers=2).parse_torah_filenames(fnames)
+		# Same numbering and content as parsing in order.
+		self.assertEquals(
+			etree.tostring(serial.to_xml_elt(), encoding='utf-8'),
+			etree.tostring(parallel.to_xml_elt(), encoding='utf-8'))
+
+	def test_lxml_backend(self):
+		soup = MechonMamreParser()
+		fast = MechonMamreParser(backend=MechonMamreParser.LXML)
+		for i in range(1, 6):
+			fname = '../data/mamre.cantillation/c0%d.htm' % i
+			expected = etree.Element('root')
+			soup.parse_sefer_filename(fname, i).add_to_xml_tree(expected)
+			actual = etree.Element('root')
+			fast.parse_sefer_filename(fname, i).add_to_xml_tree(actual)
+			self.assertEquals(
+				etree.tostring(expected, encoding='utf-8'),
+				etree.tostring(actual, encoding='utf-8'))
+
 	def test_make_xml(self):
 		parser = MechonMamreParser()
 		sefer = parser.parse_sefer_filename('../data/mamre.cantillation/c01.htm')
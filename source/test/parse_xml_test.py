@@ -39,6 +39,32 @@ class XmlTorahParserTest(unittest.TestCase):
 		# XML generated from parsed tree should be equivalent to input XML.
 		self.assertEquals(expected_xml, actual_xml)
 
+	def test_streaming_parse_torah(self):
+		fname = '../data/xml_torah/torah.xml'
+		expected_xml = self._norm_xml_string_for_fname(fname)
+
+		parser = XmlTorahParser(streaming=True)
+		torah = parser.parse_xml_filename(fname)
+		actual_xml = self._norm_xml_string_for_torah_elt(torah)
+		self.assertEquals(expected_xml, actual_xml)
+
+	def test_iter_sefarim(self):
+		fname = '../data/xml_torah/torah.xml'
+		torah = XmlTorahParser().parse_xml_filename(fname)
+
+		parser = XmlTorahParser()
+		sefarim = list(parser.iter_sefarim_filename(fname))
+		self.assertEquals(5, len(sefarim))
+		for expected, actual in zip(torah.stream, sefarim):
+			self.assertEquals(Sefer, type(actual))
+			expected_xml = etree.Element('Torah')
+			expected.add_to_xml_tree(expected_xml)
+			actual_xml = etree.Element('Torah')
+			actual.add_to_xml_tree(actual_xml)
+			self.assertEquals(
+				self._xml_to_string(expected_xml),
+				self._xml_to_string(actual_xml))
+
 
 if __name__ == '__main__':
 	unittest.main()
\ No newline at end of file
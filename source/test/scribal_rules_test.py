@@ -0,0 +1,143 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import scribal_rules
+from column_solver import AnchoredColumnSolver, Anchor
+from kavlar import KavlarCompiler, KavlarConfig
+from layout import Layout, LayoutParams, Line, Paragraph, Word, letters_of
+from parse_xml_torah import XmlTorahParser
+from scribal_rules import ScribalRules
+from torah_model import ParashaDelimiter
+
+
+class ScribalRulesTest(unittest.TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		cls.shemot = XmlTorahParser().parse_xml_filename(
+			'../data/xml_torah/shemot.xml')
+		cls.config = KavlarConfig.default_config()
+		cls.rules = ScribalRules.from_config(cls.shemot, cls.config)
+
+	def _rules_of(self, violations):
+		return set(v.rule for v in violations)
+
+	def test_native_layout(self):
+		lay = KavlarCompiler(self.config).layout_torah_model(self.shemot)
+		violations = self.rules.validate(lay)
+		self.assertEqual(
+			sum(len(line.words) for line in lay.lines), len(self.rules))
+		self.assertNotIn(
+			scribal_rules.FORCED_BREAK, self._rules_of(violations))
+
+		# Ex. 14:28 and 34:11 are not at the top of a column.
+		self.assertEqual(
+			['pasuk_0:13:27', 'pasuk_0:33:10'],
+			[v.pasuk_id for v in violations
+			 if v.rule == scribal_rules.BIYA_SHEMO])
+
+		vav = [v for v in violations
+			   if v.rule == scribal_rules.VAVEI_HAAMUDIM]
+		self.assertEqual(
+			[c.column_idx for c in lay.columns
+			 if not letters_of(c.first_word.text).startswith(u'ו')],
+			[v.column for v in vav])
+		column = lay.columns[vav[0].column]
+		self.assertEqual(column.first_word.pasuk_id, vav[0].pasuk_id)
+		self.assertIs(column.lines[0], lay.lines[vav[0].line])
+
+		self.assertEqual(
+			violations[:3], self.rules.validate(lay, limit=3))
+		self.assertFalse(self.rules.is_valid(lay))
+		self.assertTrue(self.rules.is_valid(
+			lay, [scribal_rules.FORCED_BREAK, scribal_rules.BOOK_END]))
+
+		# Running two lines together across a forced break.
+		petuha = self.rules.breaks[0]
+		lines = list(lay.lines)
+		k = n_words = 0
+		while n_words <= petuha:
+			n_words += len(lines[k].words)
+			k += 1
+		k -= 1
+		lines[k:k + 2] = [Line(lines[k].words + lines[k + 1].words)]
+		broken = self.rules.validate(
+			Layout(lines, lay.lines_per_col, lay.line_width),
+			[scribal_rules.FORCED_BREAK])
+		self.assertEqual(
+			[(scribal_rules.FORCED_BREAK, self.rules.pasuk_ids[petuha], k)],
+			[(v.rule, v.pasuk_id, v.line) for v in broken])
+
+		del lines[-1]
+		self.assertRaises(
+			ValueError, self.rules.validate,
+			Layout(lines, lay.lines_per_col, lay.line_width))
+
+	def test_anchored_layout(self):
+		solver = AnchoredColumnSolver.from_config(self.config, max_workers=1)
+		violations = self.rules.validate(solver.solve(self.shemot))
+		self.assertNotIn(scribal_rules.BIYA_SHEMO, self._rules_of(violations))
+		self.assertNotIn(
+			scribal_rules.FORCED_BREAK, self._rules_of(violations))
+
+	def test_rules(self):
+		def words(pasuk_id, *texts):
+			return [Word(t, float(len(t)), pasuk_id) for t in texts]
+
+		a = words('pasuk_0:0:0', u'ויאמר', u'אל', u'משה')
+		b = words('pasuk_0:0:1', u'וידבר', u'אל', u'אהרן')
+		c = words('pasuk_1:0:0', u'ואלה', u'שמות')
+		paragraphs = [
+			Paragraph(0, a, [Paragraph.SPACE, Paragraph.SETUMA, 0],
+					  ParashaDelimiter.PETUHA),
+			Paragraph(0, b, [0, 0, 0], Paragraph.SEFER_END),
+			Paragraph(1, c, [0, 0], Paragraph.SEFER_END)]
+		params = LayoutParams(12.0, lines_per_col=3, book_end_lines=2)
+		rules = ScribalRules(
+			paragraphs, [Anchor('pasuk_1:0:0', u'ואלה')], params)
+		self.assertEqual([1], rules.setumot)
+		self.assertEqual([2, 5, 7], rules.breaks)
+		self.assertEqual([6], rules.anchors)
+
+		lines = [
+			# The setuma ends a justified line.
+			Line(a[:2], natural_width=8.0, stretch=0.5),
+			# The petuha leaves a gap of 9.
+			Line(a[2:], natural_width=3.0, is_last=True),
+			Line(b, natural_width=11.0, is_last=True),
+			Line([]),
+			Line([]),
+			Line(c, natural_width=9.0, is_last=True)]
+		# The anchored word is the first of its column, after the blank
+		# lines.
+		lay = Layout(lines, 3, 12.0)
+		self.assertEqual(
+			[(scribal_rules.SETUMA, 'pasuk_0:0:0', 0, 0)],
+			[(v.rule, v.pasuk_id, v.line, v.column)
+			 for v in rules.validate(lay)])
+
+		# A full petuha line is followed by a blank line.
+		lines[1] = Line(a[2:], natural_width=10.0, is_last=True)
+		lines.insert(2, Line([]))
+		lay = Layout(lines, 3, 12.0)
+		self.assertEqual([], rules.validate(lay, [scribal_rules.PETUHA]))
+		del lines[2]
+		self.assertEqual(
+			[(scribal_rules.PETUHA, 'pasuk_0:0:0', 1)],
+			[(v.rule, v.pasuk_id, v.line)
+			 for v in rules.validate(Layout(lines, 3, 12.0))
+			 if v.rule == scribal_rules.PETUHA])
+
+		# Too few blank lines between sefarim.
+		del lines[3]
+		self.assertEqual(
+			[(scribal_rules.BOOK_END, 'pasuk_0:0:1', 4)],
+			[(v.rule, v.pasuk_id, v.line)
+			 for v in rules.validate(
+				 Layout(lines, 3, 12.0), [scribal_rules.BOOK_END])])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from concurrent.futures import ProcessPoolExecutor
+from lxml import etree
+from parse_xml_torah import XmlTorahParser
+from shared_store import SharedTorahStore
+from torah_store import TorahStore
+
+
+def _sefer_summary(job):
+	name, n = job
+	shared = SharedTorahStore.attach(name)
+	try:
+		sefer = shared.sefer(n)
+		return sefer.name, len(sefer.stream), shared.perek(n, 2).perek
+	finally:
+		shared.close()
+
+
+class SharedTorahStoreTest(unittest.TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		cls.torah = XmlTorahParser().parse_xml_filename(
+			'../data/xml_torah/torah.xml')
+		cls.store = TorahStore.from_model(cls.torah)
+
+	def _xml(self, elt):
+		holder = etree.Element('Holder')
+		elt.add_to_xml_tree(holder)
+		return etree.tostring(holder)
+
+	def test_round_trip(self):
+		with SharedTorahStore.publish(self.store) as shared:
+			self.assertEqual(len(self.store), len(shared))
+			self.assertEqual(self.store.strings, list(shared.store.strings))
+			self.assertEqual(self._xml(self.torah), self._xml(shared.model()))
+
+			attached = SharedTorahStore.attach(shared.name)
+			vayikra = attached.sefer(2)
+			self.assertIs(vayikra, attached.sefer(2))
+			self.assertEqual(
+				self._xml(self.torah.stream[2]), self._xml(vayikra))
+			self.assertEqual(
+				self._xml(self.torah.stream[4].stream[31]),
+				self._xml(attached.perek(4, 31)))
+			self.assertRaises(IndexError, attached.perek, 4, 34)
+			attached.close()
+			# Rebuilt models outlive the attachment.
+			self.assertEqual(u'ויקרא', vayikra.name)
+		self.assertRaises(
+			FileNotFoundError, SharedTorahStore.attach, shared.name)
+
+	def test_sefer_root(self):
+		shemot = self.torah.stream[1]
+		with SharedTorahStore.publish(TorahStore.from_model(shemot)) as shared:
+			self.assertEqual([0], shared.sefer_nodes())
+			self.assertEqual(self._xml(shemot), self._xml(shared.sefer(0)))
+
+	def test_workers(self):
+		with SharedTorahStore.publish(self.store) as shared:
+			jobs = [(shared.name, n) for n in range(5)]
+			with ProcessPoolExecutor(max_workers=2) as executor:
+				results = list(executor.map(_sefer_summary, jobs))
+		self.assertEqual(
+			[(s.name, len(s.stream), s.stream[2].perek)
+			 for s in self.torah.iter_stream],
+			results)
+
+
+if __name__ == '__main__':
+	unittest.main()
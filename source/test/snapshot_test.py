@@ -0,0 +1,97 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import snapshot
+from kavlar import KavlarConfig
+from lxml import etree
+from parse_xml_torah import XmlTorahParser
+from snapshot import Snapshot, SnapshotCache
+from torah_store import TorahStore
+
+
+class SnapshotCacheTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.mkdtemp()
+		self.fname = os.path.join(self.tmp_dir, 'shemot.xml')
+		shutil.copy('../data/xml_torah/shemot.xml', self.fname)
+		self.cache = SnapshotCache(os.path.join(self.tmp_dir, 'cache'))
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp_dir)
+
+	def _xml(self, torah):
+		return etree.tostring(torah.to_xml_elt(), encoding='utf-8')
+
+	def test_round_trip(self):
+		shemot = XmlTorahParser().parse_xml_filename(self.fname)
+		store = TorahStore.from_model(shemot)
+		fname = os.path.join(self.tmp_dir, 'shemot.snapshot')
+		Snapshot.save(store, fname)
+		loaded = Snapshot.load(fname)
+		self.assertEqual(list(store.ends), list(loaded.ends))
+		self.assertEqual(store.strings, list(loaded.strings))
+		self.assertEqual(self._xml(shemot), self._xml(loaded.to_model()))
+
+	def test_hit_and_invalidation(self):
+		calls = []
+		parser = XmlTorahParser()
+
+		def parse():
+			calls.append(1)
+			return parser.parse_xml_filename(self.fname)
+
+		def load():
+			return self.cache.load_store(
+				[self.fname], 'XmlTorahParser', parser.VERSION, parse)
+
+		expected = self._xml(parse())
+		del calls[:]
+		self.assertEqual(expected, self._xml(load().to_model()))
+		self.assertEqual(expected, self._xml(load().to_model()))
+		self.assertEqual(1, len(calls))
+
+		# A different parser version or input misses.
+		self.cache.load_store(
+			[self.fname], 'XmlTorahParser', parser.VERSION + 1, parse)
+		self.assertEqual(2, len(calls))
+		with open(self.fname, 'rb') as f:
+			data = f.read()
+		with open(self.fname, 'wb') as f:
+			f.write(data.replace(u'שמות'.encode('utf-8'), b'Exodus', 1))
+		self.assertEqual('Exodus', load().to_model().stream[0].name)
+		self.assertEqual(3, len(calls))
+
+	def test_corrupt_snapshot(self):
+		self.cache.parse_xml_filename(self.fname)
+		key = SnapshotCache.key(
+			[self.fname], 'XmlTorahParser', XmlTorahParser.VERSION)
+		with open(self.cache.path_for(key), 'r+b') as f:
+			f.truncate(100)
+		self.assertIsNone(self.cache.load(key))
+		shemot = self.cache.parse_xml_filename(self.fname)
+		self.assertEqual(
+			self._xml(XmlTorahParser().parse_xml_filename(self.fname)),
+			self._xml(shemot))
+
+	def test_parse_with_config(self):
+		config = KavlarConfig.default_config()
+		expected = self._xml(XmlTorahParser().parse_xml_filename(self.fname))
+		self.assertEqual(
+			expected, self._xml(snapshot.parse_xml_filename(self.fname, config)))
+		self.assertFalse(os.path.exists(self.cache.cache_dir))
+
+		config.set('cache', 'snapshot_dir', self.cache.cache_dir)
+		for _ in range(2):
+			self.assertEqual(expected, self._xml(
+				snapshot.parse_xml_filename(self.fname, config)))
+		self.assertEqual(1, len(os.listdir(self.cache.cache_dir)))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,139 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import sweep
+from kavlar import KavlarCompiler, KavlarConfig
+from layout import Layout, LayoutParams, Line, Word
+from parse_xml_torah import XmlTorahParser
+from sweep import ConfigSweep
+from torah_store import TorahStore
+
+
+class ConfigSweepTest(unittest.TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		cls.shemot = XmlTorahParser().parse_xml_filename(
+			'../data/xml_torah/shemot.xml')
+
+	def setUp(self):
+		self.grid = [
+			(('formatting', 'lines_per_col'), ['42', '48']),
+			(('formatting', 'aspect_ratio'), ['3.5', '4.0'])]
+
+	def test_matches_compiler(self):
+		results = ConfigSweep(self.shemot).sweep(
+			KavlarConfig.default_config(), self.grid)
+		self.assertEqual(4, len(results))
+		for options, stats in results:
+			config = KavlarConfig.default_config()
+			for (section, option), value in options.items():
+				config.set(section, option, value)
+			lay = KavlarCompiler(config).layout_torah_model(self.shemot)
+			self.assertEqual(lay.n_columns, stats.n_columns)
+			self.assertEqual(len(lay.lines), stats.n_lines)
+			self.assertAlmostEqual(lay.total_demerits, stats.total_demerits)
+			self.assertLessEqual(stats.min_ratio, stats.mean_abs_ratio)
+
+		by_options = dict(
+			((o[('formatting', 'lines_per_col')],
+			  o[('formatting', 'aspect_ratio')]), s) for o, s in results)
+		# 42 lines at 3.5 and 48 lines at 4.0 are both 42 letters wide.
+		self.assertEqual(
+			by_options[('42', '3.5')].n_lines,
+			by_options[('48', '4.0')].n_lines)
+
+	def test_shared_work(self):
+		config_sweep = ConfigSweep(self.shemot)
+		configs = [c for _, c in sweep.config_grid(
+			KavlarConfig.default_config(), self.grid)]
+		first = config_sweep.evaluate(configs)
+		self.assertEqual(1, len(config_sweep._paragraphs))
+		self.assertEqual(4, len(config_sweep._stats))
+		self.assertEqual(first, config_sweep.evaluate(reversed(configs))[::-1])
+		self.assertEqual(4, len(config_sweep._stats))
+
+		configs[0].set('formatting', 'maqaf', 'keep')
+		config_sweep.evaluate(configs[:1])
+		self.assertEqual(2, len(config_sweep._paragraphs))
+		self.assertEqual(5, len(config_sweep._stats))
+
+	def test_store(self):
+		config = KavlarConfig.default_config()
+		expected = ConfigSweep(self.shemot).sweep(config, self.grid)
+		store = TorahStore.from_model(self.shemot)
+		self.assertEqual(expected, ConfigSweep(store).sweep(config, self.grid))
+
+		tmp_dir = tempfile.mkdtemp()
+		try:
+			config.set('cache', 'snapshot_dir', tmp_dir)
+			for _ in range(2):
+				config_sweep = ConfigSweep.from_xml_filename(
+					'../data/xml_torah/shemot.xml', config=config)
+				self.assertIsInstance(config_sweep.torah, TorahStore)
+				self.assertEqual(
+					expected, config_sweep.sweep(config, self.grid))
+		finally:
+			shutil.rmtree(tmp_dir)
+
+	def test_parallel(self):
+		serial = ConfigSweep(self.shemot).sweep(
+			KavlarConfig.default_config(), self.grid)
+		parallel = ConfigSweep(self.shemot, max_workers=2).sweep(
+			KavlarConfig.default_config(), self.grid)
+		self.assertEqual(serial, parallel)
+
+	def test_unjustifiable_lines(self):
+		words = [Word(u'אב', 2.0, 'pasuk_0:0:0')] * 2
+		lay = Layout([
+			Line(words, natural_width=5.0, stretch=1.0),
+			Line(words[:1], natural_width=2.0),
+			Line(words, natural_width=8.0, ratio=-1.0),
+			Line(words[:1], natural_width=2.0, is_last=True)], 2, 7.0)
+		stats = sweep.layout_stats(lay)
+		self.assertEqual(float('inf'), stats.max_ratio)
+		self.assertEqual(float('-inf'), stats.min_ratio)
+		self.assertEqual(1, stats.infeasible_lines)
+		self.assertEqual(1, stats.overfull_lines)
+		self.assertEqual(2.0, stats.mean_abs_ratio)
+		self.assertEqual(stats, sweep.layout_stats(lay, LayoutParams(7.0, 2)))
+
+		options = {('formatting', 'lines_per_col'): '2'}
+		[result] = json.loads(json.dumps(
+			sweep.results_json([(options, stats)]), allow_nan=False))
+		self.assertEqual({'formatting.lines_per_col': '2'}, result['options'])
+		self.assertIsNone(result['max_ratio'])
+		self.assertIsNone(result['min_ratio'])
+		self.assertEqual(2.0, result['mean_abs_ratio'])
+		self.assertEqual(1, result['infeasible_lines'])
+
+	def test_grid_option(self):
+		self.assertEqual(
+			(('formatting', 'lines_per_col'), ['42', '48']),
+			sweep.parse_grid_option('formatting.lines_per_col=42, 48'))
+		self.assertRaises(ValueError, sweep.parse_grid_option, 'lines=42')
+
+	def test_read_config(self):
+		fd, fname = tempfile.mkstemp(suffix='.ini')
+		try:
+			with os.fdopen(fd, 'w') as f:
+				f.write('[formatting]\nlines_per_col = 48\n')
+			config = KavlarConfig.read_config(fname)
+		finally:
+			os.unlink(fname)
+		self.assertEqual(48, config.getint('formatting', 'lines_per_col'))
+		self.assertEqual('4.0', config.get('formatting', 'aspect_ratio'))
+
+		copy = KavlarConfig.copy_config(config)
+		copy.set('formatting', 'lines_per_col', '42')
+		self.assertEqual('48', config.get('formatting', 'lines_per_col'))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import torah_model
+from lxml import etree
+from parse_xml_torah import XmlTorahParser
+from torah_model import ENTER, LEAF, LEAVE, ModelEvents
+from torah_model import PasukFragment, PasukStart, Perek, Sefer, Stream
+
+
+def preorder(elt):
+	"""The elements of a model subtree, recursively."""
+	ret = [elt]
+	if isinstance(elt, Stream):
+		for child in elt.stream:
+			ret.extend(preorder(child))
+	return ret
+
+
+class ModelEventsTest(unittest.TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		cls.torah = XmlTorahParser().parse_xml_filename(
+			'../data/xml_torah/torah.xml')
+
+	def test_order(self):
+		events = list(ModelEvents(self.torah))
+		self.assertEqual(
+			[id(elt) for elt in preorder(self.torah)],
+			[id(elt) for kind, elt, _, _, _ in events if kind != LEAVE])
+
+		open_elts = []
+		for kind, elt, _, _, _ in events:
+			if kind == ENTER:
+				self.assertIsInstance(elt, Stream)
+				open_elts.append(elt)
+			elif kind == LEAVE:
+				self.assertIs(open_elts.pop(), elt)
+			else:
+				self.assertNotIsInstance(elt, Stream)
+		self.assertEqual([], open_elts)
+
+	def test_context(self):
+		n_fragments = 0
+		for kind, elt, sefer, perek, pasuk in ModelEvents(self.torah):
+			t = type(elt)
+			if t is Sefer:
+				self.assertIs(elt, sefer)
+				self.assertIsNone(perek)
+			elif t is Perek:
+				self.assertIs(elt, perek)
+				self.assertIn(elt, sefer.stream)
+			elif t is PasukStart:
+				self.assertIs(elt, pasuk)
+			elif t is PasukFragment:
+				self.assertIn(elt, perek.stream)
+				self.assertEqual(elt.pasuk_id, pasuk.pasuk_id)
+				n_fragments += kind == ENTER
+			elif kind == LEAF:
+				self.assertTrue(pasuk.pasuk_id.startswith(
+					'pasuk_%d:%d:' % (sefer.sefer_idx, perek.perek_idx)))
+		self.assertEqual(5844, n_fragments)
+
+		perek = self.torah.stream[1].stream[14]
+		events = list(ModelEvents(perek))
+		self.assertEqual((ENTER, perek, None, perek, None), events[0])
+		self.assertEqual(
+			(LEAVE, perek, None, perek, events[-2][4]), events[-1])
+
+	def test_skip(self):
+		events = ModelEvents(self.torah)
+		kinds = []
+		for kind, elt, _, _, _ in events:
+			kinds.append((kind, type(elt)))
+			if kind == ENTER and type(elt) is Perek:
+				events.skip()
+		self.assertEqual(
+			[(ENTER, torah_model.Torah), (ENTER, Sefer), (ENTER, Perek),
+			 (LEAVE, Perek), (ENTER, Perek)], kinds[:5])
+		self.assertEqual(2 + 2 * 5 + 2 * 187, len(kinds))
+
+		leaf = self.torah.stream[0].stream[0].stream[0]
+		self.assertEqual(
+			[(LEAF, leaf, None, None, leaf)], list(ModelEvents(leaf)))
+
+	def test_build_xml_tree(self):
+		xml_elt = torah_model.build_xml_tree(self.torah)
+		with open('../data/xml_torah/torah.xml', 'rb') as f:
+			expected = etree.parse(
+				f, etree.XMLParser(remove_blank_text=True)).getroot()
+		self.assertEqual(etree.tostring(expected), etree.tostring(xml_elt))
+
+		holder = etree.Element('Holder')
+		perek = self.torah.stream[2].stream[16]
+		perek.add_to_xml_tree(holder)
+		self.assertEqual(
+			etree.tostring(expected[2][16]), etree.tostring(holder[0]))
+
+
+if __name__ == '__main__':
+	unittest.main()
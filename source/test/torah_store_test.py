@@ -0,0 +1,66 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from layout import ParagraphBuilder
+from lxml import etree
+from parse_xml_torah import XmlTorahParser
+from torah_model import PasukFragment
+import torah_store
+from torah_store import TorahStore
+
+
+class TorahStoreTest(unittest.TestCase):
+
+	def setUp(self):
+		parser = XmlTorahParser()
+		self.shemot = parser.parse_xml_filename(
+			'../data/xml_torah/shemot.xml')
+
+	def _xml(self, torah):
+		return etree.tostring(torah.to_xml_elt(), encoding='utf-8')
+
+	def test_round_trip(self):
+		store = TorahStore.from_model(self.shemot)
+		self.assertEqual(self._xml(self.shemot), self._xml(store.to_model()))
+
+	def test_from_xml_file(self):
+		fname = '../data/xml_torah/shemot.xml'
+		from_xml = TorahStore.from_xml_filename(fname)
+		from_model = TorahStore.from_model(self.shemot)
+		for name, _ in torah_store.COLUMNS:
+			self.assertEqual(
+				getattr(from_model, name), getattr(from_xml, name))
+		self.assertEqual(from_model.strings, from_xml.strings)
+
+	def test_structure(self):
+		store = TorahStore.from_model(self.shemot)
+		sefarim = list(store.children(0))
+		self.assertEqual(1, len(sefarim))
+		self.assertEqual(u'שמות', store.string(store.labels[sefarim[0]]))
+		perakim = list(store.children(sefarim[0]))
+		self.assertEqual(40, len(perakim))
+		for perek in perakim:
+			self.assertEqual(sefarim[0], store.parents[perek])
+
+		fragment = next(store.find(torah_store.PASUK_FRAGMENT))
+		model_fragment = next(
+			e for e in self.shemot.stream[0].stream[0].stream
+			if type(e) == PasukFragment)
+		self.assertEqual(
+			u''.join(c.text for c in model_fragment.stream),
+			store.text(fragment))
+
+	def test_paragraphs(self):
+		store = TorahStore.from_model(self.shemot)
+		builder = ParagraphBuilder()
+		expected = builder.paragraphs_for_torah(self.shemot)
+		actual = builder.paragraphs_for_store(store)
+		self.assertEqual(
+			[(p.sefer_idx, p.words, p.glues, p.end_kind) for p in expected],
+			[(p.sefer_idx, p.words, p.glues, p.end_kind) for p in actual])
+
+
+if __name__ == '__main__':
+	unittest.main()
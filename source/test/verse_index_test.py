@@ -0,0 +1,65 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from parse_xml_torah import XmlTorahParser
+from torah_model import PasukFragment, PasukStart
+from verse_index import VerseIndex
+
+
+class VerseIndexTest(unittest.TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		parser = XmlTorahParser()
+		cls.torah = parser.parse_xml_filename('../data/xml_torah/torah.xml')
+		cls.index = VerseIndex(cls.torah)
+
+	def test_counts(self):
+		n_starts = 0
+		for sefer in self.torah.iter_stream:
+			for perek in sefer.iter_stream:
+				n_starts += sum(
+					1 for e in perek.iter_stream if type(e) == PasukStart)
+		self.assertEqual(n_starts, len(self.index))
+		self.assertEqual(187, len(self.index.perakim))
+
+	def test_lookup(self):
+		verse = self.index[(0, 0, 3)]
+		self.assertEqual('pasuk_0:0:3', verse.pasuk_id)
+		self.assertEqual(3, verse.position)
+		self.assertIs(verse, self.index['pasuk_0:0:3'])
+		self.assertEqual(u'ד', verse.start.pasuk)
+		self.assertEqual(u'בראשית', verse.sefer.name)
+		self.assertEqual([PasukFragment], [type(f) for f in verse.fragments])
+		self.assertIsNone(self.index.find((0, 0, 999)))
+		self.assertRaises(KeyError, self.index.position, 'pasuk_9:9:9')
+		self.assertEqual(1, self.index.sefer_idx(u'שמות'))
+
+	def test_flat_positions(self):
+		for i, verse in enumerate(self.index.verses):
+			self.assertEqual(i, verse.position)
+			self.assertEqual(i, self.index.position(verse.pasuk_id))
+
+	def test_range(self):
+		# Exodus 15:1-21, the song at the sea and Miriam's song.
+		shirah = self.index.range((1, 14, 0), (1, 14, 20))
+		self.assertEqual(21, len(shirah))
+		self.assertEqual('pasuk_1:14:0', shirah[0].pasuk_id)
+		self.assertEqual('pasuk_1:14:20', shirah[-1].pasuk_id)
+		self.assertEqual(
+			list(range(shirah[0].position, shirah[0].position + 21)),
+			[v.position for v in shirah])
+
+	def test_perek(self):
+		entry = self.index.perek('perek_1:14')
+		self.assertIs(entry, self.index.perek((1, 14)))
+		self.assertEqual(u'טו', entry.perek.perek)
+		verses = self.index.perek_verses((1, 14))
+		self.assertEqual(27, len(verses))
+		self.assertEqual(entry.first, verses[0].position)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,61 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from kavlar import KavlarCompiler, KavlarConfig
+from parse_xml_torah import XmlTorahParser
+from sweep import ConfigSweep
+from width_search import LineWidthSearch
+
+
+class LineWidthSearchTest(unittest.TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		cls.shemot = XmlTorahParser().parse_xml_filename(
+			'../data/xml_torah/shemot.xml')
+
+	def setUp(self):
+		self.search = LineWidthSearch(
+			ConfigSweep(self.shemot), KavlarConfig.default_config(),
+			resolution=0.1)
+
+	def test_hits_target(self):
+		default = KavlarCompiler.default_instance().layout_torah_model(
+			self.shemot)
+		target = default.n_columns + 5
+		result = self.search.search(target)
+		self.assertEqual(target, result.stats.n_columns)
+		self.assertLess(result.n_layouts, 20)
+		self.assertGreater(default.line_width, result.line_width)
+
+		# The result is reproduced by a compile with its aspect ratio.
+		config = KavlarConfig.default_config()
+		config.set('formatting', 'aspect_ratio', repr(result.aspect_ratio))
+		lay = KavlarCompiler(config).layout_torah_model(self.shemot)
+		self.assertEqual(target, lay.n_columns)
+		self.assertAlmostEqual(result.line_width, lay.line_width)
+
+		# No wider or narrower line on the grid hits the target with
+		# fewer demerits among those compared.
+		for step, stats in self.search._probes.items():
+			if stats.n_columns == target:
+				self.assertGreaterEqual(
+					stats.total_demerits, result.stats.total_demerits)
+
+	def test_memoized(self):
+		target = KavlarCompiler.default_instance().layout_torah_model(
+			self.shemot).n_columns
+		first = self.search.search(target)
+		again = self.search.search(target)
+		self.assertEqual(first.line_width, again.line_width)
+		self.assertEqual(0, again.n_layouts)
+
+	def test_unreachable(self):
+		self.assertRaises(ValueError, self.search.search, 1)
+		self.assertRaises(ValueError, self.search.search, 100000)
+
+
+if __name__ == '__main__':
+	unittest.main()
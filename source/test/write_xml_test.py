@@ -0,0 +1,91 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import gzip
+import io
+import lzma
+import os
+import shutil
+import tempfile
+import unittest
+
+from lxml import etree
+from parse_xml_torah import XmlTorahParser, compressed_opener
+from torah_model import Sefer, Torah
+from torah_store import TorahStore
+from write_xml_torah import XmlTorahWriter
+from xml_offsets import XmlOffsetIndex
+
+
+class XmlTorahWriterTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.mkdtemp()
+		self.writer = XmlTorahWriter()
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp_dir)
+
+	def _read(self, fname):
+		with open(fname, 'rb') as f:
+			return f.read()
+
+	def test_same_as_tostring(self):
+		fname = '../data/xml_torah/shemot.xml'
+		shemot = XmlTorahParser().parse_xml_filename(fname)
+		f = io.BytesIO()
+		self.writer.write(shemot, f)
+		self.assertEqual(self._read(fname), f.getvalue())
+
+		for torah in (Torah(), self._torah_with_empty_sefer()):
+			f = io.BytesIO()
+			self.writer.write(torah, f)
+			expected = etree.tostring(
+				torah.to_xml_elt(), pretty_print=True,
+				xml_declaration=True, encoding='utf-8')
+			self.assertEqual(expected, f.getvalue())
+
+	def _torah_with_empty_sefer(self):
+		torah = Torah()
+		torah.append_to_stream(Sefer(u'שמות', 0, 'sefer_0'))
+		return torah
+
+	def test_stream_sefarim(self):
+		fname = '../data/xml_torah/torah.xml'
+		sefarim = XmlTorahParser().iter_sefarim_filename(fname)
+		out_fname = os.path.join(self.tmp_dir, 'torah.xml')
+		self.writer.write_filename(sefarim, out_fname)
+		self.assertEqual(self._read(fname), self._read(out_fname))
+
+	def test_compressed(self):
+		fname = '../data/xml_torah/shemot.xml'
+		expected = self._read(fname)
+		shemot = XmlTorahParser().parse_xml_filename(fname)
+		self.assertIsNone(compressed_opener(fname))
+		for suffix, opener in (('.gz', gzip.open), ('.xz', lzma.open)):
+			out_fname = os.path.join(self.tmp_dir, 'shemot.xml' + suffix)
+			self.writer.write_filename(shemot, out_fname)
+			self.assertNotEqual(expected[:6], self._read(out_fname)[:6])
+			self.assertIs(opener, compressed_opener(out_fname))
+			self.assertLess(os.path.getsize(out_fname), len(expected) // 4)
+
+			for parser in (XmlTorahParser(), XmlTorahParser(streaming=True)):
+				parsed = parser.parse_xml_filename(out_fname)
+				self.assertEqual(
+					etree.tostring(shemot.to_xml_elt()),
+					etree.tostring(parsed.to_xml_elt()))
+			store = TorahStore.from_xml_filename(out_fname)
+			self.assertEqual(
+				len(TorahStore.from_model(shemot)), len(store))
+			self.assertRaises(ValueError, XmlOffsetIndex.scan, out_fname)
+
+		# The compression may be given whatever the suffix.
+		out_fname = os.path.join(self.tmp_dir, 'shemot.xml')
+		self.writer.write_filename(shemot, out_fname, XmlTorahWriter.GZIP)
+		self.assertEqual(b'\x1f\x8b', self._read(out_fname)[:2])
+		self.assertRaises(
+			ValueError, self.writer.write_filename, shemot, out_fname, 'zip')
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from kavlar import KavlarCompiler, KavlarConfig
+from lxml import etree
+from parse_xml_torah import XmlTorahParser
+from torah_model import Torah
+from xml_offsets import XmlOffsetIndex
+
+
+class XmlOffsetIndexTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.mkdtemp()
+		self.fname = os.path.join(self.tmp_dir, 'torah.xml')
+		shutil.copy('../data/xml_torah/torah.xml', self.fname)
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp_dir)
+
+	def _xml(self, elt):
+		root = etree.Element('root')
+		elt.add_to_xml_tree(root)
+		return etree.tostring(root, encoding='utf-8')
+
+	def test_scan(self):
+		index = XmlOffsetIndex.scan(self.fname)
+		self.assertEqual(5, len(index.sefarim))
+		self.assertEqual(
+			187, sum(len(s['perakim']) for s in index.sefarim))
+		with open(self.fname, 'rb') as f:
+			data = f.read()
+		for sefer in index.sefarim:
+			self.assertTrue(data[sefer['start']:].startswith(b'<Sefer '))
+			self.assertTrue(data[:sefer['end']].endswith(b'</Sefer>'))
+			for perek in sefer['perakim']:
+				chunk = data[perek['start']:perek['end']]
+				self.assertTrue(chunk.startswith(b'<Perek '))
+				self.assertTrue(chunk.endswith(b'</Perek>'))
+
+	def test_side_file(self):
+		index = XmlOffsetIndex.for_filename(self.fname)
+		side_fname = self.fname + XmlOffsetIndex.SUFFIX
+		self.assertTrue(os.path.exists(side_fname))
+		self.assertEqual(
+			index.sefarim, XmlOffsetIndex.for_filename(self.fname).sefarim)
+
+		# Editing the XML invalidates the side file.
+		with open(self.fname, 'rb') as f:
+			data = f.read()
+		with open(self.fname, 'wb') as f:
+			f.write(b'<!-- edited -->\n' + data[data.index(b'<Torah'):])
+		edited = XmlOffsetIndex.for_filename(self.fname)
+		self.assertNotEqual(
+			index.sefarim[0]['start'], edited.sefarim[0]['start'])
+		self.assertEqual(edited.sefarim, XmlOffsetIndex.scan(self.fname).sefarim)
+
+	def test_parse_range(self):
+		torah = XmlTorahParser().parse_xml_filename(self.fname)
+		index = XmlOffsetIndex.for_filename(self.fname)
+		partial = index.parse_range_filename(self.fname, u'שמות', 14, 16)
+		self.assertEqual(Torah, type(partial))
+		sefer = partial.stream[0]
+		self.assertEqual(1, sefer.sefer_idx)
+		self.assertEqual([14, 15, 16], [p.perek_idx for p in sefer.stream])
+		for perek in sefer.stream:
+			self.assertEqual(
+				self._xml(torah.stream[1].stream[perek.perek_idx]),
+				self._xml(perek))
+
+	def test_compile_range(self):
+		compiler = KavlarCompiler.default_instance()
+		tex = compiler.compile_xml_range(self.fname, 4, 33)
+		self.assertIn(u'\\section{דברים}', tex)
+		self.assertIn(u'וימת שם משה', tex)
+		self.assertNotIn(u'האזינו', tex)
+
+	def test_cache_dir(self):
+		cache_dir = os.path.join(self.tmp_dir, 'offsets')
+		config = KavlarConfig.default_config()
+		config.set('cache', 'offsets_dir', cache_dir)
+		tex = KavlarCompiler(config).compile_xml_range(self.fname, 4, 33)
+		self.assertIn(u'וימת שם משה', tex)
+		self.assertEqual(
+			['offsets', 'torah.xml'], sorted(os.listdir(self.tmp_dir)))
+		side_fname = XmlOffsetIndex.side_filename(self.fname, cache_dir)
+		self.assertEqual([os.path.basename(side_fname)], os.listdir(cache_dir))
+		self.assertEqual(
+			XmlOffsetIndex.scan(self.fname).sefarim,
+			XmlOffsetIndex.for_filename(self.fname, cache_dir).sefarim)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -1,28 +1,67 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
-"""Classes describing the object model of a sefer torah or tikkun."""
+"""Classes describing the object model of a sefer torah or tikkun.
+
+ModelEvents traverses a model hierarchy without recursion, as a flat
+sequence of events entering and leaving the Streams and visiting the
+leaves. Building the XML and TeX of the model, and storing it, are loops
+over these events.
+"""
+
+import collections
+import normalize
 
 from lxml import etree
 
 
 class TeXAble(object):
 
-	def to_tex(self, kavlar_config):
-		"""Returns tex code for this element."""
+	__slots__ = ()
+
+	def to_tex(self, kavlar_config, normalizer=None):
+		"""Returns tex code for this element.
+
+		Args:
+			kavlar_config: the KavlarConfig to compile with.
+			normalizer: the normalize.TextNormalizer of kavlar_config;
+				built from it if None. Pass it when compiling many
+				elements, since reading the config is slow.
+		"""
 		msg = (
 			'%s does not implement to_tex' %
 			self.__class__.__name__)
 		raise NotImplementedError(msg)
 
+	def iter_tex(self, kavlar_config, fragment_cache=None, normalizer=None):
+		"""Yields the tex code for this element in pieces.
+
+		Args:
+			kavlar_config: the KavlarConfig to compile with.
+			fragment_cache: optional fragment_cache.FragmentCache to
+				take the TeX of cached descendants from.
+			normalizer: as in to_tex.
+		"""
+		yield self.to_tex(kavlar_config, normalizer)
+
 
 class XmlAble(object):
 	"""Interface for items in the hierarchy that can be made to/from XML."""
 
+	__slots__ = ()
+
 	def add_to_xml_tree(self, xml_elt):
 		"""Append thyself to this container element as appropriate."""
+		build_xml_tree(self, xml_elt)
+
+	def new_xml_elt(self, parent):
+		"""Returns the XML element of thyself alone, without children.
+
+		Args:
+			parent: the element to append it to, or None.
+		"""
 		msg = (
-			'%s does not implement add_to_xml_tree' %
+			'%s does not implement new_xml_elt' %
 			self.__class__.__name__)
 		raise NotImplementedError(msg)
 
@@ -41,6 +80,8 @@ class XmlAble(object):
 class Stream(XmlAble, TeXAble):
 	"""Interface for elements well-represented as a stream of children."""
 
+	__slots__ = ('stream',)
+
 	def append_to_stream(self, elt):
 		self.stream.append(elt)
 
@@ -48,46 +89,65 @@ class Stream(XmlAble, TeXAble):
 	def iter_stream(self):
 		return iter(self.stream)
 
-	def add_stream_to_xml_tree(self, xml_elt):
-		"""Elements in the stream must implement XmlAble."""
-		for child in self.iter_stream:
-			child.add_to_xml_tree(xml_elt)
-
 	def get_stream_tex(self, kavlar_config):
 		"""Returns a list of unicode strings of TeX code."""
 		kc = kavlar_config
-		return [c.to_tex(kc) for c in self.stream]
+		normalizer = normalize.TextNormalizer.from_config(kc)
+		return [c.to_tex(kc, normalizer) for c in self.stream]
+
+	def tex_header(self, kavlar_config):
+		"""Returns the TeX code preceding the stream, if any."""
+		return None
+
+	def iter_tex(self, kavlar_config, fragment_cache=None, normalizer=None):
+		"""Yields the TeX code of the stream, one leaf at a time.
+
+		Containers add nothing of their own but their tex_header. The
+		header and footer of the Torah are handled by the caller.
+		"""
+		kc = kavlar_config
+		cache = fragment_cache
+		if normalizer is None:
+			normalizer = normalize.TextNormalizer.from_config(kc)
+		events = ModelEvents(self)
+		for kind, elt, _, _, _ in events:
+			if kind == LEAF:
+				yield elt.to_tex(kc, normalizer)
+			elif kind == ENTER:
+				if elt is not self and cache is not None and cache.caches(elt):
+					events.skip()
+					yield from cache.iter_tex(elt, kc, normalizer)
+				else:
+					header = elt.tex_header(kc)
+					if header:
+						yield header
+
+	def to_tex(self, kavlar_config, normalizer=None):
+		return ''.join(self.iter_tex(kavlar_config, normalizer=normalizer))
 
 
 class Torah(Stream):
 	"""Ordered stream of Sefarim."""
+	__slots__ = ()
+
 	def __init__(self):
 		self.stream = []
 
 	def to_xml_elt(self):
-		self_xml = etree.Element(
-			self.__class__.__name__)
-		self.add_stream_to_xml_tree(self_xml)
-		return self_xml
+		return build_xml_tree(self)
 
-	def add_to_xml_tree(self, xml_elt):
-		self_xml = self.to_xml_elt()
-		xml_elt.append(self_xml)
+	def new_xml_elt(self, parent):
+		return _new_xml_elt(parent, self.__class__.__name__)
 
 	@classmethod
 	def from_xml_elt(cls, xml_elt):
 		return cls()
 
-	def to_tex(self, kavlar_config):
-		# Header and footer handled by caller.
-		# As such, no required formatting for Torah elements.
-		kc = kavlar_config
-		l = self.get_stream_tex(kc)
-		return ''.join(l)
-
 
 class Sefer(Stream):
 	"""Which of the books, e.g. Genesis, Exodus etc."""
+	__slots__ = ('name', 'sefer_idx', 'sefer_id')
+
 	def __init__(self, name, sefer_idx, sefer_id):
 		"""Initialize.
 
@@ -110,12 +170,15 @@ class Sefer(Stream):
 	def append_to_stream(self, elt):
 		self.stream.append(elt)
 
-	def add_to_xml_tree(self, xml_elt):
-		self_xml = etree.Element(
-			self.__class__.__name__,
-			id=self.sefer_id, index=str(self.sefer_idx), name=self.name)
-		self.add_stream_to_xml_tree(self_xml)
-		xml_elt.append(self_xml)
+	def xml_attributes(self):
+		"""The attributes of the Sefer XML element, in order."""
+		return collections.OrderedDict([
+			('id', self.sefer_id), ('index', str(self.sefer_idx)),
+			('name', self.name)])
+
+	def new_xml_elt(self, parent):
+		return _new_xml_elt(
+			parent, self.__class__.__name__, self.xml_attributes())
 
 	@classmethod
 	def from_xml_elt(cls, xml_elt):
@@ -125,17 +188,14 @@ class Sefer(Stream):
 		sefer_name = attributes["name"]
 		return cls(sefer_name, sefer_idx, sefer_id)
 
-	def to_tex(self, kavlar_config):
-		kc = kavlar_config
-		tex = r"\section{%s}" % self.name + "\n"
-
-		l = [tex]
-		l.extend(self.get_stream_tex(kc))
-		return ''.join(l)
+	def tex_header(self, kavlar_config):
+		return r"\section{%s}" % self.name + "\n"
 
 
 class Perek(Stream):
 	"""A chapter marker. Contains text fragments and various markers."""
+	__slots__ = ('perek', 'perek_idx', 'perek_id')
+
 	def __init__(self, perek, perek_idx, perek_id):
 		"""Initialize.
 
@@ -155,12 +215,10 @@ class Perek(Stream):
 	def __str__(self):
 		return self.perek
 
-	def add_to_xml_tree(self, xml_elt):
-		self_xml = etree.Element(
-			self.__class__.__name__,
-			id=self.perek_id, index=str(self.perek_idx), perek=self.perek)
-		self.add_stream_to_xml_tree(self_xml)
-		xml_elt.append(self_xml)
+	def new_xml_elt(self, parent):
+		return _new_xml_elt(parent, self.__class__.__name__, {
+			'id': self.perek_id, 'index': str(self.perek_idx),
+			'perek': self.perek})
 
 	@classmethod
 	def from_xml_elt(cls, xml_elt):
@@ -170,15 +228,11 @@ class Perek(Stream):
 		perek = attributes["perek"]
 		return cls(perek, perek_idx, perek_id)
 
-	def to_tex(self, kavlar_config):
-		# For now the perek is silent.
-		kc = kavlar_config
-		l = self.get_stream_tex(kc)
-		return ''.join(l)
-
 
 class PasukStart(XmlAble, TeXAble):
 	"""Demarcates the start of a new verse."""
+	__slots__ = ('pasuk', 'pasuk_idx', 'pasuk_id')
+
 	def __init__(self, pasuk, pasuk_idx, pasuk_id):
 		"""Initialize.
 
@@ -197,11 +251,10 @@ class PasukStart(XmlAble, TeXAble):
 	def __str__(self):
 		return self.perek
 
-	def add_to_xml_tree(self, xml_elt):
-		self_xml = etree.Element(
-			self.__class__.__name__,
-			id=self.pasuk_id, index=str(self.pasuk_idx), pasuk=self.pasuk)
-		xml_elt.append(self_xml)
+	def new_xml_elt(self, parent):
+		return _new_xml_elt(parent, self.__class__.__name__, {
+			'id': self.pasuk_id, 'index': str(self.pasuk_idx),
+			'pasuk': self.pasuk})
 
 	@classmethod
 	def from_xml_elt(cls, xml_elt):
@@ -211,13 +264,15 @@ class PasukStart(XmlAble, TeXAble):
 		pasuk = attributes["pasuk"]
 		return cls(pasuk, pasuk_idx, pasuk_id)
 
-	def to_tex(self, kavlar_config):
+	def to_tex(self, kavlar_config, normalizer=None):
 		# For now the pasuk start is just whitespace.
 		return '\n'
 
 
 class PasukFragment(Stream):
 
+	__slots__ = ('pasuk_id',)
+
 	def __init__(self, pasuk_id):
 		"""A fragment of a verse.
 
@@ -232,11 +287,9 @@ class PasukFragment(Stream):
 		self.pasuk_id = pasuk_id
 		self.stream = []
 
-	def add_to_xml_tree(self, xml_elt):
-		self_xml = etree.Element(
-			self.__class__.__name__, pasuk_id=self.pasuk_id)
-		self.add_stream_to_xml_tree(self_xml)
-		xml_elt.append(self_xml)
+	def new_xml_elt(self, parent):
+		return _new_xml_elt(
+			parent, self.__class__.__name__, {'pasuk_id': self.pasuk_id})
 
 	@classmethod
 	def from_xml_elt(cls, xml_elt):
@@ -244,16 +297,12 @@ class PasukFragment(Stream):
 		pasuk_id = attributes["pasuk_id"]
 		return cls(pasuk_id)
 
-	def to_tex(self, kavlar_config):
-		# For now the pasuk is silent.
-		kc = kavlar_config
-		l = self.get_stream_tex(kc)
-		return ''.join(l)
-
 
 class TextFragment(XmlAble, TeXAble):
 	"""A fragment of text contained within a sefer."""
 
+	__slots__ = ('text',)
+
 	def __init__(self, text):
 		"""A fragment of a verse.
 
@@ -273,21 +322,25 @@ class TextFragment(XmlAble, TeXAble):
 	def __str__(self):
 		return self.text
 
-	def add_to_xml_tree(self, xml_elt):
-		self_xml = etree.Element(self.__class__.__name__)
+	def new_xml_elt(self, parent):
+		self_xml = _new_xml_elt(parent, self.__class__.__name__)
 		self_xml.text = self.text
-		xml_elt.append(self_xml)
+		return self_xml
 
 	@classmethod
 	def from_xml_elt(cls, xml_elt):
 		text = xml_elt.text
 		return cls(text)
 
-	def to_tex(self, kavlar_config):
-		return self.text
+	def to_tex(self, kavlar_config, normalizer=None):
+		if normalizer is None:
+			normalizer = normalize.TextNormalizer.from_config(kavlar_config)
+		return normalizer.normalize(self.text)
 
 
 class FormattedText(TextFragment):
+	__slots__ = ('kind',)
+
 	BIG = -1
 	SMALL = -2
 
@@ -306,10 +359,10 @@ class FormattedText(TextFragment):
 	def xml_name(self):
 		return self.CODE_NAMES[self.kind]
 
-	def add_to_xml_tree(self, xml_elt):
-		self_xml = etree.Element(self.xml_name)
+	def new_xml_elt(self, parent):
+		self_xml = _new_xml_elt(parent, self.xml_name)
 		self_xml.text = self.text
-		xml_elt.append(self_xml)
+		return self_xml
 
 	@classmethod
 	def from_xml_elt(cls, xml_elt):
@@ -325,16 +378,19 @@ class FormattedText(TextFragment):
 			return TextFragment(text)
 		return cls(text, kind)
 
-	def to_tex(self, kavlar_config):
+	def to_tex(self, kavlar_config, normalizer=None):
 		fmt = r'%s'
 		if self.kind == self.BIG:
 			fmt = r'{\Large %s}'
 		elif self.kind == self.SMALL:
 			fmt = r'{\Small %s}'
-		return fmt % self.text
+		return fmt % super(FormattedText, self).to_tex(
+			kavlar_config, normalizer)
 
 
 class ParashaDelimiter(XmlAble, TeXAble):
+	__slots__ = ('kind',)
+
 	PETUHA = -1
 	SETUMA = -2
 	BOOK_END = -3
@@ -369,9 +425,8 @@ class ParashaDelimiter(XmlAble, TeXAble):
 	def xml_name(self):
 		return self.CODE_NAMES[self.kind]
 
-	def add_to_xml_tree(self, xml_elt):
-		self_xml = etree.Element(self.xml_name)
-		xml_elt.append(self_xml)
+	def new_xml_elt(self, parent):
+		return _new_xml_elt(parent, self.xml_name)
 
 	@classmethod
 	def from_xml_elt(cls, xml_elt):
@@ -379,5 +434,132 @@ class ParashaDelimiter(XmlAble, TeXAble):
 		kind = cls.NAME_CODES[tag]
 		return cls(kind)
 
-	def to_tex(self, kavlar_config):
+	def to_tex(self, kavlar_config, normalizer=None):
 		return r'\\' + "\n"
+
+
+def _new_xml_elt(parent, tag, attrib=None):
+	"""A new XML element, appended to parent unless it is None."""
+	if parent is None:
+		return etree.Element(tag, attrib)
+	return etree.SubElement(parent, tag, attrib)
+
+
+# Kinds of ModelEvents.
+ENTER = 0
+LEAVE = 1
+LEAF = 2
+
+class ModelEvents(object):
+	"""Depth-first traversal of a model hierarchy as a flat event stream.
+
+	Iterating yields an ENTER event for each Stream, then the events of
+	its children, then a LEAVE event. Any other element, e.g. a
+	TextFragment, PasukStart or ParashaDelimiter, is a single LEAF
+	event. Events are tuples (kind, elt, sefer, perek, pasuk), where
+	sefer and perek are the Sefer and Perek containing elt, or elt
+	itself, and pasuk is the last PasukStart of the Perek up to elt;
+	each is None outside the traversal. The traversal keeps its own
+	stack instead of recursing.
+	"""
+
+	__slots__ = ('root', '_events', '_skip')
+
+	def __init__(self, root):
+		"""Initialize.
+
+		Args:
+			root: the element to traverse, e.g. a Torah or a Perek.
+		"""
+		self.root = root
+		self._skip = False
+		self._events = self._iter_events()
+
+	def __iter__(self):
+		# Loops run the generator directly.
+		return self._events
+
+	def __next__(self):
+		return next(self._events)
+
+	def skip(self):
+		"""Skips the children of the element just entered.
+
+		The next event is the one leaving it.
+		"""
+		self._skip = True
+
+	def _iter_events(self):
+		sefer = perek = pasuk = None
+		# Entries are (iterator of the siblings, parent) of each element
+		# entered.
+		stack = []
+		siblings = iter((self.root,))
+		while True:
+			for elt in siblings:
+				if not isinstance(elt, Stream):
+					if type(elt) is PasukStart:
+						pasuk = elt
+					yield LEAF, elt, sefer, perek, pasuk
+					continue
+
+				t = type(elt)
+				if t is Sefer:
+					sefer, perek, pasuk = elt, None, None
+				elif t is Perek:
+					perek, pasuk = elt, None
+				yield ENTER, elt, sefer, perek, pasuk
+				if not self._skip:
+					stack.append((siblings, elt))
+					siblings = iter(elt.stream)
+					break
+				self._skip = False
+				yield LEAVE, elt, sefer, perek, pasuk
+				if t is Perek:
+					perek = pasuk = None
+				elif t is Sefer:
+					sefer = perek = pasuk = None
+			else:
+				if not stack:
+					return
+				siblings, elt = stack.pop()
+				yield LEAVE, elt, sefer, perek, pasuk
+				t = type(elt)
+				if t is Perek:
+					perek = pasuk = None
+				elif t is Sefer:
+					sefer = perek = pasuk = None
+
+
+def build_xml_tree(root, xml_elt=None):
+	"""Builds the XML of a model hierarchy.
+
+	The hierarchy is walked in the order of ModelEvents with an explicit
+	stack, but without an event per element: this is the hot path of
+	writing the XML of a whole Torah.
+
+	Args:
+		root: the element whose XML to build, e.g. a Torah or a Perek.
+		xml_elt: the XML element to append it to, or None.
+
+	Returns:
+		The XML element of root.
+	"""
+	first = root.new_xml_elt(xml_elt)
+	if not isinstance(root, Stream):
+		return first
+	# Entries are (iterator of the siblings, XML parent) of each element
+	# entered.
+	stack = []
+	siblings, parent = iter(root.stream), first
+	while True:
+		for elt in siblings:
+			child = elt.new_xml_elt(parent)
+			if isinstance(elt, Stream):
+				stack.append((siblings, parent))
+				siblings, parent = iter(elt.stream), child
+				break
+		else:
+			if not stack:
+				return first
+			siblings, parent = stack.pop()
@@ -0,0 +1,325 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Compact columnar storage of a torah model.
+
+A TorahStore holds the nodes of a model hierarchy in preorder, one entry
+per node in each of a few typed arrays, with all text interned in a
+single table of strings. A node is identified by its position. The
+descendants of node i are the nodes i + 1 up to ends[i], so whole-tree
+traversals are flat loops over the arrays rather than walks over
+objects. The torah_model classes can be rebuilt from any node.
+"""
+
+import array
+import collections.abc
+
+from lxml import etree
+from parse_xml_torah import open_xml_filename
+from torah_model import ENTER, LEAVE, ModelEvents
+from torah_model import FormattedText, ParashaDelimiter
+from torah_model import PasukStart, PasukFragment
+from torah_model import Perek, Sefer, Torah, TextFragment
+
+
+# Node kinds.
+TORAH = 0
+SEFER = 1
+PEREK = 2
+PASUK_START = 3
+PASUK_FRAGMENT = 4
+TEXT = 5
+BIG = 6
+SMALL = 7
+PETUHA = 8
+SETUMA = 9
+SEFER_END = 10
+SHIRAH_LINE_BREAK = 11
+
+FORMATTED_KINDS = {
+	FormattedText.BIG: BIG,
+	FormattedText.SMALL: SMALL
+}
+DELIMITER_KINDS = {
+	ParashaDelimiter.PETUHA: PETUHA,
+	ParashaDelimiter.SETUMA: SETUMA,
+	ParashaDelimiter.BOOK_END: SEFER_END,
+	ParashaDelimiter.SHIRAH_LINE_BREAK: SHIRAH_LINE_BREAK
+}
+FORMATTED_CODES = dict((v, k) for k, v in FORMATTED_KINDS.items())
+DELIMITER_CODES = dict((v, k) for k, v in DELIMITER_KINDS.items())
+
+# Kinds of the nodes carrying text.
+TEXT_KINDS = frozenset([TEXT, BIG, SMALL])
+
+# Node kinds by XML tag of the intermediate format.
+XML_KINDS = {
+	'Torah': TORAH,
+	'Sefer': SEFER,
+	'Perek': PEREK,
+	'PasukStart': PASUK_START,
+	'PasukFragment': PASUK_FRAGMENT,
+	'TextFragment': TEXT
+}
+XML_KINDS.update(
+	(name, FORMATTED_KINDS[code])
+	for code, name in FormattedText.CODE_NAMES.items())
+XML_KINDS.update(
+	(name, DELIMITER_KINDS[code])
+	for code, name in ParashaDelimiter.CODE_NAMES.items())
+
+# Array type codes of the columns of a store.
+COLUMNS = (
+	('kinds', 'b'),
+	('parents', 'i'),
+	('ends', 'i'),
+	('indices', 'i'),
+	('labels', 'i'),
+	('idents', 'i'))
+
+
+class EncodedStrings(collections.abc.Sequence):
+	"""A read-only string table, decoded from UTF-8 one string at a time.
+
+	Looking up a string decodes only that string, so a table in a mapped
+	file or in shared memory costs nothing to open.
+	"""
+
+	def __init__(self, data, offsets):
+		"""Initialize.
+
+		Args:
+			data: bytes-like object of the encoded strings, concatenated.
+			offsets: sequence of the byte offset of each string in data,
+				followed by the length of data.
+		"""
+		self.data = data
+		self.offsets = offsets
+
+	def __len__(self):
+		return len(self.offsets) - 1
+
+	def __getitem__(self, i):
+		if isinstance(i, slice):
+			return [self[j] for j in range(*i.indices(len(self)))]
+		if i < 0:
+			i += len(self)
+		if not 0 <= i < len(self):
+			raise IndexError('string id out of range')
+		offsets = self.offsets
+		return str(self.data[offsets[i]:offsets[i + 1]], 'utf-8')
+
+
+class TorahStore(object):
+	"""The nodes of a torah model in typed arrays.
+
+	Per node, in preorder:
+		kinds: the node kind, one of the constants above.
+		parents: index of the parent node, -1 for the root.
+		ends: index one past the last descendant.
+		indices: sefer_idx, perek_idx or pasuk_idx, else -1.
+		labels: string id of the sefer name, perek or pasuk letter or
+			text, else -1.
+		idents: string id of the sefer, perek or pasuk id, else -1.
+	"""
+
+	def __init__(self, kinds=None, parents=None, ends=None, indices=None,
+				 labels=None, idents=None, strings=None):
+		self.kinds = kinds if kinds is not None else array.array('b')
+		self.parents = parents if parents is not None else array.array('i')
+		self.ends = ends if ends is not None else array.array('i')
+		self.indices = indices if indices is not None else array.array('i')
+		self.labels = labels if labels is not None else array.array('i')
+		self.idents = idents if idents is not None else array.array('i')
+		self.strings = strings if strings is not None else []
+		self._string_ids = None
+
+	def __len__(self):
+		return len(self.kinds)
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		# Rebuilt on demand by intern().
+		state['_string_ids'] = None
+		return state
+
+	@property
+	def nbytes(self):
+		"""Bytes held by the arrays and the string table."""
+		n = sum(
+			getattr(self, name).itemsize * len(getattr(self, name))
+			for name, _ in COLUMNS)
+		return n + sum(len(s.encode('utf-8')) for s in self.strings)
+
+	def intern(self, s):
+		"""Returns the string id of s, adding it to the table if new."""
+		if s is None:
+			return -1
+		if self._string_ids is None:
+			self._string_ids = dict(
+				(t, i) for i, t in enumerate(self.strings))
+		string_id = self._string_ids.get(s)
+		if string_id is None:
+			string_id = len(self.strings)
+			self.strings.append(s)
+			self._string_ids[s] = string_id
+		return string_id
+
+	def string(self, string_id):
+		if string_id < 0:
+			return None
+		return self.strings[string_id]
+
+	def add_node(self, kind, parent, index=-1, label=None, ident=None):
+		"""Appends a node, whose end is set to the next node.
+
+		Returns:
+			The index of the new node.
+		"""
+		i = len(self.kinds)
+		self.kinds.append(kind)
+		self.parents.append(parent)
+		self.ends.append(i + 1)
+		self.indices.append(index)
+		self.labels.append(self.intern(label))
+		self.idents.append(self.intern(ident))
+		return i
+
+	def close_node(self, i):
+		"""Marks the nodes added since node i as its descendants."""
+		self.ends[i] = len(self.kinds)
+
+	@classmethod
+	def from_model(cls, root):
+		"""Stores a model hierarchy, e.g. a Torah."""
+		store = cls()
+		open_nodes = [-1]
+		for kind, elt, _, _, _ in ModelEvents(root):
+			if kind == LEAVE:
+				store.close_node(open_nodes.pop())
+				continue
+			i = store._add_model_node(elt, open_nodes[-1])
+			if kind == ENTER:
+				open_nodes.append(i)
+		return store
+
+	def _add_model_node(self, elt, parent):
+		t = type(elt)
+		if t == TextFragment:
+			return self.add_node(TEXT, parent, label=elt.text)
+		if t == FormattedText:
+			return self.add_node(
+				FORMATTED_KINDS[elt.kind], parent, label=elt.text)
+		if t == ParashaDelimiter:
+			return self.add_node(DELIMITER_KINDS[elt.kind], parent)
+		if t == PasukStart:
+			return self.add_node(
+				PASUK_START, parent, elt.pasuk_idx, elt.pasuk, elt.pasuk_id)
+		if t == PasukFragment:
+			return self.add_node(
+				PASUK_FRAGMENT, parent, ident=elt.pasuk_id)
+		if t == Perek:
+			return self.add_node(
+				PEREK, parent, elt.perek_idx, elt.perek, elt.perek_id)
+		if t == Sefer:
+			return self.add_node(
+				SEFER, parent, elt.sefer_idx, elt.name, elt.sefer_id)
+		if t == Torah:
+			return self.add_node(TORAH, parent)
+		raise TypeError('Cannot store %s' % t.__name__)
+
+	@classmethod
+	def from_xml_filename(cls, fname):
+		with open_xml_filename(fname) as f:
+			return cls.from_xml_file(f)
+
+	@classmethod
+	def from_xml_file(cls, f):
+		"""Stores an intermediate XML file without building the model."""
+		store = cls()
+		open_nodes = [-1]
+		for event, xml_elt in etree.iterparse(f, events=('start', 'end')):
+			if event == 'start':
+				kind = XML_KINDS[xml_elt.tag]
+				attributes = xml_elt.attrib
+				index = attributes.get('index')
+				label = (
+					attributes.get('name') or attributes.get('perek') or
+					attributes.get('pasuk'))
+				ident = attributes.get('id') or attributes.get('pasuk_id')
+				open_nodes.append(store.add_node(
+					kind, open_nodes[-1],
+					int(index) if index is not None else -1, label, ident))
+				continue
+
+			i = open_nodes.pop()
+			if store.kinds[i] in TEXT_KINDS:
+				store.labels[i] = store.intern(xml_elt.text)
+			store.close_node(i)
+			xml_elt.clear()
+			parent = xml_elt.getparent()
+			if parent is not None:
+				while xml_elt.getprevious() is not None:
+					del parent[0]
+		return store
+
+	def children(self, i):
+		"""Yields the indices of the children of node i."""
+		ends = self.ends
+		j = i + 1
+		end = ends[i]
+		while j < end:
+			yield j
+			j = ends[j]
+
+	def find(self, kind, start=0, end=None):
+		"""Yields the indices of the nodes of a kind among start..end."""
+		kinds = self.kinds
+		if end is None:
+			end = len(kinds)
+		for i in range(start, end):
+			if kinds[i] == kind:
+				yield i
+
+	def text(self, i):
+		"""The text of node i and its descendants."""
+		labels = self.labels
+		strings = self.strings
+		kinds = self.kinds
+		return u''.join(
+			strings[labels[j]] for j in range(i, self.ends[i])
+			if kinds[j] in TEXT_KINDS and labels[j] >= 0)
+
+	def to_model(self, i=0):
+		"""Rebuilds the torah_model hierarchy rooted at node i."""
+		root = self._make_model_node(i)
+		open_elts = [(self.ends[i], root)]
+		for j in range(i + 1, self.ends[i]):
+			while open_elts[-1][0] <= j:
+				open_elts.pop()
+			elt = self._make_model_node(j)
+			open_elts[-1][1].append_to_stream(elt)
+			if self.ends[j] > j + 1:
+				open_elts.append((self.ends[j], elt))
+		return root
+
+	def _make_model_node(self, i):
+		kind = self.kinds[i]
+		label = self.string(self.labels[i])
+		if kind == TEXT:
+			return TextFragment(label)
+		if kind in FORMATTED_CODES:
+			return FormattedText(label, FORMATTED_CODES[kind])
+		if kind in DELIMITER_CODES:
+			return ParashaDelimiter(DELIMITER_CODES[kind])
+		ident = self.string(self.idents[i])
+		index = self.indices[i]
+		if kind == PASUK_START:
+			return PasukStart(label, index, ident)
+		if kind == PASUK_FRAGMENT:
+			return PasukFragment(ident)
+		if kind == PEREK:
+			return Perek(label, index, ident)
+		if kind == SEFER:
+			return Sefer(label, index, ident)
+		return Torah()
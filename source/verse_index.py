@@ -0,0 +1,138 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Random-access index of the verses of a torah model.
+
+A VerseIndex is built with one pass over a Torah. It numbers the pesukim
+in order, giving each a position in a flat verse sequence, and maps both
+(sefer_idx, perek_idx, pasuk_idx) tuples and pasuk_id strings to these
+positions, and (sefer_idx, perek_idx) tuples and perek_id strings to
+perakim. Ranges of verses are then slices of the sequence.
+
+Indices are zero-based, as in the ids: Exodus 15:1-21 in torah.xml is
+index.range((1, 14, 0), (1, 14, 20)).
+"""
+
+import collections
+import torah_model
+
+
+# A pasuk of the index. fragments lists its PasukFragments in order.
+Verse = collections.namedtuple('Verse', [
+	'position', 'sefer_idx', 'perek_idx', 'pasuk_idx', 'pasuk_id',
+	'sefer', 'perek', 'start', 'fragments'])
+
+# A perek of the index, holding the verses first..end - 1.
+PerekEntry = collections.namedtuple('PerekEntry', [
+	'sefer_idx', 'perek_idx', 'perek_id', 'sefer', 'perek', 'first', 'end'])
+
+
+class VerseIndex(object):
+	"""Maps verse and perek keys to nodes and flat positions."""
+
+	def __init__(self, torah):
+		"""Indexes a Torah model.
+
+		Raises:
+			ValueError: if a pasuk_id, perek_id or index tuple repeats.
+		"""
+		self.verses = []
+		self.perakim = []
+		self.sefarim = []
+		self._positions = {}
+		self._perek_positions = {}
+		self._sefer_idx_by_name = {}
+		for sefer in torah.iter_stream:
+			self._add_sefer(sefer)
+
+	def _add_sefer(self, sefer):
+		self.sefarim.append(sefer)
+		self._sefer_idx_by_name.setdefault(sefer.name, sefer.sefer_idx)
+		sefer_idx = sefer.sefer_idx
+		for perek in sefer.iter_stream:
+			entry_idx = len(self.perakim)
+			first = len(self.verses)
+			current = None
+			for elt in perek.iter_stream:
+				t = type(elt)
+				if t == torah_model.PasukStart:
+					current = self._add_verse(Verse(
+						len(self.verses), sefer_idx, perek.perek_idx,
+						elt.pasuk_idx, elt.pasuk_id, sefer, perek, elt, []))
+				elif t == torah_model.PasukFragment:
+					if current is None or current.pasuk_id != elt.pasuk_id:
+						# A fragment continuing a verse of a previous perek.
+						current = self.verses[self.position(elt.pasuk_id)]
+					current.fragments.append(elt)
+			entry = PerekEntry(
+				sefer_idx, perek.perek_idx, perek.perek_id, sefer, perek,
+				first, len(self.verses))
+			self.perakim.append(entry)
+			self._add_key(
+				self._perek_positions, (sefer_idx, perek.perek_idx),
+				entry_idx)
+			self._add_key(self._perek_positions, perek.perek_id, entry_idx)
+
+	def _add_verse(self, verse):
+		self.verses.append(verse)
+		self._add_key(
+			self._positions,
+			(verse.sefer_idx, verse.perek_idx, verse.pasuk_idx),
+			verse.position)
+		self._add_key(self._positions, verse.pasuk_id, verse.position)
+		return verse
+
+	@staticmethod
+	def _add_key(positions, key, position):
+		if key in positions:
+			raise ValueError('Duplicate key %r in the Torah' % (key,))
+		positions[key] = position
+
+	def __len__(self):
+		return len(self.verses)
+
+	def __getitem__(self, key):
+		return self.verses[self.position(key)]
+
+	def __contains__(self, key):
+		return key in self._positions
+
+	def position(self, key):
+		"""Position of a verse in the flat sequence.
+
+		Args:
+			key: a pasuk_id, or a (sefer_idx, perek_idx, pasuk_idx)
+				tuple.
+
+		Raises:
+			KeyError: if there is no such verse.
+		"""
+		return self._positions[key]
+
+	def find(self, key):
+		"""The Verse for key, or None."""
+		position = self._positions.get(key)
+		if position is None:
+			return None
+		return self.verses[position]
+
+	def sefer_idx(self, name):
+		"""The sefer_idx of the sefer called name, or None."""
+		return self._sefer_idx_by_name.get(name)
+
+	def perek(self, key):
+		"""The PerekEntry for a perek_id or (sefer_idx, perek_idx)."""
+		return self.perakim[self._perek_positions[key]]
+
+	def range(self, first, last):
+		"""The Verses from first to last, inclusive.
+
+		Args:
+			first, last: keys as accepted by position().
+		"""
+		return self.verses[self.position(first):self.position(last) + 1]
+
+	def perek_verses(self, key):
+		"""The Verses of a perek, by perek_id or (sefer_idx, perek_idx)."""
+		entry = self.perek(key)
+		return self.verses[entry.first:entry.end]
@@ -0,0 +1,252 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Search for the line width which lays out into a target column count.
+
+The number of columns falls as the lines get wider. LineWidthSearch
+finds the range of line widths, on a grid of a given resolution, for
+which the layout has the target number of columns, by bisection from a
+bracket estimated from the natural widths of the paragraphs. Within that
+range it returns the width whose layout has the fewest total demerits.
+Layouts are evaluated by a sweep.ConfigSweep, so the model is parsed and
+measured once and no width is laid out twice. Run from the source
+directory, e.g. for the 247 columns of 42 lines of Davidovich's tikkun:
+
+	python width_search.py -n 247 -l 42
+"""
+
+import argparse
+import collections
+import layout
+import math
+import sys
+
+from kavlar import KavlarConfig
+from sweep import ConfigSweep
+
+
+# The best width found. n_layouts is the number of layouts the search
+# evaluated.
+WidthSearchResult = collections.namedtuple('WidthSearchResult', [
+	'line_width', 'aspect_ratio', 'stats', 'n_layouts'])
+
+
+def estimate_lines(engine, paragraphs, line_width):
+	"""Estimates the number of lines of a layout from natural widths.
+
+	Each paragraph is taken to fill its lines at natural width, which is
+	only a guess but costs no line breaking.
+	"""
+	params = engine.params
+	n_lines = 0
+	last = len(paragraphs) - 1
+	for i, paragraph in enumerate(paragraphs):
+		if paragraph.words:
+			natural = (
+				sum(word.width for word in paragraph.words) +
+				params.space_width * (len(paragraph.words) - 1))
+			n_lines += max(1, int(math.ceil(natural / line_width)))
+		n_lines += engine.n_blank_lines_after(paragraph, i == last)
+	return n_lines
+
+
+class LineWidthSearch(object):
+	"""Finds the line width laying out a Torah into a column count."""
+
+	def __init__(self, config_sweep, base_config, resolution=0.05,
+				 n_samples=5):
+		"""Initialize.
+
+		Args:
+			config_sweep: the sweep.ConfigSweep of the Torah.
+			base_config: the KavlarConfig of all the other options.
+			resolution: spacing in letters of the line widths tried.
+			n_samples: number of widths compared for demerits within the
+				range hitting the target.
+		"""
+		self.config_sweep = config_sweep
+		self.base_config = base_config
+		self.resolution = resolution
+		self.n_samples = n_samples
+		self.lines_per_col = base_config.getint(
+			'formatting', 'lines_per_col')
+		self.line_height = base_config.getfloat('layout', 'line_height')
+		# LayoutStats by grid step.
+		self._probes = {}
+
+	def aspect_ratio(self, step):
+		"""The aspect_ratio giving lines of step * resolution letters."""
+		return self.lines_per_col * self.line_height / (
+			step * self.resolution)
+
+	def config_for(self, step):
+		config = KavlarConfig.copy_config(self.base_config)
+		config.set(
+			'formatting', 'aspect_ratio', repr(self.aspect_ratio(step)))
+		return config
+
+	def evaluate(self, steps):
+		"""Returns the LayoutStats of grid steps, laying out new ones."""
+		new_steps = sorted(set(s for s in steps if s not in self._probes))
+		if new_steps:
+			stats = self.config_sweep.evaluate(
+				[self.config_for(s) for s in new_steps])
+			self._probes.update(zip(new_steps, stats))
+		return [self._probes[s] for s in steps]
+
+	def n_columns(self, step):
+		return self.evaluate([step])[0].n_columns
+
+	def estimate_step(self, n_columns):
+		"""Grid step whose estimated layout has n_columns columns.
+
+		Raises:
+			ValueError: if even infinitely long lines need more columns.
+		"""
+		paragraphs = self.config_sweep.paragraphs_for(self.base_config)
+		engine = layout.LayoutEngine(
+			layout.LayoutParams.from_config(self.base_config))
+		target_lines = n_columns * self.lines_per_col
+		if estimate_lines(engine, paragraphs, float('inf')) > target_lines:
+			raise ValueError(
+				'Cannot lay out into as few as %d columns' % n_columns)
+		lo, hi = 1.0, 1.0
+		while estimate_lines(engine, paragraphs, hi) > target_lines:
+			lo, hi = hi, hi * 2
+		for _ in range(50):
+			mid = (lo + hi) / 2
+			if estimate_lines(engine, paragraphs, mid) > target_lines:
+				lo = mid
+			else:
+				hi = mid
+		return max(1, int(round(hi / self.resolution)))
+
+	def _bracket(self, n_columns, step):
+		"""Grid steps lo < hi with more and fewer than n_columns.
+
+		The bracket grows from around step, which should be close. Lines
+		are kept wider than the widest word.
+		"""
+		paragraphs = self.config_sweep.paragraphs_for(self.base_config)
+		min_step = 1 + int(max(
+			word.width for p in paragraphs for word in p.words) /
+			self.resolution)
+		width = max(1, step // 200)
+		lo, hi = max(min_step, step - width), step + width
+		while self.n_columns(lo) <= n_columns:
+			if lo == min_step:
+				raise ValueError(
+					'Cannot lay out into as many as %d columns' % n_columns)
+			lo, width = max(min_step, lo - width), width * 2
+		width = max(1, step // 200)
+		while self.n_columns(hi) >= n_columns:
+			hi, width = hi + width, width * 2
+		return lo, hi
+
+	def _first_step(self, lo, hi, pred):
+		"""The first step in lo..hi where pred holds, given it holds at hi.
+
+		pred must be false before and true after some step. Known probes
+		narrow the bisection.
+		"""
+		for step, stats in self._probes.items():
+			if lo < step < hi:
+				if pred(stats.n_columns):
+					hi = step
+				else:
+					lo = step
+		while hi - lo > 1:
+			mid = (lo + hi) // 2
+			if pred(self.n_columns(mid)):
+				hi = mid
+			else:
+				lo = mid
+		return hi
+
+	def search(self, n_columns):
+		"""Returns the WidthSearchResult of the best width for n_columns.
+
+		Raises:
+			ValueError: if no width on the grid gives n_columns columns.
+		"""
+		n_before = len(self._probes)
+		lo, hi = self._bracket(n_columns, self.estimate_step(n_columns))
+		first = self._first_step(lo, hi, lambda n: n <= n_columns)
+		if self.n_columns(first) != n_columns:
+			raise ValueError(
+				'No line width gives %d columns: %d columns at %.2f letters, '
+				'%d at %.2f' % (
+					n_columns, self.n_columns(first - 1),
+					(first - 1) * self.resolution, self.n_columns(first),
+					first * self.resolution))
+		last = self._first_step(first, hi, lambda n: n < n_columns) - 1
+
+		n = min(self.n_samples, last - first + 1)
+		if n > 1:
+			steps = sorted(set(
+				first + int(round(i * (last - first) / float(n - 1)))
+				for i in range(n)))
+		else:
+			steps = [first]
+		stats = self.evaluate(steps)
+		best_step, best_stats = min(
+			((s, t) for s, t in zip(steps, stats)
+			 if t.n_columns == n_columns),
+			key=lambda pair: pair[1].total_demerits)
+		return WidthSearchResult(
+			best_step * self.resolution, self.aspect_ratio(best_step),
+			best_stats, len(self._probes) - n_before)
+
+
+def main():
+	parser = argparse.ArgumentParser(
+		description='Finds the line width giving a number of columns. '
+		'Requires NumPy.')
+	parser.add_argument(
+		'-n', '--n_columns', type=int, required=True,
+		help='Target number of columns.')
+	parser.add_argument(
+		'-l', '--lines_per_col', type=int, default=None,
+		help='Lines per column; defaults to the config.')
+	parser.add_argument(
+		'-x', '--xml_filename', default='../data/xml_torah/torah.xml',
+		help='Intermediate XML file of the Torah.')
+	parser.add_argument(
+		'-c', '--config_filename', default=None,
+		help='Config file of the other options.')
+	parser.add_argument(
+		'-r', '--resolution', type=float, default=0.05,
+		help='Spacing in letters of the line widths tried.')
+	parser.add_argument(
+		'-j', '--jobs', type=int, default=1,
+		help='Number of processes breaking lines; 0 for one per CPU.')
+	args = parser.parse_args()
+
+	if args.config_filename:
+		config = KavlarConfig.read_config(args.config_filename)
+	else:
+		config = KavlarConfig.default_config()
+	if args.lines_per_col:
+		config.set('formatting', 'lines_per_col', str(args.lines_per_col))
+
+	config_sweep = ConfigSweep.from_xml_filename(
+		args.xml_filename, args.jobs or None, config)
+	search = LineWidthSearch(config_sweep, config, args.resolution)
+	try:
+		result = search.search(args.n_columns)
+	except ValueError as e:
+		print(e)
+		return 1
+	stats = result.stats
+	print('line_width = %.2f letters' % result.line_width)
+	print('aspect_ratio = %.4f' % result.aspect_ratio)
+	print('%d columns, %d lines, %d in the last column' % (
+		stats.n_columns, stats.n_lines, stats.last_column_lines))
+	print('total demerits %.0f, mean |ratio| %.3f' % (
+		stats.total_demerits, stats.mean_abs_ratio))
+	print('%d layouts evaluated' % result.n_layouts)
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,107 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Writes a torah model hierarchy to the XML intermediate format.
+
+The XML is written incrementally with etree.xmlfile: only the tree of a
+single Perek is built at a time, so the peak memory of writing does not
+grow with the size of the model. The output is the same as pretty
+printing Torah.to_xml_elt() with etree.tostring. Files may be compressed
+with gzip or xz, which XmlTorahParser reads back transparently.
+"""
+
+import gzip
+import lzma
+
+from lxml import etree
+from torah_model import Sefer, Torah, build_xml_tree
+
+
+XML_DECLARATION = b"<?xml version='1.0' encoding='utf-8'?>\n"
+INDENT = '  '
+
+
+class XmlTorahWriter(object):
+
+	# Compressions of the output.
+	GZIP = 'gzip'
+	XZ = 'xz'
+
+	# Compression by filename suffix.
+	SUFFIXES = {
+		'.gz': GZIP,
+		'.xz': XZ
+	}
+
+	@classmethod
+	def compression_for(cls, fname):
+		"""The compression implied by the suffix of fname, or None."""
+		for suffix, compression in cls.SUFFIXES.items():
+			if fname.endswith(suffix):
+				return compression
+		return None
+
+	@classmethod
+	def open_output(cls, fname, compression=None):
+		"""Opens fname for writing in binary mode, compressed if asked.
+
+		Args:
+			fname: path of the file.
+			compression: GZIP, XZ or None; defaults to the compression
+				implied by the suffix of fname.
+		"""
+		if compression is None:
+			compression = cls.compression_for(fname)
+		if compression == cls.GZIP:
+			return gzip.open(fname, 'wb')
+		if compression == cls.XZ:
+			return lzma.open(fname, 'wb')
+		if compression is not None:
+			raise ValueError('Unknown compression %r' % compression)
+		return open(fname, 'wb')
+
+	def write_filename(self, torah, fname, compression=None):
+		"""Writes a Torah, or an iterable of its Sefarim, to fname."""
+		with self.open_output(fname, compression) as f:
+			if isinstance(torah, Torah):
+				self.write(torah, f)
+			else:
+				self.write_sefarim(torah, f)
+
+	def write(self, torah, f):
+		"""Writes a Torah to f, opened in binary mode."""
+		self.write_sefarim(torah.iter_stream, f)
+
+	def write_sefarim(self, sefarim, f):
+		"""Writes a Torah of the Sefarim in an iterable to f.
+
+		The sefarim may be generated one at a time, e.g. as they are
+		parsed, and are not kept.
+		"""
+		f.write(XML_DECLARATION)
+		sefarim = iter(sefarim)
+		sefer = next(sefarim, None)
+		with etree.xmlfile(f, encoding='utf-8') as xf:
+			if sefer is None:
+				xf.write(etree.Element(Torah.__name__))
+			else:
+				with xf.element(Torah.__name__):
+					while sefer is not None:
+						xf.write('\n' + INDENT)
+						self._write_sefer(xf, sefer)
+						sefer = next(sefarim, None)
+					xf.write('\n')
+		f.write(b'\n')
+
+	def _write_sefer(self, xf, sefer):
+		if not sefer.stream:
+			xf.write(sefer.new_xml_elt(None))
+			return
+		with xf.element(Sefer.__name__, sefer.xml_attributes()):
+			for elt in sefer.iter_stream:
+				# The XML of one Perek at a time.
+				xml_elt = build_xml_tree(elt)
+				etree.indent(xml_elt, space=INDENT, level=2)
+				xf.write('\n' + INDENT * 2)
+				xf.write(xml_elt)
+			xf.write('\n' + INDENT)
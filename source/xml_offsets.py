@@ -0,0 +1,201 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Byte offsets of the Sefer and Perek elements of an intermediate XML file.
+
+An XmlOffsetIndex is found by scanning the raw bytes of the file for the
+Sefer and Perek tags, without parsing it, and is kept in a small JSON
+side file, next to the XML or in a cache directory. With it a range of
+perakim can be read and parsed on its own, e.g. to preview a single
+chapter.
+"""
+
+import hashlib
+import json
+import os
+import re
+
+from lxml import etree
+from parse_xml_torah import XmlTorahParser, is_compressed
+from torah_model import Sefer, Torah
+
+
+TAG_PATTERN = re.compile(rb'<(/?)(Sefer|Perek)\b([^>]*)>')
+ATTRIBUTE_PATTERN = re.compile(rb'([\w:]+)\s*=\s*"([^"]*)"')
+
+XML_ENTITIES = (
+	('&lt;', '<'), ('&gt;', '>'), ('&quot;', '"'), ('&apos;', "'"),
+	('&amp;', '&'))
+
+
+def _unescape(value):
+	for entity, char in XML_ENTITIES:
+		value = value.replace(entity, char)
+	return value
+
+
+def _attributes(data):
+	return dict(
+		(name.decode('utf-8'), _unescape(value.decode('utf-8')))
+		for name, value in ATTRIBUTE_PATTERN.findall(data))
+
+
+class XmlOffsetIndex(object):
+	"""The byte ranges of each Sefer and Perek of an XML file.
+
+	sefarim is a list of dicts with the attributes of each Sefer, its
+	[start, end) byte range, and the list of its perakim, which are dicts
+	of the attributes and byte range of each Perek.
+	"""
+
+	VERSION = 1
+	SUFFIX = '.offsets.json'
+
+	def __init__(self, sefarim, size=None, mtime_ns=None):
+		self.sefarim = sefarim
+		self.size = size
+		self.mtime_ns = mtime_ns
+
+	@classmethod
+	def scan(cls, fname):
+		"""Finds the offsets by scanning the bytes of the file.
+
+		Raises:
+			ValueError: if the file is compressed, and so has no useful
+				byte offsets.
+		"""
+		if is_compressed(fname):
+			raise ValueError('Cannot index compressed XML %s' % fname)
+		with open(fname, 'rb') as f:
+			data = f.read()
+		st = os.stat(fname)
+		sefarim = []
+		open_tags = []
+		for m in TAG_PATTERN.finditer(data):
+			closing, tag, rest = m.groups()
+			if closing:
+				entry = open_tags.pop()
+				entry['end'] = m.end()
+				continue
+			entry = _attributes(rest)
+			entry['start'] = m.start()
+			if tag == b'Sefer':
+				entry['perakim'] = []
+				sefarim.append(entry)
+			else:
+				sefarim[-1]['perakim'].append(entry)
+			if rest.rstrip().endswith(b'/'):
+				entry['end'] = m.end()
+			else:
+				open_tags.append(entry)
+		return cls(sefarim, st.st_size, st.st_mtime_ns)
+
+	@classmethod
+	def side_filename(cls, fname, cache_dir=None):
+		"""The path of the side file of fname.
+
+		Args:
+			fname: path of the XML file.
+			cache_dir: directory of side files, named by a hash of the
+				absolute path of their XML file. If None, the side file
+				is next to the XML file.
+		"""
+		if not cache_dir:
+			return fname + cls.SUFFIX
+		digest = hashlib.sha256(
+			os.path.abspath(fname).encode('utf-8')).hexdigest()
+		return os.path.join(cache_dir, digest + cls.SUFFIX)
+
+	@classmethod
+	def for_filename(cls, fname, cache_dir=None):
+		"""Returns the index of fname, from its side file if up to date.
+
+		The side file is written when missing or stale.
+
+		Args:
+			fname: path of the XML file.
+			cache_dir: as in side_filename.
+		"""
+		st = os.stat(fname)
+		side_fname = cls.side_filename(fname, cache_dir)
+		try:
+			with open(side_fname, 'r', encoding='utf-8') as f:
+				data = json.load(f)
+			if (data['version'] == cls.VERSION and
+					data['size'] == st.st_size and
+					data['mtime_ns'] == st.st_mtime_ns):
+				return cls(data['sefarim'], data['size'], data['mtime_ns'])
+		except (IOError, OSError, ValueError, KeyError):
+			pass
+		index = cls.scan(fname)
+		try:
+			if cache_dir and not os.path.isdir(cache_dir):
+				os.makedirs(cache_dir)
+			index.save(side_fname)
+		except (IOError, OSError):
+			# A read-only location only costs a scan per run.
+			pass
+		return index
+
+	def save(self, side_fname):
+		data = {
+			'version': self.VERSION,
+			'size': self.size,
+			'mtime_ns': self.mtime_ns,
+			'sefarim': self.sefarim
+		}
+		with open(side_fname, 'w', encoding='utf-8') as f:
+			json.dump(data, f, ensure_ascii=False)
+
+	def sefer(self, key):
+		"""The entry of a Sefer by index (int) or name."""
+		for entry in self.sefarim:
+			if isinstance(key, int):
+				if int(entry['index']) == key:
+					return entry
+			elif entry['name'] == key:
+				return entry
+		raise KeyError(key)
+
+	def parse_range(self, f, sefer_key, first_perek=0, last_perek=None):
+		"""Parses perakim first_perek..last_perek of a sefer from f.
+
+		Only the bytes of those perakim are read.
+
+		Args:
+			f: the XML file, opened in binary mode.
+			sefer_key: sefer index or name.
+			first_perek, last_perek: perek indices, inclusive. Defaults
+				to the last perek.
+
+		Returns:
+			A Torah holding a Sefer with just the requested perakim.
+		"""
+		entry = self.sefer(sefer_key)
+		perakim = entry['perakim']
+		if last_perek is None:
+			last_perek = len(perakim) - 1
+		selected = [
+			p for p in perakim
+			if first_perek <= int(p['index']) <= last_perek]
+		if not selected:
+			raise KeyError('No perakim %d-%d in %s' % (
+				first_perek, last_perek, entry['name']))
+
+		start = selected[0]['start']
+		f.seek(start)
+		data = f.read(selected[-1]['end'] - start)
+		xml_root = etree.fromstring(b'<Range>' + data + b'</Range>')
+
+		parser = XmlTorahParser()
+		sefer = Sefer(entry['name'], int(entry['index']), entry['id'])
+		for xml_elt in xml_root.iterchildren('Perek'):
+			sefer.append_to_stream(parser.parse_xml_elt(xml_elt))
+		torah = Torah()
+		torah.append_to_stream(sefer)
+		return torah
+
+	def parse_range_filename(self, fname, sefer_key, first_perek=0,
+							 last_perek=None):
+		with open(fname, 'rb') as f:
+			return self.parse_range(f, sefer_key, first_perek, last_perek)